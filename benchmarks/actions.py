@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measures the time spent by the actions and the helpers used by the data
+requests pages on a data base filled with synthetic data (see generator.py).
+The data base grows to every size in turn (1000, 10000 and 100000 data
+requests by default) and every operation is measured at every size:
+
+* datarequest_index with every combination of filters (organization, user,
+  state, visibility and text search), the other orders and pagination
+* datarequest_show
+* datarequest_comment_list
+* the data shown by the badge helpers (the rendering of their snippet is not
+  included, it requires the CKAN web application)
+
+Actions are called as the API calls them, with a new session per call, but
+without checking access. An in-memory SQLite data base is used by default.
+PostgreSQL data bases can be used with --db-url; they must not contain data
+requests (the CKAN tables are created when they do not exist).
+
+Usage: python benchmarks/actions.py [--db-url URL] [--sizes 1000,10000,100000] [--repeat N]
+                                    [--comments N] [--organizations N] [--users N] [--datasets N]
+'''
+
+import argparse
+import itertools
+import json
+import timeit
+
+import ckan.model as model
+
+from ckanext.datarequests import actions, cache, constants, db, helpers
+from generator import Generator, setup, TOPICS
+
+INDEX_FILTERS = ['organization_id', 'user_id', 'closed', 'visibility', 'q']
+
+
+def _context():
+    return {'model': model, 'session': model.Session, 'ignore_auth': True}
+
+
+def _measure(call, repeat, setup=None):
+    def new_session():
+        model.Session.remove()
+        if setup:
+            setup()
+
+    times = sorted(timeit.repeat(call, setup=new_session, number=1, repeat=repeat))
+    return {
+        'min_seconds': times[0],
+        'median_seconds': times[len(times) // 2]
+    }
+
+
+def index_cases(generator):
+    '''Yields the name and the parameters of every datarequest_index call that is measured'''
+    values = {
+        'organization_id': generator.organizations[0],
+        'user_id': generator.users[0],
+        'closed': False,
+        'visibility': constants.DataRequestState.visible.name,
+        'q': TOPICS[0]
+    }
+
+    for length in range(len(INDEX_FILTERS) + 1):
+        for combination in itertools.combinations(INDEX_FILTERS, length):
+            yield '+'.join(combination) or 'no_filters', dict((field, values[field]) for field in combination)
+
+    first_page = actions.datarequest_index(_context(), {})
+    yield 'q+sort_newest', {'q': values['q'], 'sort': constants.DATAREQUESTS_SORT_NEWEST}
+    yield 'sort_most_discussed', {'sort': constants.DATAREQUESTS_SORT_MOST_DISCUSSED}
+    yield 'offset_1000', {'offset': 1000}
+    yield 'cursor_page_2', {'after': first_page['next_cursor']}
+
+
+def _sample_datarequests():
+    '''Returns the ID of a data request with an average number of comments and the most discussed one'''
+    most_discussed = db.DataRequest.get_ordered_by_comments(limit=1)[0]
+    average = model.Session.query(db.DataRequest).filter(
+        db.DataRequest.comment_count == most_discussed.comment_count // 2).first() or most_discussed
+    return average.id, most_discussed.id
+
+
+def benchmark(generator, repeat):
+    '''Yields the results of every operation for the current size of the data base'''
+    for case, data_dict in index_cases(generator):
+        yield 'datarequest_index', case, _measure(lambda: actions.datarequest_index(_context(), dict(data_dict)),
+                                                  repeat)
+
+    average_id, most_discussed_id = _sample_datarequests()
+    counters_cache = cache.get_counters_cache()
+
+    for case, datarequest_id in (('average_comments', average_id), ('most_discussed', most_discussed_id)):
+        yield 'datarequest_show', case, _measure(
+            lambda: actions.datarequest_show(_context(), {'id': datarequest_id}), repeat)
+        yield 'datarequest_comment_list', case, _measure(
+            lambda: actions.datarequest_comment_list(_context(), {'datarequest_id': datarequest_id}), repeat)
+        yield 'helpers.get_comments_number', case, _measure(
+            lambda: helpers.get_comments_number(datarequest_id), repeat)
+
+    # The number of open data requests is cached by the helper
+    yield 'helpers.get_open_datarequests_number', 'not_cached', _measure(
+        helpers.get_open_datarequests_number, repeat,
+        setup=lambda: counters_cache.delete(cache.OPEN_DATAREQUESTS_NUMBER))
+    yield 'helpers.get_open_datarequests_number', 'cached', _measure(helpers.get_open_datarequests_number, repeat)
+
+
+def run(db_url='sqlite://', sizes=(1000, 10000, 100000), repeat=5, comments=3, organizations=20, users=100,
+        datasets=200):
+    engine = setup(db_url)
+    if model.Session.query(db.DataRequest).count():
+        raise ValueError('The data base already contains data requests')
+
+    generator = Generator(users, organizations, datasets, comments)
+    generator.generate_base()
+
+    for size in sorted(sizes):
+        generator.add_datarequests(size - generator.datarequests)
+
+        for operation, case, times in benchmark(generator, repeat):
+            result = {
+                'benchmark': operation,
+                'case': case,
+                'datarequests': generator.datarequests,
+                'comments': generator.comments,
+                'dialect': engine.dialect.name,
+                'repeat': repeat
+            }
+            result.update(times)
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the data requests actions and helpers')
+    parser.add_argument('--db-url', default='sqlite://',
+                        help='SQLAlchemy URL of the data base (SQLite or PostgreSQL). It must not contain data requests')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated numbers of data requests the data base is measured at')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times each operation is measured')
+    parser.add_argument('--comments', type=int, default=3, help='average number of comments per data request')
+    parser.add_argument('--organizations', type=int, default=20, help='number of organizations')
+    parser.add_argument('--users', type=int, default=100, help='number of users')
+    parser.add_argument('--datasets', type=int, default=200, help='number of datasets')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    for result in run(args.db_url, sizes, args.repeat, args.comments, args.organizations, args.users,
+                      args.datasets):
+        print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Fills a data base with synthetic users, organizations, datasets, data
+requests and comments. The CKAN tables and the tables of the extension are
+created when they do not exist. Rows are stored with bulk inserts, so large
+data bases (100000 data requests or more) can be generated in a few seconds.
+
+Usage: python benchmarks/generator.py [--db-url URL] [--datarequests N] [--comments N]
+                                      [--organizations N] [--users N] [--datasets N] [--seed N]
+'''
+
+import argparse
+import datetime
+import json
+import random
+import sqlalchemy as sa
+import time
+import uuid
+
+import ckan.model as model
+
+from ckanext.datarequests import constants, db, markup
+
+BATCH_SIZE = 1000
+FIRST_OPEN_TIME = datetime.datetime(2015, 1, 1)
+
+TOPICS = [u'air quality', u'budget', u'buses', u'census', u'crime', u'education', u'elections', u'energy',
+          u'forests', u'health', u'housing', u'libraries', u'museums', u'noise', u'parking', u'parks',
+          u'pollution', u'population', u'procurement', u'rainfall', u'recycling', u'roads', u'salaries',
+          u'schools', u'tourism', u'traffic', u'trains', u'unemployment', u'water', u'weather']
+
+DESCRIPTION = (u'We would like to have the {topic} data of every district, updated monthly and published in an '
+               u'open format (CSV or JSON).')
+
+COMMENTS = [u'+1, we need this too',
+            u'The {topic} data is already published at http://example.com/{topic}, but only as PDF',
+            u'Is there any update on this?\nThe last version we found is from 2014.',
+            u'We are working on it. It will be published by the end of the month (see www.example.com/news).']
+
+
+def setup(db_url):
+    '''
+    Connects the CKAN model to the given data base and creates the tables of
+    CKAN and of the extension (when they do not exist)
+    '''
+    engine = sa.create_engine(db_url)
+    model.init_model(engine)
+    model.meta.metadata.create_all(engine)
+    db.setup_db(model)
+    return engine
+
+
+def _uuid():
+    return unicode(uuid.uuid4())
+
+
+class Generator(object):
+    '''
+    Generates synthetic data. Users, organizations and datasets are created
+    by generate_base and data requests are appended by add_datarequests, so
+    the same data base can be measured at increasing sizes. The values are
+    random, but the same seed always generates the same data (except IDs).
+
+    Every data request has between 0 and 2 * comments comments, a random user
+    and (most of them) a random organization. Around 30% of them are closed
+    (half of those with an accepted dataset) and 10% are hidden.
+    '''
+
+    def __init__(self, users=100, organizations=20, datasets=200, comments=3, seed=0):
+        self.users_number = users
+        self.organizations_number = organizations
+        self.datasets_number = datasets
+        self.comments_per_datarequest = comments
+        self.random = random.Random(seed)
+        self.users = []
+        self.organizations = []
+        self.datasets = []
+        self.datarequests = 0
+        self.comments = 0
+        self._comments_html = {}
+
+    def generate_base(self):
+        '''Creates the users, the organizations and the datasets'''
+        now = datetime.datetime.now()
+
+        users = [{'id': _uuid(), 'name': u'benchmark-user-%d' % i, 'fullname': u'Benchmark User %d' % i,
+                  'email': u'benchmark-user-%d@example.com' % i, 'password': u'', 'created': now,
+                  'state': u'active', 'sysadmin': False} for i in range(self.users_number)]
+        organizations = [{'id': _uuid(), 'name': u'benchmark-organization-%d' % i,
+                          'title': u'Benchmark Organization %d' % i, 'type': u'organization',
+                          'is_organization': True, 'approval_status': u'approved', 'state': u'active',
+                          'created': now} for i in range(self.organizations_number)]
+        datasets = [{'id': _uuid(), 'name': u'benchmark-dataset-%d' % i, 'title': u'Benchmark Dataset %d' % i,
+                     'type': u'dataset', 'owner_org': self.random.choice(organizations)['id'] if organizations else None,
+                     'private': False, 'state': u'active', 'metadata_created': now, 'metadata_modified': now}
+                    for i in range(self.datasets_number)]
+
+        for table, rows in ((model.user_table, users), (model.group_table, organizations),
+                            (model.package_table, datasets)):
+            if rows:
+                model.Session.execute(table.insert(), rows)
+        model.Session.commit()
+
+        self.users = [user['name'] for user in users]
+        self.organizations = [organization['name'] for organization in organizations]
+        self.datasets = [dataset['name'] for dataset in datasets]
+        self._users_ids = [user['id'] for user in users]
+        self._organizations_ids = [organization['id'] for organization in organizations]
+        self._datasets_ids = [dataset['id'] for dataset in datasets]
+
+    def _comment_html(self, comment):
+        if comment not in self._comments_html:
+            self._comments_html[comment] = markup.render_comment(comment)
+        return self._comments_html[comment]
+
+    def _datarequest(self, number):
+        topic = self.random.choice(TOPICS)
+        user_id = self.random.choice(self._users_ids)
+        open_time = FIRST_OPEN_TIME + datetime.timedelta(minutes=number)
+        closed = self.random.random() < 0.3
+        close_time = open_time + datetime.timedelta(days=self.random.randint(1, 60)) if closed else None
+        accepted_dataset_id = None
+        if closed and self._datasets_ids and self.random.random() < 0.5:
+            accepted_dataset_id = self.random.choice(self._datasets_ids)
+        organization_id = None
+        if self._organizations_ids and self.random.random() < 0.8:
+            organization_id = self.random.choice(self._organizations_ids)
+
+        datarequest = {
+            'id': _uuid(),
+            'user_id': user_id,
+            'title': u'Data request %d: %s' % (number, topic),
+            'description': DESCRIPTION.format(topic=topic),
+            'organization_id': organization_id,
+            'open_time': open_time,
+            'accepted_dataset_id': accepted_dataset_id,
+            'close_time': close_time,
+            'closed': closed,
+            'visibility': (constants.DataRequestState.hidden if self.random.random() < 0.1 else
+                           constants.DataRequestState.visible).value,
+            'comment_count': self.random.randint(0, 2 * self.comments_per_datarequest),
+            'update_time': close_time or open_time,
+            'extras': {}
+        }
+
+        comments = []
+        for i in range(datarequest['comment_count']):
+            comment = self.random.choice(COMMENTS).format(topic=topic.replace(u' ', u'-'))
+            comments.append({
+                'id': _uuid(),
+                'datarequest_id': datarequest['id'],
+                'user_id': self.random.choice(self._users_ids),
+                'time': open_time + datetime.timedelta(hours=i + 1),
+                'comment': comment,
+                'comment_html': self._comment_html(comment)
+            })
+
+        if comments:
+            datarequest['update_time'] = max(datarequest['update_time'], comments[-1]['time'])
+
+        return datarequest, comments
+
+    def add_datarequests(self, number):
+        '''Appends the given number of data requests (and their comments)'''
+        end = self.datarequests + number
+
+        while self.datarequests < end:
+            datarequests = []
+            comments = []
+            for i in range(self.datarequests, min(self.datarequests + BATCH_SIZE, end)):
+                datarequest, datarequest_comments = self._datarequest(i)
+                datarequests.append(datarequest)
+                comments.extend(datarequest_comments)
+
+            db.DataRequest.insert_many(datarequests)
+            if comments:
+                db.Comment.insert_many(comments)
+            model.Session.commit()
+
+            self.datarequests += len(datarequests)
+            self.comments += len(comments)
+
+
+def run(db_url, datarequests=1000, comments=3, organizations=20, users=100, datasets=200, seed=0):
+    setup(db_url)
+    start = time.time()
+    generator = Generator(users, organizations, datasets, comments, seed)
+    generator.generate_base()
+    generator.add_datarequests(datarequests)
+
+    return {
+        'datarequests': generator.datarequests,
+        'comments': generator.comments,
+        'organizations': len(generator.organizations),
+        'users': len(generator.users),
+        'datasets': len(generator.datasets),
+        'seconds': time.time() - start
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fills a data base with synthetic data requests')
+    parser.add_argument('--db-url', default='sqlite:///datarequests_benchmark.db',
+                        help='SQLAlchemy URL of the data base (SQLite or PostgreSQL)')
+    parser.add_argument('--datarequests', type=int, default=1000, help='number of data requests')
+    parser.add_argument('--comments', type=int, default=3, help='average number of comments per data request')
+    parser.add_argument('--organizations', type=int, default=20, help='number of organizations')
+    parser.add_argument('--users', type=int, default=100, help='number of users')
+    parser.add_argument('--datasets', type=int, default=200, help='number of datasets')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random values')
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.db_url, args.datarequests, args.comments, args.organizations, args.users,
+                         args.datasets, args.seed), sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compares the time spent by the link detection of the comments with the time
+spent by the regular expression that was used before. The inputs are the
+worst cases of the regular expression, up to the maximum length of a comment.
+
+Usage: python benchmarks/linkify.py [--repeat N]
+'''
+
+import argparse
+import json
+import re
+import timeit
+
+from ckanext.datarequests import constants, markup
+
+# Link detection used before (it backtracks on long tokens with many URL beginnings)
+_REFERENCE_LINK = re.compile(r'(?:(https?://)|(www\.))(\S+\b/?)([!"#$%&\'()*+,\-./:;<=>?@[\\\]^_`{|}~]*)(\s|$)', re.I)
+
+
+def reference_convert_links(text):
+    def replace(match):
+        groups = match.groups()
+        return u'<a href="{0}{1}{2}" target="_blank">{0}{1}{2}</a>{3}{4}'.format(
+            groups[0] or '', groups[1] or '', *groups[2:])
+    return _REFERENCE_LINK.sub(replace, text)
+
+
+def _fill(pattern, length, suffix=u''):
+    return (pattern * ((length - len(suffix)) // len(pattern) + 1))[:length - len(suffix)] + suffix
+
+
+def adversarial_inputs(length=constants.COMMENT_MAX_LENGTH):
+    return [
+        ('plain_text', _fill(u'lorem ipsum dolor sit amet ', length)),
+        ('many_links', _fill(u'see http://example.com/path ', length)),
+        ('repeated_www', _fill(u'www.', length, u'\xe9')),
+        ('repeated_www_word', _fill(u'www.a', length, u'\xe9')),
+        ('repeated_http', _fill(u'http://', length, u'\xe9')),
+        ('repeated_https_punctuation', _fill(u'https://a!!!', length, u'\xe9')),
+        ('long_punctuation_run', u'http://a' + _fill(u'-', length - 9, u'\xe9')),
+        ('long_dotted_host', u'http://' + _fill(u'a.', length - 7)),
+        ('mixed_punctuation', u'www.' + _fill(u'a.,;:!?()', length - 4)),
+    ]
+
+
+def run(repeat=5):
+    results = []
+
+    for name, text in adversarial_inputs():
+        if reference_convert_links(text) != markup.convert_links(text):
+            raise AssertionError('The output for %s differs from the reference output' % name)
+
+        reference = min(timeit.repeat(lambda: reference_convert_links(text), number=1, repeat=repeat))
+        current = min(timeit.repeat(lambda: markup.convert_links(text), number=1, repeat=repeat))
+        results.append({
+            'input': name,
+            'length': len(text),
+            'reference_seconds': reference,
+            'convert_links_seconds': current,
+            'speedup': reference / current if current else None
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the link detection of the comments')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times each input is processed')
+    args = parser.parse_args()
+
+    for result in run(args.repeat):
+        print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,50 +19,192 @@
 
 
 from ckan import authz
+import cache
 import ckan.plugins as plugins
 import constants
 import datetime
 import cgi
 import db
+import hashlib
 import logging
+import markup
+import metrics
+import re
 import validator
 
 from pylons import config
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 
 c = plugins.toolkit.c
 log = logging.getLogger(__name__)
 tk = plugins.toolkit
 
 # Avoid user_show lag
-USERS_CACHE = {}
+USERS_CACHE = cache.LRUCache(int(config.get('ckan.datarequests.users_cache.size', 1000)),
+                             int(config.get('ckan.datarequests.users_cache.ttl', 300)))
 
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
 
-def _get_user(user_id):
-    try:
-        if user_id in USERS_CACHE:
-            return USERS_CACHE[user_id]
+# Columns of the users retrieved to build their public dicts. The email is only
+# used to compute its hash
+USER_COLUMNS = ['id', 'name', 'fullname', 'email', 'created', 'about', 'activity_streams_email_notifications',
+                'sysadmin', 'state']
+
+SOLR_SPECIAL_CHARACTERS = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/\s])')
+
+
+def _get_action(action_name):
+    '''Returns a CKAN action. Its calls are measured as nested calls of the running action'''
+    return metrics.nested_action(action_name, tk.get_action(action_name))
+
+
+def invalidate_user(mapper, connection, user):
+    '''
+    SQLAlchemy ``after_update`` listener for the ``User`` model. It removes
+    the updated user from the cache so the new name, email... are shown
+    '''
+    USERS_CACHE.delete(user.id)
+
+
+def _count_users_activity(model, users_rows):
+    '''
+    Returns the number of edits (user name -> number) and the number of public
+    datasets created (user ID -> number) by the given users, with one query each
+    '''
+    session = model.Session
+    names = [user_row.name for user_row in users_rows]
+    ids = [user_row.id for user_row in users_rows]
+
+    edits = session.query(model.Revision.author, func.count(model.Revision.id)) \
+        .filter(model.Revision.author.in_(names)).group_by(model.Revision.author)
+    datasets = session.query(model.Package.creator_user_id, func.count(model.Package.id)) \
+        .filter(model.Package.creator_user_id.in_(ids), model.Package.state == 'active',
+                model.Package.private == False).group_by(model.Package.creator_user_id)
+
+    return dict(edits), dict(datasets)
+
+
+def _user_to_dict(user_row, number_of_edits, number_created_packages):
+    '''
+    Returns the public dict of a user: the same fields than user_show returns
+    when it is called without a requester (no email, API key or password)
+    '''
+    user = dict((column, getattr(user_row, column)) for column in USER_COLUMNS if column != 'email')
+    user['created'] = user['created'].isoformat() if user['created'] else None
+    user['display_name'] = user['fullname'] if user['fullname'] and user['fullname'].strip() else user['name']
+    user['email_hash'] = hashlib.md5((user_row.email or u'').strip().lower().encode('utf8')).hexdigest()
+    user['number_of_edits'] = number_of_edits
+    user['number_created_packages'] = number_created_packages
+    return user
+
+
+def _get_users(context, users_ids):
+    '''
+    Returns a dict (user ID -> user) with the given users. The users that are
+    not cached are retrieved with a single query (and their activity numbers
+    with one query each, see _count_users_activity). Only their columns are
+    retrieved, so the users of the session are not loaded or changed.
+    '''
+    users = {}
+    not_cached = set()
+    for user_id in set(users_ids):
+        user = USERS_CACHE.get(user_id)
+        if user is None:
+            not_cached.add(user_id)
         else:
-            user = tk.get_action('user_show')({'ignore_auth': True}, {'id': user_id})
-            USERS_CACHE[user_id] = user
-            return user
-    except Exception as e:
-        log.warn(e)
+            users[user_id] = user
+
+    if not_cached:
+        try:
+            model = context['model']
+            columns = [getattr(model.User, column) for column in USER_COLUMNS]
+            users_rows = model.Session.query(*columns).filter(model.User.id.in_(not_cached)).all()
+            edits, datasets = _count_users_activity(model, users_rows) if users_rows else ({}, {})
+            for user_row in users_rows:
+                user = _user_to_dict(user_row, edits.get(user_row.name, 0), datasets.get(user_row.id, 0))
+                USERS_CACHE.set(user_row.id, user)
+                users[user_row.id] = user
+        except Exception as e:
+            log.warn(e)
 
+    return users
 
-def _get_organization(organization_id):
-    try:
-        organization_show = tk.get_action('organization_show')
-        return organization_show({'ignore_auth': True}, {'id': organization_id})
-    except Exception as e:
-        log.warn(e)
 
+def _get_summaries(context, model_class, ids):
+    '''
+    Returns a dict (ID -> summary) with the given objects (organizations or
+    datasets). Only the fields shown in the templates (id, name, title and
+    display_name) are retrieved, with a single query.
+    '''
+    summaries = {}
+    ids = set(ids)
+
+    if ids:
+        try:
+            session = context['model'].Session
+            query = session.query(model_class.id, model_class.name, model_class.title)
+            for object_id, name, title in query.filter(model_class.id.in_(ids)):
+                summaries[object_id] = {
+                    'id': object_id,
+                    'name': name,
+                    'title': title,
+                    'display_name': title or name
+                }
+        except Exception as e:
+            log.warn(e)
+
+    return summaries
 
-def _get_package(package_id):
+
+def _get_organizations(context, organizations_ids):
+    return _get_summaries(context, context['model'].Group, organizations_ids)
+
+
+def _get_packages(context, packages_ids):
+    return _get_summaries(context, context['model'].Package, packages_ids)
+
+
+def _escape_solr(text):
+    '''Escapes the special characters (and the spaces) of Solr queries'''
+    return SOLR_SPECIAL_CHARACTERS.sub(r'\\\1', text)
+
+
+def _prefix_query(q):
+    '''
+    Returns the Solr query of the datasets whose name starts with q or whose
+    title includes words starting with every word of q
+    '''
+    title_query = ' AND '.join('title:%s*' % _escape_solr(word) for word in q.split())
+    return 'name:%s* OR (%s)' % (_escape_solr(q), title_query)
+
+
+def _commit_datarequest(session):
+    '''
+    Commits the data request stored in the session. Repeated titles are
+    rejected by the data base (unique index on lower(title)).
+    '''
     try:
-        package_show = tk.get_action('package_show')
-        return package_show({'ignore_auth': True}, {'id': package_id})
-    except Exception as e:
-        log.warn(e)
+        session.commit()
+    except IntegrityError as e:
+        session.rollback()
+        if db.UNIQUE_TITLE_INDEX in str(e):
+            raise tk.ValidationError({'Title': ['That title is already in use']})
+        raise
+
+
+def _invalidate_open_datarequests_number():
+    '''The number of open data requests (header badge) is cached'''
+    cache.get_counters_cache().delete(cache.OPEN_DATAREQUESTS_NUMBER)
+
+
+def _invalidate_pages(*scopes):
+    '''The pages rendered for anonymous users may be cached (see cache.PagesCache)'''
+    pages_cache = cache.get_pages_cache()
+
+    if pages_cache is not None:
+        pages_cache.invalidate(*scopes)
+
 
 def _get_visibility_from_name(visibility):
     try:
@@ -78,7 +220,72 @@ def _get_visibility_from_code(visibility_code):
         log.warn(e)
         return constants.DataRequestState.hidden
 
-def _dictize_datarequest(datarequest):
+def _encode_cursor(datarequest):
+    '''The cursor points to the last data request of a page'''
+    return '%s_%s' % (datarequest.open_time.strftime(CURSOR_TIME_FORMAT), datarequest.id)
+
+def _decode_cursor(cursor):
+    try:
+        open_time, datarequest_id = cursor.split('_', 1)
+        return datetime.datetime.strptime(open_time, CURSOR_TIME_FORMAT), datarequest_id
+    except ValueError, e:
+        log.warn(e)
+        raise tk.ValidationError({'Cursor': [tk._('The cursor is not valid')]})
+
+def _get_index_filters(context, data_dict):
+    '''
+    Returns the filters of the data base queries (see db.DataRequest._filter)
+    for the parameters of datarequest_index
+    '''
+    model = context['model']
+    params = {}
+
+    # Get the organization
+    organization_id = data_dict.get('organization_id', None)
+    if organization_id:
+        # Get organization ID (in some cases the organization name is received)
+        organization = model.Group.get(organization_id)
+        if not organization:
+            raise tk.ObjectNotFound(tk._('Organization not found'))
+        organization_id = organization.id
+
+        # Include organization ID into the parameters to filter the database query
+        params['organization_id'] = organization_id
+
+    user_id = data_dict.get('user_id', None)
+    if user_id:
+        # Get user ID (the user name is received)
+        user_id = _get_action('user_show')({'ignore_auth': True}, {'id': user_id}).get('id')
+
+        # Include user ID into the parameters to filter the database query
+        params['user_id'] = user_id
+
+    # Filter by state
+    closed = data_dict.get('closed', None)
+    if closed is not None:
+        params['closed'] = closed
+
+    visibility_text = data_dict.get('visibility', None)
+    if visibility_text:
+        params['visibility'] = _get_visibility_from_name(visibility_text).value
+
+    # Full text search
+    q = (data_dict.get('q', None) or '').strip()
+    if q:
+        params['q'] = q
+
+    return params
+
+
+def _dictize_datarequest(context, datarequest):
+    return _dictize_datarequests(context, [datarequest])[0]
+
+
+def _datarequest_to_dict(datarequest, users, organizations, packages):
+    '''
+    Converts a data request into a dict. Users, organizations and accepted
+    datasets are taken from the given dicts (ID -> object).
+    '''
     # Transform time
     open_time = str(datarequest.open_time)
     # Close time can be None and the transformation is only needed when the
@@ -97,24 +304,33 @@ def _dictize_datarequest(datarequest):
         'accepted_dataset_id': datarequest.accepted_dataset_id,
         'close_time': close_time,
         'closed': datarequest.closed,
-        'user': _get_user(datarequest.user_id),
-        'organization': None,
-        'accepted_dataset': None,
+        'user': users.get(datarequest.user_id),
+        'organization': organizations.get(datarequest.organization_id),
+        'accepted_dataset': packages.get(datarequest.accepted_dataset_id),
         'visibility': _get_visibility_from_code(datarequest.visibility).name,
+        'comments_count': datarequest.comment_count or 0,
     }
 
-    if datarequest.organization_id:
-        data_dict['organization'] = _get_organization(datarequest.organization_id)
-
-    if datarequest.accepted_dataset_id:
-        data_dict['accepted_dataset'] = _get_package(datarequest.accepted_dataset_id)
-
     if datarequest.extras:
         data_dict.update(datarequest.extras)
 
     return data_dict
 
 
+def _dictize_datarequests(context, datarequests):
+    '''
+    Converts a list of data requests into dicts. Users, organizations and
+    accepted datasets are retrieved with one query each.
+    '''
+    users = _get_users(context, [datarequest.user_id for datarequest in datarequests])
+    organizations = _get_organizations(context, [datarequest.organization_id for datarequest in datarequests
+                                                 if datarequest.organization_id])
+    packages = _get_packages(context, [datarequest.accepted_dataset_id for datarequest in datarequests
+                                       if datarequest.accepted_dataset_id])
+
+    return [_datarequest_to_dict(datarequest, users, organizations, packages) for datarequest in datarequests]
+
+
 def _undictize_datarequest_basic(data_request, data_dict):
     params = data_dict.copy()
     data_request.title = params.pop('title', None)
@@ -130,23 +346,36 @@ def _undictize_datarequest_basic(data_request, data_dict):
     data_request.extras = params
 
 
-def _dictize_comment(comment):
+def _dictize_comment(comment, users):
 
     return {
         'id': comment.id,
         'datarequest_id': comment.datarequest_id,
         'user_id': comment.user_id,
         'comment': comment.comment,
+        # Comments stored before comment_html existed are rendered when they are read
+        'comment_html': comment.comment_html or markup.render_comment(comment.comment or ''),
         'time': str(comment.time),
-        'user': _get_user(comment.user_id)
+        'user': users.get(comment.user_id)
     }
 
 
+def _dictize_comments(context, comments):
+    '''
+    Converts a list of comments into dicts. Users are retrieved with a
+    single query.
+    '''
+    users = _get_users(context, [comment.user_id for comment in comments])
+    return [_dictize_comment(comment, users) for comment in comments]
+
+
 def _undictize_comment_basic(comment, data_dict):
     comment.comment = cgi.escape(data_dict.get('comment', ''))
+    comment.comment_html = markup.render_comment(comment.comment)
     comment.datarequest_id = data_dict.get('datarequest_id', '')
 
 
+@metrics.instrumented
 def datarequest_create(context, data_dict):
     '''
     Action to create a new dara request. The function checks the access rights
@@ -189,6 +418,7 @@ def datarequest_create(context, data_dict):
     _undictize_datarequest_basic(data_req, data_dict)
     data_req.user_id = context['auth_user_obj'].id if context['auth_user_obj'] else 'anonymous'
     data_req.open_time = datetime.datetime.now()
+    data_req.update_time = data_req.open_time
 
     data_req.visibility = constants.DataRequestState.visible.value
     context['ignore_auth'] = config.get('ckan.datarequests.ignore_auth', False)
@@ -197,11 +427,112 @@ def datarequest_create(context, data_dict):
         data_req.visibility = constants.DataRequestState.hidden.value
 
     session.add(data_req)
-    session.commit()
+    _commit_datarequest(session)
+    _invalidate_open_datarequests_number()
+    _invalidate_pages(cache.ALL_PAGES)
+
+    return _dictize_datarequest(context, data_req)
+
+
+@metrics.instrumented
+def datarequest_create_many(context, data_dict):
+    '''
+    Action to create several data requests at once (e.g. to migrate them from
+    other system). Only sysadmins are allowed to call it. The whole batch is
+    validated at once and the valid data requests are stored in a single
+    transaction. Invalid data requests are skipped and their errors are
+    returned.
+
+    If a title is taken by other data request while the batch is being stored,
+    no data request is created and a ValidationError is risen.
+
+    :param datarequests: The data requests to be created (dicts with the same
+        parameters than datarequest_create). A maximum of 1000 data requests
+        can be created at once.
+    :type datarequests: list
+
+    :returns: A dict with the IDs of the data requests (``ids``, in the same
+        order than the given data requests and None for the invalid ones) and
+        the errors of the invalid data requests (``errors``, a list of dicts
+        with the ``index`` of the data request and its ``errors``)
+    :rtype: dict
+    '''
+
+    model = context['model']
+    session = context['session']
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_CREATE_MANY, context, data_dict)
+
+    datarequests = data_dict.get('datarequests')
+
+    if not isinstance(datarequests, list) or not datarequests:
+        raise tk.ValidationError({'Data Requests': [tk._('A list of data requests is required')]})
+
+    if len(datarequests) > constants.DATAREQUESTS_CREATE_MANY_MAX_SIZE:
+        raise tk.ValidationError({'Data Requests': [tk._('A maximum of %d data requests can be created at once') %
+                                                    constants.DATAREQUESTS_CREATE_MANY_MAX_SIZE]})
+
+    # Validate data
+    requests_data = []
+    for request_data in datarequests:
+        request_data = dict(request_data) if isinstance(request_data, dict) else {}
+        for field in ('title', 'description', 'organization_id'):
+            request_data[field] = request_data.get(field) or u''
+        requests_data.append(request_data)
+
+    batch_errors = validator.validate_datarequests(context, requests_data)
 
-    return _dictize_datarequest(data_req)
+    # All the data requests are created by the same user at the same time
+    user_id = context['auth_user_obj'].id if context['auth_user_obj'] else 'anonymous'
+    now = datetime.datetime.now()
 
+    visibility = constants.DataRequestState.visible.value
+    context['ignore_auth'] = config.get('ckan.datarequests.ignore_auth', False)
+    if context['ignore_auth'] == False and not authz.is_sysadmin(context['user']):
+        visibility = constants.DataRequestState.hidden.value
+
+    ids = []
+    errors = []
+    rows = []
+
+    for index, (request_data, request_errors) in enumerate(zip(requests_data, batch_errors)):
+        if request_errors:
+            ids.append(None)
+            errors.append({'index': index, 'errors': request_errors})
+            continue
+
+        data_req = db.DataRequest()
+        _undictize_datarequest_basic(data_req, request_data)
+        rows.append({
+            'id': db.uuid4(),
+            'user_id': user_id,
+            'title': data_req.title,
+            'description': data_req.description,
+            'organization_id': data_req.organization_id,
+            'open_time': now,
+            'update_time': now,
+            'closed': False,
+            'comment_count': 0,
+            'visibility': visibility,
+            'extras': data_req.extras
+        })
+        ids.append(rows[-1]['id'])
+
+    # Store the data
+    if rows:
+        db.DataRequest.insert_many(rows)
+        _commit_datarequest(session)
+        _invalidate_open_datarequests_number()
+        _invalidate_pages(cache.ALL_PAGES)
+
+    return {'ids': ids, 'errors': errors}
 
+
+@metrics.instrumented
 def datarequest_show(context, data_dict):
     '''
     Action to retrieve the information of a data request. The only required
@@ -237,11 +568,12 @@ def datarequest_show(context, data_dict):
         raise tk.ObjectNotFound('Data Request %s not found in the data base' % datarequest_id)
 
     data_req = result[0]
-    data_dict = _dictize_datarequest(data_req)
+    data_dict = _dictize_datarequest(context, data_req)
 
     return data_dict
 
 
+@metrics.instrumented
 def datarequest_update(context, data_dict):
     '''
     Action to update a dara request. The function checks the access rights of
@@ -302,13 +634,16 @@ def datarequest_update(context, data_dict):
 
     # Set the data provided by the user in the data_red
     _undictize_datarequest_basic(data_req, data_dict)
+    data_req.update_time = datetime.datetime.now()
 
     session.add(data_req)
-    session.commit()
+    _commit_datarequest(session)
+    _invalidate_pages(cache.LIST_PAGES, data_req.id)
 
-    return _dictize_datarequest(data_req)
+    return _dictize_datarequest(context, data_req)
 
 
+@metrics.instrumented
 def datarequest_index(context, data_dict):
     '''
     Returns a list with the existing data requests. Rights access will be checked
@@ -333,15 +668,32 @@ def datarequest_index(context, data_dict):
     :param limit: The max number of data requests to be returned (10 by default)
     :type limit: init
 
-    :returns: A dict with three fields: result (a list of data requests),
-        facets (a list of the facets that can be used) and count (the total
-        number of existing data requests)
+    :param after: This parameter is optional and allows users to get the
+        page that follows the one that returned this cursor (next_cursor).
+        When it is included, offset is ignored
+    :type after: string
+
+    :param q: This parameter is optional and allows users to search data
+        requests by the words included in their title or description.
+        Facets and count only include the data requests that match it
+    :type q: string
+
+    :param sort: The order of the data requests: newest (by default),
+        most_discussed (the ones with more comments first) or relevance
+        (the ones that match q better first; it's the default order when q
+        is given). Cursors (after and next_cursor) can only be used with the
+        newest order
+    :type sort: string
+
+    :returns: A dict with four fields: result (a list of data requests,
+        including the number of comments of each one in comments_count),
+        facets (a list of the facets that can be used), count (the total
+        number of existing data requests) and next_cursor (the value of
+        after to get the next page or None if this is the last one)
     :rtype: dict
     '''
 
     model = context['model']
-    organization_show = tk.get_action('organization_show')
-    user_show = tk.get_action('user_show')
 
     # Init the data base
     db.init_db(model)
@@ -349,77 +701,78 @@ def datarequest_index(context, data_dict):
     # Check access
     tk.check_access(constants.DATAREQUEST_INDEX, context, data_dict)
 
-    # Get the organization
-    organization_id = data_dict.get('organization_id', None)
-    params = {}
-    if organization_id:
-        # Get organization ID (in some cases the organization name is received)
-        organization_id = organization_show({'ignore_auth': True}, {'id': organization_id}).get('id')
-
-        # Include organization ID into the parameters to filter the database query
-        params['organization_id'] = organization_id
-
-    user_id = data_dict.get('user_id', None)
-    if user_id:
-        # Get user ID (the user name is received)
-        user_id = user_show({'ignore_auth': True}, {'id': user_id}).get('id')
-
-        # Include user ID into the parameters to filter the database query
-        params['user_id'] = user_id
+    params = _get_index_filters(context, data_dict)
+    q = params.get('q', None)
 
-    # Filter by state
-    closed = data_dict.get('closed', None)
-    if closed is not None:
-        params['closed'] = closed
+    default_sort = constants.DATAREQUESTS_SORT_RELEVANCE if q else constants.DATAREQUESTS_SORT_NEWEST
+    sort = data_dict.get('sort', None) or default_sort
+    if sort not in constants.DATAREQUESTS_SORT_OPTIONS:
+        raise tk.ValidationError({'Sort': [tk._('The sort parameter is not valid')]})
 
-    visibility_text = data_dict.get('visibility', None)
-    if visibility_text:
-        params['visibility'] = _get_visibility_from_name(visibility_text).value
+    # Relevance is meaningless when nothing is searched
+    if sort == constants.DATAREQUESTS_SORT_RELEVANCE and not q:
+        sort = constants.DATAREQUESTS_SORT_NEWEST
 
-    # Call the function
-    db_datarequests = db.DataRequest.get_ordered_by_date(**params)
+    # Call the function. Only the requested page is retrieved from the data base.
+    # An extra data request is requested to know if there is a next page
+    limit = data_dict.get('limit', constants.DATAREQUESTS_PER_PAGE)
+    offset = data_dict.get('offset', 0)
+    after = data_dict.get('after', None)
+    if after and sort != constants.DATAREQUESTS_SORT_NEWEST:
+        raise tk.ValidationError({'Cursor': [tk._('The cursor can only be used with the newest order')]})
+
+    if sort == constants.DATAREQUESTS_SORT_MOST_DISCUSSED:
+        db_datarequests = db.DataRequest.get_ordered_by_comments(offset=offset, limit=limit + 1, **params)
+    elif sort == constants.DATAREQUESTS_SORT_RELEVANCE:
+        db_datarequests = db.DataRequest.get_ordered_by_relevance(offset=offset, limit=limit + 1, **params)
+    elif after:
+        db_datarequests = db.DataRequest.get_ordered_by_date(limit=limit + 1, after=_decode_cursor(after), **params)
+    else:
+        db_datarequests = db.DataRequest.get_ordered_by_date(offset=offset, limit=limit + 1, **params)
+
+    next_cursor = None
+    if len(db_datarequests) > limit:
+        db_datarequests = db_datarequests[:limit]
+        # The cursor is based on the open time, so it's only valid for the newest order
+        if db_datarequests and sort == constants.DATAREQUESTS_SORT_NEWEST:
+            next_cursor = _encode_cursor(db_datarequests[-1])
+
+    total_count = db.DataRequest.get_datarequests_number(**params)
 
     # Dictize the results
-    offset = data_dict.get('offset', 0)
-    limit = data_dict.get('limit', constants.DATAREQUESTS_PER_PAGE)
-    datarequests = []
-    for data_req in db_datarequests[offset:offset + limit]:
-        datarequests.append(_dictize_datarequest(data_req))
+    datarequests = _dictize_datarequests(context, db_datarequests)
 
-    # Facets
+    # Facets (they are computed by the data base with GROUP BY queries)
     no_processed_organization_facet = {}
+    for organization_id, count in db.DataRequest.get_facet('organization_id', **params):
+        if organization_id:
+            no_processed_organization_facet[organization_id] = count
+
     CLOSED = 'Closed'
     OPEN = 'Open'
     no_processed_state_facet = {CLOSED:0 , OPEN: 0}
+    for closed, count in db.DataRequest.get_facet('closed', **params):
+        no_processed_state_facet[CLOSED if closed else OPEN] += count
+
     no_processed_visibility_facet = {
         constants.DataRequestState.hidden: 0,
         constants.DataRequestState.visible: 0.
     }
-    for data_req in db_datarequests:
-        if data_req.organization_id:
-            # Facets
-            if data_req.organization_id in no_processed_organization_facet:
-                no_processed_organization_facet[data_req.organization_id] += 1
-            else:
-                no_processed_organization_facet[data_req.organization_id] = 1
-
-        no_processed_state_facet[CLOSED if data_req.closed else OPEN] +=1
-
-        visibility = _get_visibility_from_code(data_req.visibility)
-        no_processed_visibility_facet[visibility] += 1
+    for visibility_code, count in db.DataRequest.get_facet('visibility', **params):
+        visibility = _get_visibility_from_code(visibility_code)
+        no_processed_visibility_facet[visibility] += count
 
     # Format facets
     organization_facet = []
+    organizations = _get_organizations(context, no_processed_organization_facet.keys())
     for organization_id in no_processed_organization_facet:
-        try:
-            organization = organization_show({'ignore_auth': True}, {'id': organization_id})
+        if organization_id in organizations:
+            organization = organizations[organization_id]
             organization_facet.append({
-                'name': organization.get('name'),
-                'display_name': organization.get('display_name'),
+                'name': organization['name'],
+                'display_name': organization['display_name'],
                 'count': no_processed_organization_facet[organization_id]
             })
-        except:
-            pass
 
     state_facet = []
     for state in no_processed_state_facet:
@@ -431,9 +784,10 @@ def datarequest_index(context, data_dict):
             })
 
     result = {
-        'count': len(db_datarequests),
+        'count': total_count,
         'facets': {},
-        'result': datarequests
+        'result': datarequests,
+        'next_cursor': next_cursor
     }
 
     # Facets can only be included if they contain something
@@ -454,6 +808,78 @@ def datarequest_index(context, data_dict):
     return result
 
 
+@metrics.instrumented
+def datarequest_last_modified(context, data_dict):
+    '''
+    Returns the last time that a data request (or any of the data requests of
+    a list) was modified. It only queries the data requests table, so clients
+    can call it to know if they have to retrieve the data requests again.
+    Access rights will be checked as in datarequest_show (when the id is
+    given) or datarequest_index (otherwise).
+
+    :param id: The id of the data request. This parameter is optional: when
+        it is not included, the data requests that match the filters of
+        datarequest_index (organization_id, user_id, closed, visibility and q)
+        are considered
+    :type id: string
+
+    :returns: A dict with two fields: count (the number of data requests) and
+        last_modified (the last time that they or their comments were created,
+        updated, closed or deleted or None if there are no data requests). Both
+        change whenever the data requests change
+    :rtype: dict
+    '''
+
+    model = context['model']
+    datarequest_id = data_dict.get('id', '')
+
+    # Init the data base
+    db.init_db(model)
+
+    if datarequest_id:
+        tk.check_access(constants.DATAREQUEST_SHOW, context, data_dict)
+        count, last_modified = db.DataRequest.get_last_modified(id=datarequest_id)
+
+        if not count:
+            raise tk.ObjectNotFound('Data Request %s not found in the data base' % datarequest_id)
+    else:
+        tk.check_access(constants.DATAREQUEST_INDEX, context, data_dict)
+        count, last_modified = db.DataRequest.get_last_modified(**_get_index_filters(context, data_dict))
+
+    return {
+        'count': count,
+        'last_modified': last_modified.isoformat() if last_modified else None
+    }
+
+
+@metrics.instrumented
+def datarequest_metrics(context, data_dict):
+    '''
+    Action to retrieve the metrics of the actions of this extension: the
+    number of calls, the wall time, the SQL statements executed by them and
+    the nested action calls (such as user_show), aggregated by action name.
+    Only sysadmins are allowed to call it. Metrics are kept by each process
+    of the server.
+
+    :param reset: When it is True, the metrics are reset after being returned
+    :type reset: bool
+
+    :returns: A dict with the start (since) and the end (until) of the period
+        and the metrics of every action called in that period (actions): the
+        number of calls, errors, total_seconds, mean_seconds, max_seconds,
+        sql_statements (the ones executed by the action itself),
+        sql_statements_per_call and nested_calls (action name -> calls,
+        total_seconds and sql_statements)
+    :rtype: dict
+    '''
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_METRICS, context, data_dict)
+
+    return metrics.get_metrics(tk.asbool(data_dict.get('reset', False)))
+
+
+@metrics.instrumented
 def datarequest_delete(context, data_dict):
     '''
     Action to delete a new dara request. The function checks the access rights
@@ -490,10 +916,13 @@ def datarequest_delete(context, data_dict):
     data_req = result[0]
     session.delete(data_req)
     session.commit()
+    _invalidate_open_datarequests_number()
+    _invalidate_pages(cache.ALL_PAGES)
 
-    return _dictize_datarequest(data_req)
+    return _dictize_datarequest(context, data_req)
 
 
+@metrics.instrumented
 def datarequest_close(context, data_dict):
     '''
     Action to close a data request. Access rights will be checked before closing the
@@ -543,13 +972,176 @@ def datarequest_close(context, data_dict):
     data_req.closed = True
     data_req.accepted_dataset_id = data_dict.get('accepted_dataset_id', None)
     data_req.close_time = datetime.datetime.now()
+    data_req.update_time = data_req.close_time
 
     session.add(data_req)
     session.commit()
+    _invalidate_open_datarequests_number()
+    _invalidate_pages(cache.ALL_PAGES)
 
-    return _dictize_datarequest(data_req)
+    return _dictize_datarequest(context, data_req)
 
 
+@metrics.instrumented
+def datarequest_bulk_update(context, data_dict):
+    '''
+    Action to close, reopen or change the visibility of several data requests
+    at once. Only sysadmins are allowed to call it. The data requests are
+    updated with UPDATE statements in a single transaction (they are not
+    loaded), so thousands of data requests can be updated at once.
+
+    The data requests to be updated are selected by their IDs, by the filters
+    of datarequest_index or by both of them.
+
+    :param operation: The operation to be applied: close, reopen or visibility
+    :type operation: string
+
+    :param visibility: The new visibility of the data requests (hidden or
+        visible). Only required by the visibility operation.
+    :type visibility: string
+
+    :param ids: The IDs of the data requests to be updated. An empty list
+        selects no data request.
+    :type ids: list
+
+    :param filters: The filters of the data requests to be updated: the same
+        parameters than datarequest_index (organization_id, user_id, closed,
+        visibility and q). Empty filters select all the data requests.
+    :type filters: dict
+
+    :returns: A dict with the number of data requests that have been updated
+        (count). Data requests already in the requested state are not counted.
+    :rtype: dict
+    '''
+
+    model = context['model']
+    session = context['session']
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_BULK_UPDATE, context, data_dict)
+
+    # Validate data
+    operation = data_dict.get('operation', '')
+    if operation not in constants.DATAREQUESTS_BULK_OPERATIONS:
+        raise tk.ValidationError({'Operation': [tk._('The operation must be one of: %s') %
+                                                ', '.join(constants.DATAREQUESTS_BULK_OPERATIONS)]})
+
+    visibility = data_dict.get('visibility', '')
+    if operation == constants.DATAREQUESTS_BULK_VISIBILITY and \
+            visibility not in constants.DataRequestState.__members__:
+        raise tk.ValidationError({'Visibility': [tk._('The visibility must be hidden or visible')]})
+
+    ids = data_dict.get('ids', None)
+    filters = data_dict.get('filters', None)
+
+    if ids is not None and not isinstance(ids, list):
+        raise tk.ValidationError({'IDs': [tk._('The IDs must be a list')]})
+
+    if filters is not None and not isinstance(filters, dict):
+        raise tk.ValidationError({'Filters': [tk._('The filters must be a dict')]})
+
+    if not ids and filters is None:
+        raise tk.ValidationError({'Data Requests': [tk._('The IDs or the filters of the data requests are required')]})
+
+    params = _get_index_filters(context, filters or {})
+
+    # An empty list of IDs (e.g. an empty selection) selects no data request, even
+    # when the filters are included. Only the filters can select all of them
+    if ids == []:
+        return {'count': 0}
+
+    # Update the data requests
+    now = datetime.datetime.now()
+
+    if operation == constants.DATAREQUESTS_BULK_CLOSE:
+        count = db.DataRequest.close_many(now, ids, **params)
+    elif operation == constants.DATAREQUESTS_BULK_REOPEN:
+        count = db.DataRequest.reopen_many(now, ids, **params)
+    else:
+        count = db.DataRequest.set_visibility_many(constants.DataRequestState[visibility].value, now, ids, **params)
+
+    session.commit()
+
+    if count:
+        if operation != constants.DATAREQUESTS_BULK_VISIBILITY:
+            _invalidate_open_datarequests_number()
+        _invalidate_pages(cache.ALL_PAGES)
+
+    return {'count': count}
+
+
+@metrics.instrumented
+def datarequest_dataset_autocomplete(context, data_dict):
+    '''
+    Action to look for the datasets that can be accepted as solution for a
+    data request. It returns the public datasets whose name starts with the
+    given text or whose title includes words starting with every word of the
+    text (case insensitive). Datasets are looked up with package_search, so
+    the search index is used. Access rights will be checked before returning
+    the results. If the user is not allowed, a NotAuthorized
+    exception will be risen.
+
+    :param q: The text that the name (or the words of the title) of the
+        datasets starts with
+    :type q: string
+
+    :param organization_id: This parameter is optional and allows users
+        to only look for the datasets of an organization
+    :type organization_id: string
+
+    :param limit: The max number of datasets to be returned (10 by default
+        and 100 at most)
+    :type limit: int
+
+    :returns: A list of dicts with the name and the title of the datasets
+    :rtype: list
+
+    '''
+
+    model = context['model']
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_DATASET_AUTOCOMPLETE, context, data_dict)
+
+    try:
+        limit = int(data_dict.get('limit', constants.DATASETS_AUTOCOMPLETE_LIMIT))
+    except (TypeError, ValueError):
+        raise tk.ValidationError({'Limit': [tk._('The limit parameter is not valid')]})
+
+    limit = max(0, min(limit, constants.DATASETS_AUTOCOMPLETE_MAX_LIMIT))
+    q = (data_dict.get('q', None) or '').strip().lower()
+
+    if not q or not limit:
+        return []
+
+    # Datasets are looked up in the search index, like in the rest of CKAN
+    search_dict = {
+        'q': _prefix_query(q),
+        'fq': '+dataset_type:dataset',
+        'fl': ['name', 'title'],
+        'sort': 'name asc',
+        'rows': limit
+    }
+
+    organization_id = data_dict.get('organization_id', None)
+    if organization_id:
+        # Get organization ID (in some cases the organization name is received)
+        organization = model.Group.get(organization_id)
+        if not organization:
+            raise tk.ObjectNotFound(tk._('Organization not found'))
+
+        search_dict['fq'] += ' +owner_org:"%s"' % organization.id
+
+    # Only public datasets are returned (private ones are not included by package_search)
+    result = _get_action('package_search')({'ignore_auth': True}, search_dict)
+
+    return [{'name': dataset['name'], 'title': dataset.get('title')} for dataset in result['results']]
+
+
+@metrics.instrumented
 def datarequest_comment(context, data_dict):
     '''
     Action to create a comment in a data request. Access rights will be checked before
@@ -592,11 +1184,15 @@ def datarequest_comment(context, data_dict):
     comment.time = datetime.datetime.now()
 
     session.add(comment)
+    # The number of comments is updated in the same transaction
+    db.DataRequest.update_comment_count(comment.datarequest_id, 1, comment.time)
     session.commit()
+    _invalidate_pages(cache.LIST_PAGES, comment.datarequest_id)
 
-    return _dictize_comment(comment)
+    return _dictize_comments(context, [comment])[0]
 
 
+@metrics.instrumented
 def datarequest_comment_show(context, data_dict):
     '''
     Action to retrieve a comment. Access rights will be checked before getting the
@@ -629,9 +1225,10 @@ def datarequest_comment_show(context, data_dict):
     if not result:
         raise tk.ObjectNotFound('Comment %s not found in the data base' % comment_id)
 
-    return _dictize_comment(result[0])
+    return _dictize_comments(context, result[:1])[0]
 
 
+@metrics.instrumented
 def datarequest_comment_list(context, data_dict):
     '''
     Action to retrieve all the comments of a data request. Access rights will be checked before
@@ -662,13 +1259,10 @@ def datarequest_comment_list(context, data_dict):
     # Get comments
     comments_db = db.Comment.get_ordered_by_date(datarequest_id=datarequest_id)
 
-    comments_list = []
-    for comment in comments_db:
-        comments_list.append(_dictize_comment(comment))
-
-    return comments_list
+    return _dictize_comments(context, comments_db)
 
 
+@metrics.instrumented
 def datarequest_comment_update(context, data_dict):
     '''
     Action to update a comment of a data request. Access rights will be checked before
@@ -713,11 +1307,14 @@ def datarequest_comment_update(context, data_dict):
     _undictize_comment_basic(comment, data_dict)
 
     session.add(comment)
+    # The data request is modified when its comments are modified
+    db.DataRequest.set_update_time(comment.datarequest_id, datetime.datetime.now())
     session.commit()
 
-    return _dictize_comment(comment)
+    return _dictize_comments(context, [comment])[0]
 
 
+@metrics.instrumented
 def datarequest_comment_delete(context, data_dict):
     '''
     Action to delete a comment of a data request. Access rights will be checked before
@@ -753,6 +1350,9 @@ def datarequest_comment_delete(context, data_dict):
     comment = result[0]
 
     session.delete(comment)
+    # The number of comments is updated in the same transaction
+    db.DataRequest.update_comment_count(comment.datarequest_id, -1, datetime.datetime.now())
     session.commit()
+    _invalidate_pages(cache.LIST_PAGES, comment.datarequest_id)
 
-    return _dictize_comment(comment)
+    return _dictize_comments(context, [comment])[0]
@@ -25,6 +25,11 @@ def datarequest_create(context, data_dict):
     return {'success': True}
 
 
+def datarequest_create_many(context, data_dict):
+    # Only sysadmins (they are always authorized) can create data requests in bulk
+    return {'success': False}
+
+
 @tk.auth_allow_anonymous_access
 def datarequest_show(context, data_dict):
     return {'success': True}
@@ -48,6 +53,16 @@ def datarequest_index(context, data_dict):
     return {'success': True}
 
 
+@tk.auth_allow_anonymous_access
+def datarequest_last_modified(context, data_dict):
+    return {'success': True}
+
+
+def datarequest_metrics(context, data_dict):
+    # Only sysadmins (they are always authorized) can retrieve the metrics
+    return {'success': False}
+
+
 def datarequest_delete(context, data_dict):
     return auth_if_creator(context, data_dict, constants.DATAREQUEST_SHOW)
 
@@ -56,6 +71,22 @@ def datarequest_close(context, data_dict):
     return auth_if_creator(context, data_dict, constants.DATAREQUEST_SHOW)
 
 
+def datarequest_bulk_update(context, data_dict):
+    # Only sysadmins (they are always authorized) can update data requests in bulk
+    return {'success': False}
+
+
+def datarequest_export(context, data_dict):
+    # Only sysadmins (they are always authorized) can export the data requests,
+    # hidden ones included
+    return {'success': False}
+
+
+@tk.auth_allow_anonymous_access
+def datarequest_dataset_autocomplete(context, data_dict):
+    return {'success': True}
+
+
 def datarequest_comment(context, data_dict):
     return {'success': True}
 
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from ckan.plugins import toolkit as tk
+from collections import OrderedDict
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+# Keys of the counters cache
+OPEN_DATAREQUESTS_NUMBER = 'open_datarequests_number'
+
+# Scopes of the pages cache. Every page depends on ALL_PAGES (e.g. the number of
+# open data requests shown in the header) and on LIST_PAGES (lists of data
+# requests) or on the ID of the data request that it shows
+ALL_PAGES = 'all'
+LIST_PAGES = 'lists'
+
+_counters_cache = None
+_pages_cache = None
+
+
+class LRUCache(object):
+    '''
+    In-process cache with a limited number of entries. When the cache is full,
+    the least recently used entry is discarded. Entries expire after ``ttl``
+    seconds (a ``ttl`` of ``0`` or ``None`` means that entries never expire).
+    '''
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry):
+        return entry[0] is not None and entry[0] <= time.time()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or self._expired(entry):
+                self.misses += 1
+                return default
+
+            # Re-insert the entry to mark it as the most recently used one
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl
+        }
+
+
+class RedisCache(object):
+    '''
+    Cache shared by all the processes. Entries are stored (JSON encoded) in the
+    Redis instance used by CKAN (``ckan.redis.url``) and they expire after
+    ``ttl`` seconds. The number of entries is not limited (there is no
+    ``max_size``): they are only discarded when they expire or by the
+    ``maxmemory-policy`` of Redis (e.g. ``allkeys-lru``), so a ``ttl`` of ``0``
+    should not be used. When Redis is not available, the cache behaves as if
+    it were empty.
+    '''
+
+    def __init__(self, prefix='ckanext-datarequests', ttl=300):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._redis = None
+
+    def _connection(self):
+        if self._redis is None:
+            from ckan.lib.redis import connect_to_redis
+            self._redis = connect_to_redis()
+        return self._redis
+
+    def _key(self, key):
+        return '%s:%s' % (self.prefix, key)
+
+    def get(self, key, default=None):
+        try:
+            value = self._connection().get(self._key(key))
+        except Exception as e:
+            log.warn(e)
+            value = None
+
+        if value is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        try:
+            self._connection().set(self._key(key), json.dumps(value), ex=self.ttl or None)
+        except Exception as e:
+            log.warn(e)
+
+    def delete(self, key):
+        try:
+            self._connection().delete(self._key(key))
+        except Exception as e:
+            log.warn(e)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'ttl': self.ttl
+        }
+
+
+class FileCache(object):
+    '''
+    Cache shared by all the processes of the same server. Every entry is stored
+    (JSON encoded) in a file of the ``path`` directory. When there are more than
+    ``max_size`` entries, the least recently used ones are removed. Entries
+    expire after ``ttl`` seconds (a ``ttl`` of ``0`` or ``None`` means that
+    entries never expire). When the directory cannot be used, the cache behaves
+    as if it were empty.
+    '''
+
+    def __init__(self, path, max_size=1000, ttl=300):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest())
+
+    def get(self, key, default=None):
+        file_name = self._file(key)
+
+        try:
+            with open(file_name) as f:
+                expires, value = json.load(f)
+
+            if expires is not None and expires <= time.time():
+                self.delete(key)
+                value = None
+            else:
+                # The modification time is used to know the least recently used entries
+                os.utime(file_name, None)
+        except (IOError, OSError, ValueError):
+            value = None
+
+        if value is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+
+            # The entry is written in a temporary file and then renamed, so other
+            # processes never read incomplete entries
+            fd, temp_file_name = tempfile.mkstemp(dir=self.path, prefix='.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump([expires, value], f)
+            os.rename(temp_file_name, self._file(key))
+
+            self._discard_least_recently_used()
+        except (IOError, OSError) as e:
+            log.warn(e)
+
+    def _discard_least_recently_used(self):
+        file_names = [os.path.join(self.path, name) for name in os.listdir(self.path) if not name.startswith('.')]
+        excess = len(file_names) - self.max_size
+
+        if excess > 0:
+            for file_name in sorted(file_names, key=os.path.getmtime)[:excess]:
+                self._remove(file_name)
+
+    def _remove(self, file_name):
+        try:
+            os.remove(file_name)
+        except OSError:
+            # It has been removed by other process
+            pass
+
+    def delete(self, key):
+        self._remove(self._file(key))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'max_size': self.max_size,
+            'ttl': self.ttl
+        }
+
+
+class PagesCache(object):
+    '''
+    Cache of the pages rendered for anonymous users. The keys of the pages
+    include the versions of their scopes, so all the pages of a scope are
+    invalidated at once by changing its version. Invalidated pages are not
+    removed: they are discarded when they expire or when the cache is full.
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _version(self, scope):
+        key = 'version:%s' % scope
+        version = self.cache.get(key)
+
+        if version is None:
+            version = uuid.uuid4().hex
+            self.cache.set(key, version)
+
+        return version
+
+    def _key(self, key, scopes):
+        return u'%s|%s' % (key, '|'.join(self._version(scope) for scope in scopes))
+
+    def get(self, key, scopes):
+        return self.cache.get(self._key(key, scopes))
+
+    def set(self, key, scopes, page):
+        self.cache.set(self._key(key, scopes), page)
+
+    def invalidate(self, *scopes):
+        for scope in scopes:
+            self.cache.delete('version:%s' % scope)
+
+
+def create_cache(backend, max_size=1000, ttl=300, prefix='ckanext-datarequests', path=None):
+    '''
+    Returns a cache for the given backend: "memory" (one cache per process),
+    "file" (one cache shared by all the processes of the server, stored in the
+    path directory) or "redis" (one cache shared by all the processes, which
+    does not use max_size)
+    '''
+    if backend == 'redis':
+        return RedisCache(prefix, ttl)
+    elif backend == 'memory':
+        return LRUCache(max_size, ttl)
+    elif backend == 'file':
+        return FileCache(path or os.path.join(tempfile.gettempdir(), prefix), max_size, ttl)
+    else:
+        raise ValueError('Unknown cache backend: %s' % backend)
+
+
+def get_counters_cache():
+    '''
+    Returns the cache of the counters shown in every page of the portal (such
+    as the number of open data requests of the header badge)
+    '''
+    global _counters_cache
+
+    if _counters_cache is None:
+        _counters_cache = create_cache(config.get('ckan.datarequests.counters_cache.backend', 'memory'),
+                                       ttl=int(config.get('ckan.datarequests.counters_cache.ttl', 60)))
+
+    return _counters_cache
+
+
+def get_pages_cache():
+    '''
+    Returns the cache of the pages rendered for anonymous users (lists of data
+    requests and data requests) or None if it is not enabled. Pages are
+    invalidated in the cache, so it is shared by the processes of the server
+    (file) by default: with a memory cache, the other processes would keep
+    serving the invalidated pages until they expire
+    '''
+    global _pages_cache
+
+    if _pages_cache is None and tk.asbool(config.get('ckan.datarequests.pages_cache.enabled', False)):
+        _pages_cache = PagesCache(create_cache(config.get('ckan.datarequests.pages_cache.backend', 'file'),
+                                               max_size=int(config.get('ckan.datarequests.pages_cache.size', 1000)),
+                                               ttl=int(config.get('ckan.datarequests.pages_cache.ttl', 60)),
+                                               prefix='ckanext-datarequests-pages',
+                                               path=config.get('ckan.datarequests.pages_cache.path', None)))
+
+    return _pages_cache
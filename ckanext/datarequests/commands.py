@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+import constants
+import db
+import export
+import importer
+import markup
+import sys
+import time
+
+from ckan.lib.cli import CkanCommand
+
+
+class DataRequestsCommand(CkanCommand):
+    '''Manages the data requests extension
+
+    Usage:
+        paster datarequests initdb -c <path to config file>
+            - Creates the data requests tables or migrates them to the
+              current schema
+
+        paster datarequests rebuild-comment-count -c <path to config file>
+            - Computes the number of comments of every data request again
+              from the comments table
+
+        paster datarequests rebuild-comment-html -c <path to config file>
+            - Renders the HTML of every comment again (links and line
+              breaks). Comments are processed in batches
+
+        paster datarequests export <csv|jsonl> [comments] [-f <file>] -c <path to config file>
+            - Writes all the data requests (and their comments, when
+              "comments" is included) to the file or to the standard output.
+              Data requests are read in batches, so the memory used does not
+              depend on their number
+
+        paster datarequests import <file> [-f <errors file>] -c <path to config file>
+            - Imports the data requests and the comments of a JSON lines file
+              (such as the files generated by the export command). IDs and
+              times are kept, and users, organizations and datasets are
+              mapped by name. Records are stored in batches and the errors of
+              the invalid ones are written to the errors file (or to the
+              standard output)
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = None
+    min_args = 1
+
+    # Number of comments rendered in each transaction
+    batch_size = 500
+
+    def command(self):
+        self._load_config()
+
+        cmd = self.args[0]
+
+        if cmd == 'initdb':
+            self.initdb()
+        elif cmd == 'rebuild-comment-count':
+            self.rebuild_comment_count()
+        elif cmd == 'rebuild-comment-html':
+            self.rebuild_comment_html()
+        elif cmd == 'export':
+            self.export()
+        elif cmd == 'import':
+            self.import_file()
+        else:
+            print 'Command "%s" not recognized' % cmd
+            print self.usage
+
+    def initdb(self):
+        db.setup_db(model)
+        print 'Data requests tables are up to date'
+
+    def rebuild_comment_count(self):
+        db.init_db(model)
+        db.DataRequest.rebuild_comment_count()
+        model.Session.commit()
+        print 'The number of comments of the data requests has been rebuilt'
+
+    def rebuild_comment_html(self):
+        db.init_db(model)
+        rendered = 0
+        last_id = None
+
+        while True:
+            comments = db.Comment.get_ordered_by_id(after=last_id, limit=self.batch_size)
+            if not comments:
+                break
+
+            for comment in comments:
+                comment.comment_html = markup.render_comment(comment.comment or '')
+
+            model.Session.commit()
+            rendered += len(comments)
+            last_id = comments[-1].id
+
+        print 'The HTML of %d comments has been rebuilt' % rendered
+
+    def export(self):
+        export_format = self.args[1] if len(self.args) > 1 else None
+        include_comments = 'comments' in self.args[2:]
+
+        if export_format not in constants.DATAREQUESTS_EXPORT_FORMATS:
+            print 'Export format must be one of: %s' % ', '.join(constants.DATAREQUESTS_EXPORT_FORMATS)
+            return
+
+        # The command is run as the site user (a sysadmin)
+        site_user = tk.get_action('get_site_user')({'ignore_auth': True}, {})
+        context = {'model': model, 'session': model.Session, 'user': site_user['name']}
+        tk.check_access(constants.DATAREQUEST_EXPORT, context, {})
+
+        output = open(self.options.file_path, 'wb') if self.options.file_path else sys.stdout
+
+        try:
+            for chunk in export.export(export_format, include_comments):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        if self.options.file_path:
+            print 'The data requests have been exported to %s' % self.options.file_path
+
+    def import_file(self):
+        if len(self.args) < 2:
+            print 'The file to be imported is required'
+            return
+
+        errors_output = open(self.options.file_path, 'w') if self.options.file_path else sys.stdout
+        start = time.time()
+
+        def progress(datarequests_importer):
+            elapsed = time.time() - start
+            print '%d lines processed (%d lines/s)' % (datarequests_importer.lines,
+                                                       datarequests_importer.lines / elapsed if elapsed else 0)
+
+        try:
+            datarequests_importer = importer.Importer(errors_output)
+            with open(self.args[1]) as lines:
+                datarequests_importer.import_lines(lines, progress)
+        finally:
+            if errors_output is not sys.stdout:
+                errors_output.close()
+
+        elapsed = time.time() - start
+        print '%d data requests and %d comments imported (%d errors) in %.1f seconds (%d lines/s)' % (
+            datarequests_importer.datarequests, datarequests_importer.comments, datarequests_importer.errors,
+            elapsed, datarequests_importer.lines / elapsed if elapsed else 0)
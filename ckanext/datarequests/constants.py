@@ -20,11 +20,17 @@ import enum
 
 DATAREQUESTS_MAIN_PATH = 'datarequest'
 DATAREQUEST_CREATE = 'datarequest_create'
+DATAREQUEST_CREATE_MANY = 'datarequest_create_many'
 DATAREQUEST_SHOW = 'datarequest_show'
 DATAREQUEST_UPDATE = 'datarequest_update'
 DATAREQUEST_INDEX = 'datarequest_index'
 DATAREQUEST_DELETE = 'datarequest_delete'
 DATAREQUEST_CLOSE = 'datarequest_close'
+DATAREQUEST_BULK_UPDATE = 'datarequest_bulk_update'
+DATAREQUEST_EXPORT = 'datarequest_export'
+DATAREQUEST_DATASET_AUTOCOMPLETE = 'datarequest_dataset_autocomplete'
+DATAREQUEST_LAST_MODIFIED = 'datarequest_last_modified'
+DATAREQUEST_METRICS = 'datarequest_metrics'
 DATAREQUEST_COMMENT = 'datarequest_comment'
 DATAREQUEST_COMMENT_LIST = 'datarequest_comment_list'
 DATAREQUEST_COMMENT_SHOW = 'datarequest_comment_show'
@@ -34,6 +40,22 @@ NAME_MAX_LENGTH = 100
 DESCRIPTION_MAX_LENGTH = 1000
 COMMENT_MAX_LENGTH = DESCRIPTION_MAX_LENGTH
 DATAREQUESTS_PER_PAGE = 10
+DATAREQUESTS_SORT_NEWEST = 'newest'
+DATAREQUESTS_SORT_MOST_DISCUSSED = 'most_discussed'
+DATAREQUESTS_SORT_RELEVANCE = 'relevance'
+DATASETS_AUTOCOMPLETE_LIMIT = 10
+DATASETS_AUTOCOMPLETE_MAX_LIMIT = 100
+DATAREQUESTS_CREATE_MANY_MAX_SIZE = 1000
+DATAREQUESTS_BULK_CLOSE = 'close'
+DATAREQUESTS_BULK_REOPEN = 'reopen'
+DATAREQUESTS_BULK_VISIBILITY = 'visibility'
+DATAREQUESTS_BULK_OPERATIONS = [DATAREQUESTS_BULK_CLOSE, DATAREQUESTS_BULK_REOPEN, DATAREQUESTS_BULK_VISIBILITY]
+DATAREQUESTS_EXPORT_CSV = 'csv'
+DATAREQUESTS_EXPORT_JSONL = 'jsonl'
+DATAREQUESTS_EXPORT_FORMATS = [DATAREQUESTS_EXPORT_CSV, DATAREQUESTS_EXPORT_JSONL]
+DATAREQUESTS_EXPORT_BATCH_SIZE = 1000
+DATAREQUESTS_IMPORT_BATCH_SIZE = 1000
+DATAREQUESTS_SORT_OPTIONS = [DATAREQUESTS_SORT_NEWEST, DATAREQUESTS_SORT_MOST_DISCUSSED, DATAREQUESTS_SORT_RELEVANCE]
 
 class DataRequestState(enum.Enum):
     hidden = 0
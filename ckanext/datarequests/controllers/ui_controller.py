@@ -24,33 +24,27 @@ import ckan.lib.base as base
 import ckan.model as model
 import ckan.plugins as plugins
 import ckan.lib.helpers as helpers
+import ckanext.datarequests.cache as cache
 import ckanext.datarequests.constants as constants
+import ckanext.datarequests.export as export
 import collections
+import datetime
 import functools
-import re
+import hashlib
+import json
+import time
 from pylons import config
 
 from ckan.common import request
+from email.utils import formatdate, mktime_tz, parsedate_tz
 from urllib import urlencode
 
 
-_link = re.compile(r'(?:(https?://)|(www\.))(\S+\b/?)([!"#$%&\'()*+,\-./:;<=>?@[\\\]^_`{|}~]*)(\s|$)', re.I)
-
 log = logging.getLogger(__name__)
 tk = plugins.toolkit
 c = tk.c
 
 
-def convert_links(text):
-    def replace(match):
-        groups = match.groups()
-        protocol = groups[0] or ''  # may be None
-        www_lead = groups[1] or ''  # may be None
-        return '<a href="{0}{1}{2}" target="_blank">{0}{1}{2}</a>{3}{4}'.format(
-            protocol, www_lead, *groups[2:])
-    return _link.sub(replace, text)
-
-
 def _get_errors_summary(errors):
     errors_summary = {}
 
@@ -65,6 +59,27 @@ def _encode_params(params):
             for k, v in params]
 
 
+def _http_date(date):
+    # Times are stored in the local time of the server
+    return formatdate(time.mktime(date.timetuple()), usegmt=True)
+
+
+def _modified_since(date, if_modified_since):
+    since = parsedate_tz(if_modified_since)
+    # HTTP dates do not include fractions of a second
+    return since is None or int(time.mktime(date.timetuple())) > mktime_tz(since)
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def _etag_matches(etag, if_none_match):
+    # If-None-Match uses the weak comparison (the W/ prefix is ignored)
+    etags = [_strip_weak(value.strip()) for value in if_none_match.split(',')]
+    return '*' in etags or _strip_weak(etag) in etags
+
+
 def url_with_params(url, params):
     params = _encode_params(params)
     return url + u'?' + urlencode(params)
@@ -94,21 +109,116 @@ class DataRequestsUI(base.BaseController):
         return {'model': model, 'session': model.Session,
                 'user': c.user, 'auth_user_obj': c.userobj}
 
-    def _show_index(self, user_id, organization_id, include_organization_facet, url_func, file_to_render):
+    def _not_modified(self, data_dict, include_last_modified=False):
+        '''
+        Sets the validators of the page (ETag and, if include_last_modified is
+        True, Last-Modified) from the last modification of the data requests
+        that it shows (see datarequest_last_modified). Returns True (and sets
+        the 304 status) when the copy of the client is still valid, so the page
+        does not have to be generated.
+        '''
+        # Pages that include flash messages must be generated to show them
+        if request.method not in ('GET', 'HEAD') or helpers.are_there_flash_messages():
+            return False
+
+        context = self._get_context()
+        last_modified = tk.get_action(constants.DATAREQUEST_LAST_MODIFIED)(context, data_dict)
+
+        # Pages also depend on the user that requests them and on the language
+        validator = u'|'.join(unicode(value) for value in (last_modified['count'], last_modified['last_modified'],
+                                                             c.user, helpers.lang()))
+        etag = 'W/"%s"' % hashlib.sha1(validator.encode('utf-8')).hexdigest()
+        tk.response.headers['ETag'] = etag
+
+        # Last-Modified is not valid for lists: it does not change when a data request is deleted
+        date = None
+        if include_last_modified and last_modified['last_modified']:
+            date = datetime.datetime.strptime(last_modified['last_modified'][:19], '%Y-%m-%dT%H:%M:%S')
+            tk.response.headers['Last-Modified'] = _http_date(date)
+
+        # If-Modified-Since is ignored when If-None-Match is included
+        if_none_match = request.headers.get('If-None-Match', None)
+        if_modified_since = request.headers.get('If-Modified-Since', None)
+
+        if if_none_match:
+            not_modified = _etag_matches(etag, if_none_match)
+        elif if_modified_since and date:
+            not_modified = not _modified_since(date, if_modified_since)
+        else:
+            not_modified = False
+
+        if not_modified:
+            tk.response.status_int = 304
+
+        return not_modified
+
+    def _get_pages_cache(self):
+        '''
+        Returns the cache of the pages rendered for anonymous users or None if
+        the page cannot be cached: the cache is not enabled, the user is logged
+        in, the request is not a GET or the page includes flash messages
+        '''
+        if c.user or request.method != 'GET' or helpers.are_there_flash_messages():
+            return None
+
+        return cache.get_pages_cache()
+
+    def _page_key(self):
+        # Pages depend on the route, the query string and the language
+        return u'%s|%s' % (request.path_qs, helpers.lang())
+
+    def _get_cached_page(self, scopes):
+        pages_cache = self._get_pages_cache()
+        return pages_cache.get(self._page_key(), scopes) if pages_cache else None
+
+    def _cache_page(self, scopes, page):
+        pages_cache = self._get_pages_cache()
+
+        if pages_cache:
+            pages_cache.set(self._page_key(), scopes, page)
+
+        return page
+
+    def _show_index(self, user_id, organization_id, include_organization_facet, url_func, file_to_render,
+                    load_page_data=None):
 
         def pager_url(q=None, page=None):
             params = list()
             params.append(('page', page))
+            if search_query:
+                params.append(('q', search_query))
+            if sort:
+                params.append(('sort', sort))
+            # The link to the next page includes the cursor returned by the API so
+            # that page can be retrieved without skipping all the previous ones
+            if next_cursor and page == current_page + 1:
+                params.append(('after', next_cursor))
             return url_func(params)
 
+        next_cursor = None
+        search_query = request.GET.get('q', None)
+        sort = request.GET.get('sort', None)
+
         try:
             context = self._get_context()
             context['ignore_auth'] = config.get('ckan.datarequests.ignore_auth', False)
-            page = int(request.GET.get('page', 1))
+            current_page = page = int(request.GET.get('page', 1))
             limit = constants.DATAREQUESTS_PER_PAGE
             offset = (page - 1) * constants.DATAREQUESTS_PER_PAGE
             data_dict = {'offset': offset, 'limit': limit}
 
+            # When a cursor is received, it is used instead of the offset (keyset pagination).
+            # The page number is still needed to render the pager.
+            after = request.GET.get('after', None)
+            if after:
+                data_dict['after'] = after
+
+            if search_query:
+                data_dict['q'] = search_query
+
+            if sort:
+                data_dict['sort'] = sort
+
             state = request.GET.get('state', None)
             if state:
                 data_dict['closed'] = True if state == 'closed' else False
@@ -128,7 +238,21 @@ class DataRequestsUI(base.BaseController):
                 data_dict['user_id'] = user_id
 
             tk.check_access(constants.DATAREQUEST_INDEX, context, data_dict)
+
+            if self._not_modified(data_dict):
+                return ''
+
+            scopes = (cache.ALL_PAGES, cache.LIST_PAGES)
+            cached_page = self._get_cached_page(scopes)
+            if cached_page is not None:
+                return cached_page
+
+            # Data shown by the page that is not included in the list (e.g. the organization)
+            if load_page_data:
+                load_page_data()
+
             datarequests_list = tk.get_action(constants.DATAREQUEST_INDEX)(context, data_dict)
+            next_cursor = datarequests_list.get('next_cursor', None)
             c.datarequest_count = datarequests_list['count']
             c.datarequests = datarequests_list['result']
             c.search_facets = datarequests_list['facets']
@@ -150,11 +274,18 @@ class DataRequestsUI(base.BaseController):
             if include_organization_facet is True:
                 c.facet_titles['organization'] = tk._('Organizations')
 
-            return tk.render(file_to_render)
+            return self._cache_page(scopes, tk.render(file_to_render))
         except ValueError as e:
             # This exception should only occur if the page value is not valid
             log.warn(e)
             tk.abort(400, tk._('"page" parameter must be an integer'))
+        except tk.ValidationError as e:
+            # This exception should only occur if the cursor or the order are not valid
+            log.warn(e)
+            if 'Sort' in e.error_dict:
+                tk.abort(400, tk._('"sort" parameter is not valid'))
+            else:
+                tk.abort(400, tk._('"after" parameter is not valid'))
         except tk.NotAuthorized as e:
             log.warn(e)
             tk.abort(401, tk._('Unauthorized to list Data Requests'))
@@ -215,12 +346,21 @@ class DataRequestsUI(base.BaseController):
 
         try:
             tk.check_access(constants.DATAREQUEST_SHOW, context, data_dict)
+
+            if self._not_modified(data_dict, True):
+                return ''
+
+            scopes = (cache.ALL_PAGES, id)
+            cached_page = self._get_cached_page(scopes)
+            if cached_page is not None:
+                return cached_page
+
             c.datarequest = tk.get_action(constants.DATAREQUEST_SHOW)(context, data_dict)
 
             context_ignore_auth = context.copy()
             context_ignore_auth['ignore_auth'] = True
 
-            return tk.render('datarequests/show.html')
+            return self._cache_page(scopes, tk.render('datarequests/show.html'))
         except tk.ObjectNotFound as e:
             tk.abort(404, tk._('Data Request %s not found') % id)
         except tk.NotAuthorized as e:
@@ -270,16 +410,19 @@ class DataRequestsUI(base.BaseController):
                                % id))
 
     def organization_datarequests(self, id):
-        context = self._get_context()
-        c.group_dict = tk.get_action('organization_show')(context, {'id': id})
+        def load_organization():
+            c.group_dict = tk.get_action('organization_show')(self._get_context(), {'id': id})
+
         url_func = functools.partial(org_datarequest_url, id=id)
-        return self._show_index(None, id, False, url_func, 'organization/datarequests.html')
+        return self._show_index(None, id, False, url_func, 'organization/datarequests.html', load_organization)
 
     def user_datarequests(self, id):
-        context = self._get_context()
-        c.user_dict = tk.get_action('user_show')(context, {'id': id, 'include_num_followers': True})
+        def load_user():
+            c.user_dict = tk.get_action('user_show')(self._get_context(), {'id': id, 'include_num_followers': True})
+
         url_func = functools.partial(user_datarequest_url, id=id)
-        return self._show_index(id, request.GET.get('organization', ''), True, url_func, 'user/datarequests.html')
+        return self._show_index(id, request.GET.get('organization', ''), True, url_func, 'user/datarequests.html',
+                                load_user)
 
     def close(self, id):
         data_dict = {'id': id}
@@ -289,23 +432,12 @@ class DataRequestsUI(base.BaseController):
         c.datarequest = {}
 
         def _return_page(errors={}, errors_summary={}):
-            # Get datasets (if the data req belongs to an organization, only the one that
-            # belongs to the organization are shown)
-            organization_id = c.datarequest.get('organization_id', '')
-            if organization_id:
-                base_datasets = tk.get_action('organization_show')({'ignore_auth': True}, {'id': organization_id, 'include_datasets': True})['packages']
-            else:
-                # FIXME: At this time, only the 500 last modified/created datasets are retrieved.
-                # We assume that a user will close their data request with a recently added or modified dataset
-                # In the future, we should fix this with an autocomplete form...
-                # Expected for CKAN 2.3
-                base_datasets = tk.get_action('package_search')({'ignore_auth': True}, {'rows': 500})['results']
-
-            c.datasets = []
+            # Datasets are not loaded here. The form looks them up while the user
+            # types (see dataset_autocomplete). If the data req belongs to an
+            # organization, only the ones that belong to the organization are shown
             c.errors = errors
             c.errors_summary = errors_summary
-            for dataset in base_datasets:
-                c.datasets.append({'name': dataset.get('name'), 'title': dataset.get('title')})
+            c.accepted_dataset_id = request.POST.get('accepted_dataset_id', '')
 
             return tk.render('datarequests/close.html')
 
@@ -338,6 +470,49 @@ class DataRequestsUI(base.BaseController):
             tk.abort(401, tk._('You are not authorized to close the Data Request %s'
                                % id))
 
+    def dataset_autocomplete(self):
+        data_dict = {
+            'q': request.GET.get('incomplete', ''),
+            'organization_id': request.GET.get('organization_id', None),
+            'limit': request.GET.get('limit', constants.DATASETS_AUTOCOMPLETE_LIMIT)
+        }
+
+        try:
+            context = self._get_context()
+            datasets = tk.get_action(constants.DATAREQUEST_DATASET_AUTOCOMPLETE)(context, data_dict)
+
+            # Same format as the CKAN dataset autocomplete API (used by the autocomplete module)
+            tk.response.headers['Content-Type'] = 'application/json;charset=utf-8'
+            return json.dumps({'ResultSet': {'Result': datasets}})
+        except tk.ValidationError as e:
+            log.warn(e)
+            tk.abort(400, tk._('"limit" parameter is not valid'))
+        except tk.ObjectNotFound as e:
+            log.warn(e)
+            tk.abort(404, tk._('Organization %s not found') % data_dict['organization_id'])
+        except tk.NotAuthorized as e:
+            log.warn(e)
+            tk.abort(401, tk._('You are not authorized to look up datasets'))
+
+    def export(self):
+        export_format = request.GET.get('format', constants.DATAREQUESTS_EXPORT_CSV)
+        include_comments = tk.asbool(request.GET.get('comments', False))
+
+        try:
+            # The export includes hidden data requests
+            tk.check_access(constants.DATAREQUEST_EXPORT, self._get_context(), {})
+
+            if export_format not in constants.DATAREQUESTS_EXPORT_FORMATS:
+                tk.abort(400, tk._('"format" parameter is not valid'))
+            else:
+                # The data requests are written to the response while they are read
+                tk.response.headers['Content-Type'] = export.CONTENT_TYPES[export_format]
+                tk.response.headers['Content-Disposition'] = 'attachment; filename="datarequests.%s"' % export_format
+                return export.export(export_format, include_comments)
+        except tk.NotAuthorized as e:
+            log.warn(e)
+            tk.abort(403, tk._('You are not authorized to export the Data Requests'))
+
     def comment(self, id):
         try:
             context = self._get_context()
@@ -345,6 +520,9 @@ class DataRequestsUI(base.BaseController):
             data_dict_dr_show = {'id': id}
             tk.check_access(constants.DATAREQUEST_COMMENT_LIST, context, data_dict_comment_list)
 
+            if self._not_modified(data_dict_dr_show, True):
+                return ''
+
             # Raises 404 Not Found if the data request does not exist
             c.datarequest = tk.get_action(constants.DATAREQUEST_SHOW)(context, data_dict_dr_show)
 
@@ -378,12 +556,9 @@ class DataRequestsUI(base.BaseController):
             # Comments should be retrieved once that the comment has been created
             get_comments_data_dict = {'datarequest_id': id}
             c.comments = tk.get_action(constants.DATAREQUEST_COMMENT_LIST)(context, get_comments_data_dict)
-
-            # Replace URLs by links
-            # Replace new lines by HTML line break
-            for comment in c.comments:
-                comment['comment'] = convert_links(comment['comment'])
-                comment['comment'] = comment['comment'].replace('\n', '<br/>')
+            # The badge shows the number of comments of the data request, which was read
+            # before the comment was created
+            c.datarequest['comments_count'] = len(c.comments)
 
             return tk.render('datarequests/comment.html')
 
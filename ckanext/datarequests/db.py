@@ -18,25 +18,83 @@
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
 import constants
+import logging
+import re
 import sqlalchemy as sa
 import uuid
 
-from sqlalchemy import func
+from sqlalchemy import and_, func, or_
 from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from ckan.model.meta import Session
 
+log = logging.getLogger(__name__)
+
 DataRequest = None
 Comment = None
 
+datarequests_table = None
+comments_table = None
+
+# Set once the tables have been created and migrated by setup_db
+_schema_ready = False
+
+# Whether the unique title index exists (see has_unique_title_index)
+_unique_title_index = None
+
+# Secondary indexes (name: indexed columns). They are created by migrate_indexes
+# both for new installations and for the existing ones
+DATAREQUESTS_INDEXES = {
+    'datarequests_closed_visibility_open_time_idx': '(closed, visibility, open_time DESC)',
+    'datarequests_organization_id_open_time_idx': '(organization_id, open_time)',
+    'datarequests_user_id_open_time_idx': '(user_id, open_time)',
+    'datarequests_comment_count_open_time_idx': '(comment_count DESC, open_time DESC)'
+}
+
+# Titles are unique (case insensitive). The data base rejects repeated titles
+# even when two data requests are created at the same time
+UNIQUE_TITLE_INDEX = 'datarequests_lower_title_key'
+
+# Indexes replaced by other ones. They are dropped by setup_db
+OBSOLETE_INDEXES = {
+    'datarequests_lower_title_idx': UNIQUE_TITLE_INDEX
+}
+
+# Full text search. PostgreSQL uses a GIN index on the text search vector of
+# the title and the description. The expression used in the queries must be the
+# same one used in the index. SQLite (local and test installations) uses a FTS5
+# table kept in sync with the datarequests table by triggers.
+SEARCH_CONFIG = 'english'
+SEARCH_VECTOR = "to_tsvector('%s', coalesce(title, '') || ' ' || coalesce(description, ''))" % SEARCH_CONFIG
+SEARCH_INDEXES = {
+    'datarequests_search_idx': 'USING gin (%s)' % SEARCH_VECTOR
+}
+SEARCH_TABLE = 'datarequests_fts'
+
+COMMENTS_INDEXES = {
+    'datarequests_comments_datarequest_id_time_idx': '(datarequest_id, time)'
+}
+
+
+# Maximum number of IDs included in the IN clause of the bulk updates
+BULK_IDS_CHUNK_SIZE = 500
+
 
 def uuid4():
     return str(uuid.uuid4())
 
 
 def init_db(model):
+    '''
+    Maps the DataRequest and Comment classes to their tables. The data base
+    is not accessed, so it can be called on every action. Use setup_db to
+    create and migrate the tables.
+    '''
 
     global DataRequest
     global Comment
+    global datarequests_table
+    global comments_table
 
     if DataRequest is None:
 
@@ -55,10 +113,287 @@ def init_db(model):
                 return query.filter(func.lower(cls.title) == func.lower(title)).first() is not None
 
             @classmethod
-            def get_ordered_by_date(cls, **kw):
-                '''Personalized query'''
+            def get_existing_titles(cls, titles):
+                '''
+                Returns the set of the given titles (lowercased) that are already
+                used by a Data Request, with a single query
+                '''
+                titles = set(title.lower() for title in titles)
+
+                if not titles:
+                    return set()
+
+                query = model.Session.query(func.lower(cls.title)).autoflush(False)
+                return set(title for title, in query.filter(func.lower(cls.title).in_(titles)))
+
+            @classmethod
+            def get_existing_ids(cls, ids):
+                '''Returns the set of the given IDs that belong to a Data Request, with a single query'''
+                ids = set(ids)
+
+                if not ids:
+                    return set()
+
+                query = model.Session.query(cls.id).autoflush(False)
+                return set(datarequest_id for datarequest_id, in query.filter(cls.id.in_(ids)))
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''
+                Inserts the given data requests (list of dicts with the values of
+                the columns) with a single bulk INSERT. The rows must have the
+                same keys. The change is committed with the rest of the transaction.
+                '''
+                model.Session.execute(datarequests_table.insert(), rows)
+
+            @classmethod
+            def _search(cls, query, q):
+                '''
+                Filters the query by the words included in q (they are looked
+                up in the title and the description). Returns the filtered query
+                and the clause that orders it by relevance (most relevant first)
+                '''
+                dialect = model.Session.get_bind().dialect.name
+
+                if dialect == 'postgresql':
+                    vector = sa.literal_column(SEARCH_VECTOR)
+                    tsquery = func.plainto_tsquery(SEARCH_CONFIG, q)
+                    return query.filter(vector.op('@@')(tsquery)), func.ts_rank(vector, tsquery).desc()
+                elif dialect == 'sqlite':
+                    fts_query = _fts_query(q)
+                    if not fts_query:
+                        # A text without words (e.g. only punctuation) is not a valid FTS5
+                        # query. It matches no data request (as in PostgreSQL)
+                        return query.filter(sa.false()), cls.open_time.desc()
+
+                    fts_table = sa.table(SEARCH_TABLE, sa.column('rowid'))
+                    match = sa.literal_column(SEARCH_TABLE).op('MATCH')(fts_query)
+                    matches = sa.select([fts_table.c.rowid]).where(match)
+                    # bm25 returns lower values for the most relevant rows
+                    rank = sa.select([func.bm25(sa.literal_column(SEARCH_TABLE))]) \
+                        .where(and_(match, fts_table.c.rowid == sa.literal_column('datarequests.rowid'))).as_scalar()
+                    return query.filter(sa.literal_column('datarequests.rowid').in_(matches)), rank
+                else:
+                    # Data bases without a full text search engine: unranked search
+                    pattern = '%%%s%%' % q
+                    return query.filter(or_(cls.title.ilike(pattern), cls.description.ilike(pattern))), \
+                        cls.open_time.desc()
+
+            @classmethod
+            def _filter(cls, query, q=None, **kw):
+                '''Filters the query by the given fields and, if q is given, by its words'''
+                query = query.filter_by(**kw)
+
+                if q:
+                    query = cls._search(query, q)[0]
+
+                return query
+
+            @classmethod
+            def get_ordered_by_date(cls, offset=None, limit=None, after=None, **kw):
+                '''
+                Personalized query. When offset and/or limit are given, the
+                page is cut in the data base so only its rows are loaded.
+                after is an (open_time, id) tuple: only the data requests that
+                come after it in the ordering are returned (keyset pagination)
+                '''
                 query = model.Session.query(cls).autoflush(False)
-                return query.filter_by(**kw).order_by(cls.open_time.desc()).all()
+                query = cls._filter(query, **kw)
+
+                if after:
+                    open_time, datarequest_id = after
+                    query = query.filter(or_(cls.open_time < open_time,
+                                             and_(cls.open_time == open_time, cls.id < datarequest_id)))
+
+                # The ID is used as tie-breaker so the order is stable between pages
+                query = query.order_by(cls.open_time.desc(), cls.id.desc())
+
+                if offset:
+                    query = query.offset(offset)
+
+                if limit is not None:
+                    query = query.limit(limit)
+
+                return query.all()
+
+            @classmethod
+            def get_ordered_by_comments(cls, offset=None, limit=None, **kw):
+                '''
+                Returns the data requests ordered by their number of comments
+                (most discussed first). Ties are ordered by date.
+                '''
+                query = model.Session.query(cls).autoflush(False)
+                query = cls._filter(query, **kw)
+                query = query.order_by(cls.comment_count.desc(), cls.open_time.desc(), cls.id.desc())
+
+                if offset:
+                    query = query.offset(offset)
+
+                if limit is not None:
+                    query = query.limit(limit)
+
+                return query.all()
+
+            @classmethod
+            def get_ordered_by_relevance(cls, q, offset=None, limit=None, **kw):
+                '''
+                Returns the data requests that contain the words included in q
+                ordered by relevance. Ties are ordered by date.
+                '''
+                query = model.Session.query(cls).autoflush(False)
+                query, relevance = cls._search(query.filter_by(**kw), q)
+                query = query.order_by(relevance, cls.open_time.desc(), cls.id.desc())
+
+                if offset:
+                    query = query.offset(offset)
+
+                if limit is not None:
+                    query = query.limit(limit)
+
+                return query.all()
+
+            @classmethod
+            def update_comment_count(cls, datarequest_id, increment, update_time=None):
+                '''
+                Adds increment to the number of comments of a data request. The
+                column is updated in the data base (UPDATE ... SET comment_count =
+                comment_count + increment) so concurrent comments are not lost.
+                When update_time is given, it's set as the last modification time.
+                The change is committed with the rest of the transaction.
+                '''
+                values = {cls.comment_count: cls.comment_count + increment}
+
+                if update_time is not None:
+                    values[cls.update_time] = update_time
+
+                query = model.Session.query(cls).filter_by(id=datarequest_id)
+                query.update(values, synchronize_session=False)
+
+            @classmethod
+            def set_update_time(cls, datarequest_id, update_time):
+                '''
+                Sets the last modification time of a data request without loading
+                it (e.g. when one of its comments is updated). The change is
+                committed with the rest of the transaction.
+                '''
+                query = model.Session.query(cls).filter_by(id=datarequest_id)
+                query.update({cls.update_time: update_time}, synchronize_session=False)
+
+            @classmethod
+            def _update_many(cls, values, condition, ids=None, **kw):
+                '''
+                Updates the data requests that match the filters and the condition
+                (and whose ID is included in ids, when given) with an UPDATE
+                statement (one per chunk of IDs). Returns the number of updated
+                data requests. The change is committed with the rest of the
+                transaction.
+                '''
+                query = cls._filter(model.Session.query(cls), **kw).filter(condition)
+
+                if ids is None:
+                    return query.update(values, synchronize_session=False)
+
+                ids = list(ids)
+                updated = 0
+
+                for start in range(0, len(ids), BULK_IDS_CHUNK_SIZE):
+                    chunk = query.filter(cls.id.in_(ids[start:start + BULK_IDS_CHUNK_SIZE]))
+                    updated += chunk.update(values, synchronize_session=False)
+
+                return updated
+
+            @classmethod
+            def close_many(cls, close_time, ids=None, **kw):
+                '''Closes the open data requests that match the filters (see _update_many)'''
+                values = {cls.closed: True, cls.close_time: close_time, cls.update_time: close_time,
+                          cls.accepted_dataset_id: None}
+                return cls._update_many(values, cls.closed == False, ids, **kw)
+
+            @classmethod
+            def reopen_many(cls, update_time, ids=None, **kw):
+                '''Reopens the closed data requests that match the filters (see _update_many)'''
+                values = {cls.closed: False, cls.close_time: None, cls.update_time: update_time,
+                          cls.accepted_dataset_id: None}
+                return cls._update_many(values, cls.closed == True, ids, **kw)
+
+            @classmethod
+            def set_visibility_many(cls, visibility, update_time, ids=None, **kw):
+                '''
+                Sets the visibility of the data requests that match the filters
+                and have a different visibility (see _update_many)
+                '''
+                values = {cls.visibility: visibility, cls.update_time: update_time}
+                condition = or_(cls.visibility != visibility, cls.visibility == None)
+                return cls._update_many(values, condition, ids, **kw)
+
+            @classmethod
+            def get_comment_count(cls, datarequest_id):
+                '''Returns the number of comments of a data request (comment_count column)'''
+                query = model.Session.query(cls.comment_count).autoflush(False)
+                return query.filter_by(id=datarequest_id).scalar() or 0
+
+            @classmethod
+            def rebuild_comment_count(cls):
+                '''
+                Computes the number of comments of every data request from the
+                comments table. The change must be committed by the caller.
+                '''
+                comments_number = sa.select([func.count(Comment.id)]) \
+                    .where(Comment.datarequest_id == cls.id).as_scalar()
+                model.Session.query(cls).update({cls.comment_count: comments_number}, synchronize_session=False)
+
+            @classmethod
+            def get_datarequests_number(cls, **kw):
+                '''Returns the number of data requests that match the filters'''
+                return cls._filter(model.Session.query(func.count(cls.id)), **kw).scalar()
+
+            @classmethod
+            def get_last_modified(cls, **kw):
+                '''
+                Returns a (count, last modification time) tuple for the data
+                requests that match the filters. It changes whenever a data
+                request is created, updated, closed, commented or deleted, so it
+                can be used to know if a list of data requests has changed
+                '''
+                query = model.Session.query(func.count(cls.id), func.max(cls.update_time)).autoflush(False)
+                return tuple(cls._filter(query, **kw).one())
+
+            @classmethod
+            def rebuild_update_time(cls):
+                '''
+                Sets the last modification time of every data request to the
+                last time it was opened, closed or commented. The change must be
+                committed by the caller.
+                '''
+                last_comment_time = sa.select([func.max(Comment.time)]) \
+                    .where(Comment.datarequest_id == cls.id).as_scalar()
+                query = model.Session.query(cls)
+                query.update({cls.update_time: func.coalesce(cls.close_time, cls.open_time)},
+                             synchronize_session=False)
+                query.filter(last_comment_time > cls.update_time) \
+                    .update({cls.update_time: last_comment_time}, synchronize_session=False)
+
+            @classmethod
+            def get_facet(cls, field, **kw):
+                '''
+                Returns a list of (value, count) tuples with the number of data
+                requests that match the filters grouped by the given field
+                '''
+                column = getattr(cls, field)
+                query = model.Session.query(column, func.count(cls.id)).autoflush(False)
+                return cls._filter(query, **kw).group_by(column).all()
+
+            @classmethod
+            def iter_all(cls, batch_size=1000):
+                '''
+                Returns an iterator over all the data requests (named tuples with
+                the columns of the table) ordered by ID. Rows are read in batches
+                of batch_size (with a server-side cursor when the data base
+                supports it), so the data requests are never loaded at once
+                '''
+                columns = [getattr(cls, column.name) for column in datarequests_table.columns]
+                query = model.Session.query(*columns).autoflush(False).order_by(cls.id)
+                return query.yield_per(batch_size)
 
             @classmethod
             def get_open_datarequests_number(cls):
@@ -82,21 +417,11 @@ def init_db(model):
             sa.Column('visibility',
                       sa.types.Integer,
                       default=constants.DataRequestState.hidden.value),
+            sa.Column('comment_count', sa.types.Integer, nullable=False, default=0, server_default='0'),
+            # Last time the data request or its comments changed (see get_last_modified)
+            sa.Column('update_time', sa.types.DateTime, primary_key=False, default=None),
         )
 
-        # Create the table only if it does not exist
-        if not datarequests_table.exists():
-            datarequests_table.create(checkfirst=True)
-        else:
-            from ckan.model.meta import engine
-            inspector = Inspector.from_engine(engine)
-            columns = inspector.get_columns('datarequests')
-            column_names = [column['name'] for column in columns]
-            if not 'extras' in column_names:
-                migrate_extras()
-            if not 'visibility' in column_names:
-                migrate_visibility()
-
         model.meta.mapper(DataRequest, datarequests_table,)
 
 
@@ -115,6 +440,56 @@ def init_db(model):
                 query = model.Session.query(cls).autoflush(False)
                 return query.filter_by(**kw).order_by(cls.time.desc()).all()
 
+            @classmethod
+            def get_ordered_by_id(cls, after=None, limit=None):
+                '''
+                Returns the comments ordered by ID. When after is given, only
+                the comments whose ID is greater are returned, so all the comments
+                can be processed in batches
+                '''
+                query = model.Session.query(cls)
+
+                if after is not None:
+                    query = query.filter(cls.id > after)
+
+                query = query.order_by(cls.id)
+
+                if limit is not None:
+                    query = query.limit(limit)
+
+                return query.all()
+
+            @classmethod
+            def get_existing_ids(cls, ids):
+                '''Returns the set of the given IDs that belong to a comment, with a single query'''
+                ids = set(ids)
+
+                if not ids:
+                    return set()
+
+                query = model.Session.query(cls.id).autoflush(False)
+                return set(comment_id for comment_id, in query.filter(cls.id.in_(ids)))
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''
+                Inserts the given comments (list of dicts with the values of the
+                columns) with a single bulk INSERT. The rows must have the same
+                keys. The change is committed with the rest of the transaction.
+                '''
+                model.Session.execute(comments_table.insert(), rows)
+
+            @classmethod
+            def get_by_datarequests(cls, datarequests_ids):
+                '''
+                Returns the comments (named tuples with the columns of the table)
+                of the given data requests ordered by date, with a single query
+                '''
+                columns = [getattr(cls, column.name) for column in comments_table.columns]
+                query = model.Session.query(*columns).autoflush(False)
+                query = query.filter(cls.datarequest_id.in_(datarequests_ids))
+                return query.order_by(cls.time, cls.id).all()
+
             @classmethod
             def get_datarequest_comments_number(cls, **kw):
                 '''
@@ -130,30 +505,274 @@ def init_db(model):
             sa.Column('user_id', sa.types.UnicodeText, primary_key=False, default=u''),
             sa.Column('datarequest_id', sa.types.UnicodeText, primary_key=True, default=uuid4),
             sa.Column('time', sa.types.DateTime, primary_key=True, default=u''),
-            sa.Column('comment', sa.types.Unicode(constants.COMMENT_MAX_LENGTH), primary_key=False, default=u'')
+            sa.Column('comment', sa.types.Unicode(constants.COMMENT_MAX_LENGTH), primary_key=False, default=u''),
+            # HTML of the comment, rendered when the comment is stored
+            sa.Column('comment_html', sa.types.UnicodeText, primary_key=False, default=None)
         )
 
-        # Create the table only if it does not exist
-        comments_table.create(checkfirst=True)
-
         model.meta.mapper(Comment, comments_table,)
 
 
-def migrate_extras():
-    conn = Session.connection()
+def setup_db(model):
+    '''
+    Creates the tables (if they do not exist) and migrates them to the current
+    schema. It's run once per process (when the plugin is configured or by
+    the "datarequests initdb" command) instead of on every action call.
+    '''
+
+    global _schema_ready
+
+    if _schema_ready:
+        return
+
+    init_db(model)
+    comment_count_migrated = False
+    update_time_migrated = False
+
+    # Create the table only if it does not exist
+    if not datarequests_table.exists():
+        _create_table(datarequests_table)
+    else:
+        from ckan.model.meta import engine
+        inspector = Inspector.from_engine(engine)
+        columns = inspector.get_columns('datarequests')
+        column_names = [column['name'] for column in columns]
+        if not 'extras' in column_names:
+            migrate_extras()
+        if not 'visibility' in column_names:
+            migrate_visibility()
+        if not 'comment_count' in column_names:
+            comment_count_migrated = migrate_comment_count()
+        if not 'update_time' in column_names:
+            update_time_migrated = migrate_update_time()
+
+    migrate_indexes('datarequests', DATAREQUESTS_INDEXES)
+    migrate_unique_title_index()
+    migrate_search()
+
+    if not comments_table.exists():
+        _create_table(comments_table)
+    else:
+        from ckan.model.meta import engine
+        inspector = Inspector.from_engine(engine)
+        column_names = [column['name'] for column in inspector.get_columns('datarequests_comments')]
+        if not 'comment_html' in column_names:
+            migrate_comment_html()
+
+    migrate_indexes('datarequests_comments', COMMENTS_INDEXES)
+
+    # Existing comments are counted (and their time is taken into account by the
+    # last modification time) once the comments table is available
+    if comment_count_migrated:
+        DataRequest.rebuild_comment_count()
+        Session.commit()
+
+    if update_time_migrated:
+        DataRequest.rebuild_update_time()
+        Session.commit()
+
+    _schema_ready = True
+
+
+def _execute_ddl(statement, made):
+    '''
+    Executes a schema change and commits it. Several server processes run
+    setup_db when they start at the same time, so when the change fails, the
+    schema is inspected (made) to know whether other process has made it.
+    Returns False in that case (instead of failing), True otherwise
+    '''
+    try:
+        Session.connection().execute(statement)
+        Session.commit()
+        return True
+    except DBAPIError as e:
+        Session.rollback()
+        if not made():
+            raise
+        log.info('The schema change has already been made by other process: %s' % e)
+        return False
+
 
+def _create_table(table):
+    try:
+        table.create(checkfirst=True)
+    except DBAPIError:
+        if not table.exists():
+            raise
+        log.info('The table %s has already been created by other process' % table.name)
+
+
+def _column_exists(table_name, column_name):
+    from ckan.model.meta import engine
+
+    inspector = Inspector.from_engine(engine)
+    return column_name in [column['name'] for column in inspector.get_columns(table_name)]
+
+
+def migrate_extras():
     statements = '''
     ALTER TABLE datarequests ADD COLUMN extras text;
     '''
-    conn.execute(statements)
-    Session.commit()
 
-def migrate_visibility():
-    conn = Session.connection()
+    return _execute_ddl(statements, lambda: _column_exists('datarequests', 'extras'))
 
+
+def migrate_visibility():
     statements = '''
     ALTER TABLE datarequests ADD COLUMN visibility integer;
     '''
 
-    conn.execute(statements)
+    return _execute_ddl(statements, lambda: _column_exists('datarequests', 'visibility'))
+
+
+def migrate_comment_count():
+    statements = '''
+    ALTER TABLE datarequests ADD COLUMN comment_count integer NOT NULL DEFAULT 0;
+    '''
+
+    return _execute_ddl(statements, lambda: _column_exists('datarequests', 'comment_count'))
+
+
+def migrate_update_time():
+    statements = '''
+    ALTER TABLE datarequests ADD COLUMN update_time timestamp without time zone;
+    '''
+
+    return _execute_ddl(statements, lambda: _column_exists('datarequests', 'update_time'))
+
+
+def migrate_comment_html():
+    # Existing comments are rendered when they are read until the
+    # "datarequests rebuild-comment-html" command is run
+    statements = '''
+    ALTER TABLE datarequests_comments ADD COLUMN comment_html text;
+    '''
+
+    return _execute_ddl(statements, lambda: _column_exists('datarequests_comments', 'comment_html'))
+
+
+def _fts_query(q):
+    '''
+    Converts the text written by the user into a FTS5 query that matches the
+    rows that contain all its words. Words are quoted so the FTS5 operators
+    that users may type are not interpreted.
+    '''
+    return u' '.join(u'"%s"' % word for word in re.findall(r'\w+', q, re.UNICODE))
+
+
+def has_unique_title_index():
+    '''
+    Returns True when titles are checked by the unique index on lower(title).
+    The index cannot be created when there are repeated titles in the data
+    base. Titles have to be checked before storing data requests in that case.
+    '''
+    global _unique_title_index
+
+    if _unique_title_index is None:
+        _unique_title_index = UNIQUE_TITLE_INDEX in _get_index_names('datarequests')
+
+    return _unique_title_index
+
+
+def _get_index_names(table_name):
+    from ckan.model.meta import engine
+
+    # Inspector does not reflect expression-based indexes (lower(title)) in
+    # PostgreSQL, so the catalog is queried directly in that case
+    if engine.dialect.name == 'postgresql':
+        result = engine.execute(sa.text('SELECT indexname FROM pg_indexes WHERE tablename = :table_name'),
+                                table_name=table_name)
+        return set(row[0] for row in result)
+
+    inspector = Inspector.from_engine(engine)
+    return set(index['name'] for index in inspector.get_indexes(table_name))
+
+
+def migrate_indexes(table_name, indexes, unique=False):
+    existing_indexes = _get_index_names(table_name)
+    missing_indexes = [name for name in indexes if name not in existing_indexes]
+
+    for name in missing_indexes:
+        _execute_ddl('CREATE %sINDEX %s ON %s %s;' % ('UNIQUE ' if unique else '', name, table_name, indexes[name]),
+                     lambda name=name: name in _get_index_names(table_name))
+
+
+def migrate_unique_title_index():
+    global _unique_title_index
+
+    try:
+        migrate_indexes('datarequests', {UNIQUE_TITLE_INDEX: '(lower(title))'}, unique=True)
+    except IntegrityError as e:
+        Session.rollback()
+        log.warn('The unique index on the titles of the data requests cannot be created because '
+                 'some titles are repeated. Titles will be checked before storing data requests. %s' % e)
+
+    # Obsolete indexes are only dropped when the ones that replace them exist
+    existing_indexes = _get_index_names('datarequests')
+    obsolete_indexes = [name for name, replacement in OBSOLETE_INDEXES.items()
+                        if name in existing_indexes and replacement in existing_indexes]
+
+    for name in obsolete_indexes:
+        _execute_ddl('DROP INDEX %s;' % name, lambda name=name: name not in _get_index_names('datarequests'))
+
+    _unique_title_index = UNIQUE_TITLE_INDEX in existing_indexes
+
+
+def migrate_search():
+    '''
+    Creates the structures used by the full text search of the data base in use
+    '''
+    dialect = Session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        migrate_indexes('datarequests', SEARCH_INDEXES)
+    elif dialect == 'sqlite':
+        migrate_fts_table()
+    else:
+        log.warn('Full text search is not available for %s. Data requests will be searched without '
+                 'an index and results will not be ranked' % dialect)
+
+
+def migrate_fts_table():
+    from ckan.model.meta import engine
+
+    inspector = Inspector.from_engine(engine)
+
+    if SEARCH_TABLE in inspector.get_table_names():
+        return
+
+    conn = Session.connection()
+
+    statements = [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS datarequests_fts USING fts5(title, description, content='datarequests',
+                                                         content_rowid='rowid');
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS datarequests_fts_insert AFTER INSERT ON datarequests BEGIN
+            INSERT INTO datarequests_fts(rowid, title, description) VALUES (new.rowid, new.title, new.description);
+        END;
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS datarequests_fts_delete AFTER DELETE ON datarequests BEGIN
+            INSERT INTO datarequests_fts(datarequests_fts, rowid, title, description)
+                VALUES ('delete', old.rowid, old.title, old.description);
+        END;
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS datarequests_fts_update AFTER UPDATE OF title, description ON datarequests BEGIN
+            INSERT INTO datarequests_fts(datarequests_fts, rowid, title, description)
+                VALUES ('delete', old.rowid, old.title, old.description);
+            INSERT INTO datarequests_fts(rowid, title, description) VALUES (new.rowid, new.title, new.description);
+        END;
+        ''',
+        # Index the data requests that already exist
+        '''
+        INSERT INTO datarequests_fts(datarequests_fts) VALUES ('rebuild');
+        '''
+    ]
+
+    for statement in statements:
+        conn.execute(statement)
+
     Session.commit()
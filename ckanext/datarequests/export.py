@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import constants
+import csv
+import datetime
+import db
+import json
+
+from collections import defaultdict, OrderedDict
+from cStringIO import StringIO
+
+# Fields of the exported data requests and comments (in this order)
+DATAREQUEST_FIELDS = ['id', 'user_id', 'title', 'description', 'organization_id', 'open_time',
+                      'accepted_dataset_id', 'close_time', 'closed', 'visibility', 'comment_count',
+                      'update_time', 'extras']
+COMMENT_FIELDS = ['id', 'user_id', 'time', 'comment']
+
+CONTENT_TYPES = {
+    constants.DATAREQUESTS_EXPORT_CSV: 'text/csv; charset=utf-8',
+    constants.DATAREQUESTS_EXPORT_JSONL: 'application/x-ndjson; charset=utf-8'
+}
+
+
+def _value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _visibility(visibility_code):
+    try:
+        return constants.DataRequestState(visibility_code).name
+    except ValueError:
+        return None
+
+
+def _comment_record(comment):
+    return OrderedDict((field, _value(getattr(comment, field))) for field in COMMENT_FIELDS)
+
+
+def _datarequest_record(datarequest, comments=None):
+    record = OrderedDict((field, _value(getattr(datarequest, field))) for field in DATAREQUEST_FIELDS)
+    record['visibility'] = _visibility(datarequest.visibility)
+
+    if comments is not None:
+        record['comments'] = [_comment_record(comment) for comment in comments]
+
+    return record
+
+
+def _records(datarequests, include_comments):
+    comments = None
+
+    if include_comments and datarequests:
+        # The comments of the batch are retrieved with a single query
+        comments = defaultdict(list)
+        for comment in db.Comment.get_by_datarequests([datarequest.id for datarequest in datarequests]):
+            comments[comment.datarequest_id].append(comment)
+
+    return [_datarequest_record(datarequest, comments[datarequest.id] if comments is not None else None)
+            for datarequest in datarequests]
+
+
+def iter_batches(include_comments=False, batch_size=constants.DATAREQUESTS_EXPORT_BATCH_SIZE):
+    '''
+    Yields all the data requests in batches (lists of dicts with the exported
+    fields, including their comments when include_comments is True). Only one
+    batch is kept in memory.
+    '''
+    batch = []
+
+    for datarequest in db.DataRequest.iter_all(batch_size):
+        batch.append(datarequest)
+
+        if len(batch) == batch_size:
+            yield _records(batch, include_comments)
+            batch = []
+
+    if batch:
+        yield _records(batch, include_comments)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _export_csv(batches, include_comments):
+    fields = DATAREQUEST_FIELDS + ['comments'] if include_comments else DATAREQUEST_FIELDS
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+
+    for records in batches:
+        for record in records:
+            writer.writerow([_csv_value(value) for value in record.values()])
+
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _export_jsonl(batches, include_comments):
+    for records in batches:
+        yield ''.join(json.dumps(record) + '\n' for record in records)
+
+
+def _export(export_function, include_comments, batch_size):
+    try:
+        for chunk in export_function(iter_batches(include_comments, batch_size), include_comments):
+            yield chunk
+    finally:
+        # The export may be consumed after the request has finished (streamed
+        # response), so the session used to read the data requests is released here
+        model.Session.remove()
+
+
+def export(export_format, include_comments=False, batch_size=constants.DATAREQUESTS_EXPORT_BATCH_SIZE):
+    '''
+    Returns an iterator over the chunks (strings) of the export of all the
+    data requests in the given format (csv or jsonl). Data requests are read
+    from the data base in batches and each batch is written in one chunk, so
+    the memory used does not depend on the number of data requests. Comments
+    are included in the comments field (JSON encoded in CSV exports) when
+    include_comments is True.
+    '''
+    if export_format not in constants.DATAREQUESTS_EXPORT_FORMATS:
+        raise ValueError('Unknown export format: %s' % export_format)
+
+    db.init_db(model)
+    export_function = _export_csv if export_format == constants.DATAREQUESTS_EXPORT_CSV else _export_jsonl
+    return _export(export_function, include_comments, batch_size)
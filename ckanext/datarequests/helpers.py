@@ -25,6 +25,7 @@ import ckan.model as model
 import ckan.logic as logic
 import ckan.plugins.toolkit as tk
 from ckan.common import c
+import cache
 import db
 from pylons import config
 
@@ -33,7 +34,7 @@ from pylons import config
 def get_comments_number(datarequest_id):
     # DB should be intialized
     db.init_db(model)
-    return db.Comment.get_datarequest_comments_number(datarequest_id=datarequest_id)
+    return db.DataRequest.get_comment_count(datarequest_id)
 
 
 def get_comments_badge(datarequest_id):
@@ -42,9 +43,18 @@ def get_comments_badge(datarequest_id):
 
 
 def get_open_datarequests_number():
-    # DB should be initialized
-    db.init_db(model)
-    return db.DataRequest.get_open_datarequests_number()
+    # The number is shown in every page, so it's cached for a short period. The
+    # cache is invalidated when data requests are created, closed or deleted
+    counters_cache = cache.get_counters_cache()
+    open_datarequests = counters_cache.get(cache.OPEN_DATAREQUESTS_NUMBER)
+
+    if open_datarequests is None:
+        # DB should be initialized
+        db.init_db(model)
+        open_datarequests = db.DataRequest.get_open_datarequests_number()
+        counters_cache.set(cache.OPEN_DATAREQUESTS_NUMBER, open_datarequests)
+
+    return open_datarequests
 
 
 def get_open_datarequests_badge(show_badge):
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import cache
+import cgi
+import ckan.model as model
+import constants
+import datetime
+import db
+import json
+import markup
+import validator
+
+from collections import defaultdict
+from HTMLParser import HTMLParser
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+# Fields of the imported data requests (see actions._datarequest_to_dict and
+# export.DATAREQUEST_FIELDS). The other fields are stored as extras
+DATAREQUEST_FIELDS = set(['id', 'user_id', 'title', 'description', 'organization_id', 'open_time',
+                          'accepted_dataset_id', 'close_time', 'closed', 'user', 'organization',
+                          'accepted_dataset', 'visibility', 'comments_count', 'comment_count',
+                          'update_time', 'extras', 'comments'])
+
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S']
+
+
+def _parse_time(value):
+    '''Parses the times written by str(datetime) or datetime.isoformat()'''
+    if not value:
+        return None
+
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.replace('T', ' '), time_format)
+        except ValueError:
+            pass
+
+    raise ValueError('Time %s is not valid' % value)
+
+
+def _reference(record, object_field, id_field):
+    '''
+    Returns the name of the user, organization or dataset of a record (or its
+    ID when the name is not included)
+    '''
+    referenced_object = record.get(object_field)
+
+    if isinstance(referenced_object, dict) and referenced_object.get('name'):
+        return referenced_object['name']
+
+    return record.get(id_field) or None
+
+
+def _get_ids(model_class, references):
+    '''
+    Returns a dict (name or ID -> ID) with the given users, organizations or
+    datasets (referenced by name or by ID), with a single query
+    '''
+    references = set(reference for reference in references if reference)
+    ids = {}
+
+    if references:
+        query = model.Session.query(model_class.id, model_class.name)
+        query = query.filter(or_(model_class.name.in_(references), model_class.id.in_(references)))
+        for object_id, name in query:
+            ids[name] = object_id
+            ids[object_id] = object_id
+
+    return ids
+
+
+class Importer(object):
+    '''
+    Imports data requests and comments from JSON lines: data requests (as
+    returned by datarequest_show or written by the export, with or without
+    their comments in the comments field) and comments (as returned by
+    datarequest_comment_show). The original IDs and times are kept, and
+    users, organizations and accepted datasets are mapped by name.
+
+    Lines are processed in batches: the users, organizations and datasets of
+    a batch are retrieved with one query each, and the batch is stored in a
+    single transaction with bulk inserts. Invalid records are skipped and
+    their errors are written to errors_output (one JSON object per line).
+    '''
+
+    def __init__(self, errors_output, batch_size=constants.DATAREQUESTS_IMPORT_BATCH_SIZE):
+        self.errors_output = errors_output
+        self.batch_size = batch_size
+        self.lines = 0
+        self.datarequests = 0
+        self.comments = 0
+        self.errors = 0
+
+    def _error(self, line_number, record_id, errors):
+        self.errors += 1
+        self.errors_output.write(json.dumps({'line': line_number, 'id': record_id, 'errors': errors}) + '\n')
+
+    def import_lines(self, lines, progress=None):
+        '''
+        Imports the data requests and the comments of the given lines.
+        progress is called (with the importer) after every batch.
+        '''
+        db.init_db(model)
+        batch = []
+
+        for line_number, line in enumerate(lines, 1):
+            self.lines = line_number
+
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError('A JSON object was expected')
+            except ValueError as e:
+                self._error(line_number, None, {'Line': [str(e)]})
+                continue
+
+            batch.append((line_number, record))
+
+            if len(batch) == self.batch_size:
+                self._import_batch(batch)
+                batch = []
+                if progress:
+                    progress(self)
+
+        if batch:
+            self._import_batch(batch)
+            if progress:
+                progress(self)
+
+        if self.datarequests or self.comments:
+            cache.get_counters_cache().delete(cache.OPEN_DATAREQUESTS_NUMBER)
+            pages_cache = cache.get_pages_cache()
+            if pages_cache is not None:
+                pages_cache.invalidate(cache.ALL_PAGES)
+
+    def _datarequest_row(self, record, users, organizations, packages):
+        errors = {}
+        row = {
+            'id': record.get('id'),
+            'title': record.get('title') or u'',
+            'description': record.get('description') or u'',
+            'closed': bool(record.get('closed', False)),
+            'comment_count': 0
+        }
+
+        if not row['id']:
+            errors['ID'] = ['ID is required']
+
+        user = _reference(record, 'user', 'user_id')
+        row['user_id'] = users.get(user)
+        if not row['user_id']:
+            errors['User'] = ['User %s not found' % user]
+
+        organization = _reference(record, 'organization', 'organization_id')
+        row['organization_id'] = organizations.get(organization)
+        if organization and not row['organization_id']:
+            errors['Organization'] = ['Organization %s not found' % organization]
+
+        accepted_dataset = _reference(record, 'accepted_dataset', 'accepted_dataset_id')
+        row['accepted_dataset_id'] = packages.get(accepted_dataset)
+        if accepted_dataset and not row['accepted_dataset_id']:
+            errors['Accepted Dataset'] = ['Dataset %s not found' % accepted_dataset]
+
+        visibility = record.get('visibility') or constants.DataRequestState.hidden.name
+        if visibility in constants.DataRequestState.__members__:
+            row['visibility'] = constants.DataRequestState[visibility].value
+        else:
+            errors['Visibility'] = ['Visibility %s is not valid' % visibility]
+
+        try:
+            row['open_time'] = _parse_time(record.get('open_time'))
+            row['close_time'] = _parse_time(record.get('close_time'))
+            row['update_time'] = _parse_time(record.get('update_time')) or row['close_time'] or row['open_time']
+            if not row['open_time']:
+                errors['Open Time'] = ['Open time is required']
+        except ValueError as e:
+            errors['Time'] = [str(e)]
+
+        extras = dict(record.get('extras') or {})
+        extras.update((field, value) for field, value in record.items() if field not in DATAREQUEST_FIELDS)
+        row['extras'] = extras
+
+        return row, errors
+
+    def _comment_row(self, record, users):
+        errors = {}
+        # Comments are stored escaped (as datarequest_comment does). The exported
+        # comments are already escaped, so they are unescaped before escaping them
+        # again: exported comments are kept and any other HTML is escaped
+        comment = HTMLParser().unescape(record.get('comment') or u'')
+        escaped_comment = cgi.escape(comment)
+        row = {
+            'id': record.get('id'),
+            'datarequest_id': record.get('datarequest_id'),
+            'comment': escaped_comment,
+            'comment_html': markup.render_comment(escaped_comment)
+        }
+
+        if not row['id']:
+            errors['ID'] = ['ID is required']
+
+        user = _reference(record, 'user', 'user_id')
+        row['user_id'] = users.get(user)
+        if not row['user_id']:
+            errors['User'] = ['User %s not found' % user]
+
+        if not comment:
+            errors['Comment'] = ['Comments must be a minimum of 1 character long']
+        elif len(comment) > constants.COMMENT_MAX_LENGTH:
+            errors['Comment'] = ['Comments must be a maximum of %d characters long' % constants.COMMENT_MAX_LENGTH]
+
+        try:
+            row['time'] = _parse_time(record.get('time'))
+            if not row['time']:
+                errors['Time'] = ['Time is required']
+        except ValueError as e:
+            errors['Time'] = [str(e)]
+
+        return row, errors
+
+    def _import_batch(self, batch):
+        # Comments can be included in their data requests or in their own lines
+        datarequests = []
+        comments = []
+        for line_number, record in batch:
+            if 'datarequest_id' in record:
+                comments.append((line_number, record))
+            else:
+                datarequests.append((line_number, record))
+                for comment in record.get('comments') or []:
+                    if isinstance(comment, dict):
+                        comments.append((line_number, dict(comment, datarequest_id=record.get('id'))))
+                    else:
+                        self._error(line_number, record.get('id'), {'Comment': ['A JSON object was expected']})
+
+        # Users, organizations, datasets and existing IDs are retrieved with one query each
+        records = [record for _, record in datarequests + comments]
+        users = _get_ids(model.User, [_reference(record, 'user', 'user_id') for record in records])
+        organizations = _get_ids(model.Group, [_reference(record, 'organization', 'organization_id')
+                                               for _, record in datarequests])
+        packages = _get_ids(model.Package, [_reference(record, 'accepted_dataset', 'accepted_dataset_id')
+                                            for _, record in datarequests])
+        existing_datarequests = db.DataRequest.get_existing_ids(
+            [record.get('id') for _, record in datarequests if record.get('id')] +
+            [record.get('datarequest_id') for _, record in comments if record.get('datarequest_id')])
+        existing_comments = db.Comment.get_existing_ids([record.get('id') for _, record in comments
+                                                         if record.get('id')])
+
+        # Data requests
+        datarequests_rows = []
+        datarequests_ids = set()
+        for line_number, record in datarequests:
+            row, errors = self._datarequest_row(record, users, organizations, packages)
+            if row['id'] in existing_datarequests or row['id'] in datarequests_ids:
+                errors['ID'] = ['Data Request %s already exists' % row['id']]
+
+            if errors:
+                self._error(line_number, row['id'], errors)
+            else:
+                datarequests_rows.append((line_number, row))
+                datarequests_ids.add(row['id'])
+
+        # Titles (and their format) are checked for the whole batch
+        context = {'model': model, 'session': model.Session}
+        batch_errors = validator.validate_datarequests(
+            context, [datarequest_row for _, datarequest_row in datarequests_rows])
+        valid_datarequests_rows = []
+        for (line_number, row), errors in zip(datarequests_rows, batch_errors):
+            if errors:
+                self._error(line_number, row['id'], errors)
+            else:
+                valid_datarequests_rows.append((line_number, row))
+
+        # Comments
+        batch_datarequests = dict((datarequest_row['id'], datarequest_row)
+                                  for _, datarequest_row in valid_datarequests_rows)
+        comments_rows = []
+        comments_ids = set()
+        comments_number = defaultdict(int)
+        for line_number, record in comments:
+            row, errors = self._comment_row(record, users)
+            if row['id'] in existing_comments or row['id'] in comments_ids:
+                errors['ID'] = ['Comment %s already exists' % row['id']]
+            if row['datarequest_id'] not in existing_datarequests and row['datarequest_id'] not in batch_datarequests:
+                errors['Data Request'] = ['Data Request %s not found' % row['datarequest_id']]
+
+            if errors:
+                self._error(line_number, row['id'], errors)
+                continue
+
+            comments_rows.append((line_number, row))
+            comments_ids.add(row['id'])
+
+            datarequest = batch_datarequests.get(row['datarequest_id'])
+            if datarequest:
+                datarequest['comment_count'] += 1
+                datarequest['update_time'] = max(datarequest['update_time'], row['time'])
+            else:
+                comments_number[row['datarequest_id']] += 1
+
+        # Store the batch
+        try:
+            if valid_datarequests_rows:
+                db.DataRequest.insert_many([datarequest_row for _, datarequest_row in valid_datarequests_rows])
+
+            if comments_rows:
+                db.Comment.insert_many([comment_row for _, comment_row in comments_rows])
+
+            # Comments of data requests imported before
+            now = datetime.datetime.now()
+            for datarequest_id, number in comments_number.items():
+                db.DataRequest.update_comment_count(datarequest_id, number, now)
+
+            model.Session.commit()
+        except IntegrityError as e:
+            model.Session.rollback()
+            for line_number, row in valid_datarequests_rows + comments_rows:
+                self._error(line_number, row['id'], {'Data Base': [str(e.orig)]})
+            return
+
+        self.datarequests += len(valid_datarequests_rows)
+        self.comments += len(comments_rows)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import string
+
+
+# Beginning of the URLs. Candidates cannot overlap, so finding them is linear
+_link_start = re.compile(r'https?://|www\.', re.I)
+
+# Run of non whitespace characters (URLs cannot contain whitespaces)
+_token = re.compile(r'\S*')
+
+# Characters that are not considered part of the URL when they are at its end
+_TRAILING_PUNCTUATION = frozenset(string.punctuation)
+
+# \w of the re module (ASCII, as the original pattern did not use re.UNICODE)
+_WORD_CHARACTERS = frozenset(string.ascii_letters + string.digits + '_')
+
+
+def _is_word(text, i):
+    return 0 <= i < len(text) and text[i] in _WORD_CHARACTERS
+
+
+def _link_end(text, start, end):
+    '''
+    Returns the end of the URL of the token text[start:end] (the rest of the
+    token is trailing punctuation) or None if the token does not contain a URL:
+    the URL ends at the last word boundary that is only followed by punctuation
+    (and an optional slash that belongs to the URL).
+    '''
+    punctuation_start = end
+    while punctuation_start > start and text[punctuation_start - 1] in _TRAILING_PUNCTUATION:
+        punctuation_start -= 1
+
+    for i in xrange(end, max(punctuation_start, start + 1) - 1, -1):
+        if _is_word(text, i - 1) != _is_word(text, i):
+            return i
+
+    return None
+
+
+def convert_links(text):
+    '''
+    Replaces the URLs (starting with http://, https:// or www.) included in the
+    text by links. Every character is visited a bounded number of times, so
+    the time is linear whatever the text is.
+    '''
+    result = []
+    position = 0
+    # Token that contains the last candidate: (end, end of its URL)
+    token = None
+
+    for candidate in _link_start.finditer(text):
+        if candidate.start() < position:
+            continue
+
+        # A token is only analyzed once, even if it contains several candidates
+        if token is None or candidate.start() >= token[0]:
+            token_end = _token.match(text, candidate.start()).end()
+            token = (token_end, _link_end(text, candidate.start(), token_end))
+
+        token_end, url_end = token
+
+        # The URL must include something after its beginning
+        if url_end is None or url_end <= candidate.end():
+            continue
+
+        # The slash that follows the last word boundary belongs to the URL
+        if url_end < token_end and text[url_end] == '/':
+            url_end += 1
+
+        url = text[candidate.start():url_end]
+
+        # The whitespace that follows the URL is kept
+        whitespace = text[token_end:token_end + 1]
+
+        result.append(text[position:candidate.start()])
+        result.append(u'<a href="{0}" target="_blank">{0}</a>{1}{2}'.format(
+            url, text[url_end:token_end], whitespace))
+        position = token_end + len(whitespace)
+
+    result.append(text[position:])
+    return ''.join(result)
+
+
+def render_comment(comment):
+    '''
+    Returns the HTML of a comment (that has already been escaped): URLs are
+    replaced by links and new lines by HTML line breaks
+    '''
+    return convert_links(comment).replace('\n', '<br/>')
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import datetime
+import functools
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+# When it's True, a JSON log line is written after every action call
+log_calls = False
+
+# Calls in progress (per thread). The SQL statements are counted in the last one
+_local = threading.local()
+
+# Metrics of the finished calls (action name -> metrics) since _since
+_lock = threading.Lock()
+_metrics = {}
+_since = datetime.datetime.now()
+
+
+class _Call(object):
+    '''Measures of an action call in progress'''
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.sql_statements = 0
+        # Nested action name -> [calls, seconds, SQL statements]
+        self.nested_calls = {}
+        # Action name -> number of calls, at any depth
+        self.all_nested_calls = {}
+
+    def add_nested_call(self, name, seconds, sql_statements):
+        nested_call = self.nested_calls.setdefault(name, [0, 0.0, 0])
+        nested_call[0] += 1
+        nested_call[1] += seconds
+        nested_call[2] += sql_statements
+
+    def total_sql_statements(self):
+        '''SQL statements executed by the call, including the ones of its nested calls'''
+        return self.sql_statements + sum(nested_call[2] for nested_call in self.nested_calls.values())
+
+
+def _calls_stack():
+    if not hasattr(_local, 'calls'):
+        _local.calls = []
+    return _local.calls
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    '''
+    SQLAlchemy ``before_cursor_execute`` listener. It counts the statement in
+    the action call that is running in the current thread (if any)
+    '''
+    calls = getattr(_local, 'calls', None)
+    if calls:
+        calls[-1].sql_statements += 1
+
+
+def listen():
+    '''Registers count_statement in all the engines (once)'''
+    if not event.contains(Engine, 'before_cursor_execute', count_statement):
+        event.listen(Engine, 'before_cursor_execute', count_statement)
+
+
+def setup(log_action_calls=False):
+    '''Starts counting the SQL statements executed by the actions'''
+    global log_calls
+
+    log_calls = log_action_calls
+    listen()
+
+
+def _start(name):
+    call = _Call(name)
+    _calls_stack().append(call)
+    return call
+
+
+def _finish(call):
+    '''Returns the seconds spent by the call, which is recorded as a nested call of the calling action'''
+    calls = _calls_stack()
+    calls.pop()
+    seconds = time.time() - call.start
+
+    if calls:
+        calls[-1].add_nested_call(call.name, seconds, call.total_sql_statements())
+    for caller in calls:
+        caller.all_nested_calls[call.name] = caller.all_nested_calls.get(call.name, 0) + 1
+
+    return seconds
+
+
+def _record(call, seconds, error):
+    with _lock:
+        metrics = _metrics.setdefault(call.name, {
+            'calls': 0,
+            'errors': 0,
+            'total_seconds': 0.0,
+            'max_seconds': 0.0,
+            'sql_statements': 0,
+            'nested_calls': {}
+        })
+        metrics['calls'] += 1
+        metrics['errors'] += 1 if error else 0
+        metrics['total_seconds'] += seconds
+        metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
+        metrics['sql_statements'] += call.sql_statements
+
+        for name, (calls, nested_seconds, sql_statements) in call.nested_calls.items():
+            nested_metrics = metrics['nested_calls'].setdefault(name, {
+                'calls': 0,
+                'total_seconds': 0.0,
+                'sql_statements': 0
+            })
+            nested_metrics['calls'] += calls
+            nested_metrics['total_seconds'] += nested_seconds
+            nested_metrics['sql_statements'] += sql_statements
+
+    if log_calls:
+        log.info(json.dumps({
+            'action': call.name,
+            'seconds': seconds,
+            'error': error,
+            'sql_statements': call.sql_statements,
+            'nested_calls': dict((name, {'calls': calls, 'seconds': nested_seconds, 'sql_statements': sql_statements})
+                                 for name, (calls, nested_seconds, sql_statements) in call.nested_calls.items())
+        }, sort_keys=True))
+
+
+def instrumented(action):
+    '''
+    Decorator of the actions. The wall time, the SQL statements and the nested
+    action calls of every call are measured and aggregated by action name.
+    '''
+    @functools.wraps(action)
+    def wrapper(context, data_dict):
+        call = _start(action.__name__)
+        error = False
+
+        try:
+            return action(context, data_dict)
+        except Exception:
+            error = True
+            raise
+        finally:
+            _record(call, _finish(call), error)
+
+    return wrapper
+
+
+def nested_action(name, action):
+    '''
+    Returns the given action (as returned by get_action). Its calls are
+    recorded as nested calls of the action that is running
+    '''
+    def wrapper(context, data_dict=None):
+        call = _start(name)
+
+        try:
+            return action(context, data_dict)
+        finally:
+            _finish(call)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def measure(name='block'):
+    '''
+    Context manager that measures the code block as a call. It yields the call:
+    once the block is finished, its sql_statements and nested_calls can be read.
+    It's not recorded in the metrics (but it's nested in the running action)
+    '''
+    call = _start(name)
+    try:
+        yield call
+    finally:
+        _finish(call)
+
+
+def get_metrics(reset=False):
+    '''
+    Returns the metrics of the actions called since the process started or
+    since the metrics were reset: when they are retrieved with reset=True
+    '''
+    global _metrics
+    global _since
+
+    now = datetime.datetime.now()
+
+    with _lock:
+        actions = {}
+        for name, metrics in _metrics.items():
+            actions[name] = dict(metrics, nested_calls=dict((nested_name, dict(nested_metrics))
+                                                            for nested_name, nested_metrics
+                                                            in metrics['nested_calls'].items()))
+            actions[name]['mean_seconds'] = metrics['total_seconds'] / metrics['calls']
+            actions[name]['sql_statements_per_call'] = float(metrics['sql_statements']) / metrics['calls']
+
+        result = {
+            'since': _since.isoformat(),
+            'until': now.isoformat(),
+            'actions': actions
+        }
+
+        if reset:
+            _metrics = {}
+            _since = now
+
+    return result
@@ -17,15 +17,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
+import ckan.model as model
 import ckan.plugins as p
 import ckan.plugins.toolkit as tk
 import auth
 import actions
 import constants
+import db
 import helpers
+import metrics
 
 from functools import partial
 from pylons import config
+from sqlalchemy import event
 
 
 def get_config_bool_value(config_name, default_value=False):
@@ -38,6 +42,7 @@ class DataRequestsPlugin(p.SingletonPlugin):
 
     p.implements(p.IActions)
     p.implements(p.IAuthFunctions)
+    p.implements(p.IConfigurable)
     p.implements(p.IConfigurer)
     p.implements(p.IRoutes, inherit=True)
     p.implements(p.ITemplateHelpers)
@@ -47,6 +52,13 @@ class DataRequestsPlugin(p.SingletonPlugin):
         self._show_datarequests_badge = get_config_bool_value('ckan.datarequests.show_datarequests_badge')
         self._ignore_auth = get_config_bool_value('ckan.datarequests.ignore_auth')
 
+        # Cached users must be discarded when they are updated
+        if not event.contains(model.User, 'after_update', actions.invalidate_user):
+            event.listen(model.User, 'after_update', actions.invalidate_user)
+
+        # SQL statements are counted in the metrics of the actions
+        metrics.setup(get_config_bool_value('ckan.datarequests.metrics.log'))
+
     ######################################################################
     ############################## IACTIONS ##############################
     ######################################################################
@@ -54,11 +66,16 @@ class DataRequestsPlugin(p.SingletonPlugin):
     def get_actions(self):
         additional_actions = {
             constants.DATAREQUEST_CREATE: actions.datarequest_create,
+            constants.DATAREQUEST_CREATE_MANY: actions.datarequest_create_many,
             constants.DATAREQUEST_SHOW: actions.datarequest_show,
             constants.DATAREQUEST_UPDATE: actions.datarequest_update,
             constants.DATAREQUEST_INDEX: actions.datarequest_index,
             constants.DATAREQUEST_DELETE: actions.datarequest_delete,
-            constants.DATAREQUEST_CLOSE: actions.datarequest_close
+            constants.DATAREQUEST_CLOSE: actions.datarequest_close,
+            constants.DATAREQUEST_BULK_UPDATE: actions.datarequest_bulk_update,
+            constants.DATAREQUEST_DATASET_AUTOCOMPLETE: actions.datarequest_dataset_autocomplete,
+            constants.DATAREQUEST_LAST_MODIFIED: actions.datarequest_last_modified,
+            constants.DATAREQUEST_METRICS: actions.datarequest_metrics
         }
 
         if self.comments_enabled:
@@ -77,11 +94,17 @@ class DataRequestsPlugin(p.SingletonPlugin):
     def get_auth_functions(self):
         auth_functions = {
             constants.DATAREQUEST_CREATE: auth.datarequest_create,
+            constants.DATAREQUEST_CREATE_MANY: auth.datarequest_create_many,
             constants.DATAREQUEST_SHOW: auth.datarequest_show,
             constants.DATAREQUEST_UPDATE: auth.datarequest_update,
             constants.DATAREQUEST_INDEX: auth.datarequest_index,
             constants.DATAREQUEST_DELETE: auth.datarequest_delete,
             constants.DATAREQUEST_CLOSE: auth.datarequest_close,
+            constants.DATAREQUEST_BULK_UPDATE: auth.datarequest_bulk_update,
+            constants.DATAREQUEST_EXPORT: auth.datarequest_export,
+            constants.DATAREQUEST_DATASET_AUTOCOMPLETE: auth.datarequest_dataset_autocomplete,
+            constants.DATAREQUEST_LAST_MODIFIED: auth.datarequest_last_modified,
+            constants.DATAREQUEST_METRICS: auth.datarequest_metrics
         }
 
         if self.comments_enabled:
@@ -93,6 +116,17 @@ class DataRequestsPlugin(p.SingletonPlugin):
 
         return auth_functions
 
+    ######################################################################
+    ########################### ICONFIGURABLE ############################
+    ######################################################################
+
+    def configure(self, config):
+        # Tables are created and migrated once, when the server starts, so
+        # actions do not have to check the schema. This can be disabled to
+        # run "paster datarequests initdb" as a deployment step instead.
+        if get_config_bool_value('ckan.datarequests.setup_db_on_startup', True):
+            db.setup_db(model)
+
     ######################################################################
     ############################ ICONFIGURER #############################
     ######################################################################
@@ -123,6 +157,16 @@ class DataRequestsPlugin(p.SingletonPlugin):
                   controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
                   action='new', conditions=dict(method=['GET', 'POST']))
 
+        # Datasets that can be accepted when closing a Data Request (autocomplete)
+        m.connect('/%s/dataset_autocomplete' % constants.DATAREQUESTS_MAIN_PATH,
+                  controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
+                  action='dataset_autocomplete', conditions=dict(method=['GET']))
+
+        # Export all the Data Requests (CSV or JSONL)
+        m.connect('/%s/export' % constants.DATAREQUESTS_MAIN_PATH,
+                  controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
+                  action='export', conditions=dict(method=['GET']))
+
         # Show a Data Request
         m.connect('datarequest_show', '/%s/{id}' % constants.DATAREQUESTS_MAIN_PATH,
                   controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
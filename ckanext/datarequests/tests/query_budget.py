@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+
+import ckanext.datarequests.metrics as metrics
+
+
+@contextlib.contextmanager
+def query_budget(sql_statements, action_calls=None):
+    '''
+    Context manager that fails (AssertionError) when the code block executes
+    more SQL statements than the given budget (nested action calls included) or
+    calls an action (at any depth) more times than its budget in action_calls
+    (action name -> maximum number of calls). Actions not included in
+    action_calls are not limited. It yields the measured call, so the exact
+    numbers can be checked too.
+
+        with query_budget(5, {'user_show': 0}):
+            actions.datarequest_index(context, {})
+    '''
+    metrics.listen()
+
+    with metrics.measure('query_budget') as call:
+        yield call
+
+    executed = call.total_sql_statements()
+    if executed > sql_statements:
+        raise AssertionError('%d SQL statements executed, the budget is %d (nested calls: %r)' %
+                             (executed, sql_statements, call.nested_calls))
+
+    for name, budget in (action_calls or {}).items():
+        calls = call.all_nested_calls.get(name, 0)
+        if calls > budget:
+            raise AssertionError('%s called %d times, the budget is %d' % (name, calls, budget))
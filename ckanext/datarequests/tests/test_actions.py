@@ -20,6 +20,7 @@
 import ckanext.datarequests.actions as actions
 import ckanext.datarequests.constants as constants
 import datetime
+import hashlib
 import test_actions_data as test_data
 import unittest
 
@@ -33,7 +34,7 @@ class ActionsTest(unittest.TestCase):
         # Mocks
         self._tk = actions.tk
         actions.tk = MagicMock()
-        actions.USERS_CACHE = {}
+        actions.USERS_CACHE.clear()
         actions.tk.ObjectNotFound = self._tk.ObjectNotFound
         actions.tk.ValidationError = self._tk.ValidationError
 
@@ -49,6 +50,17 @@ class ActionsTest(unittest.TestCase):
         self._datetime = actions.datetime
         actions.datetime = MagicMock()
 
+        self._user_to_dict = actions._user_to_dict
+
+        self._cache = actions.cache
+        actions.cache = MagicMock()
+
+        self._authz = actions.authz
+        actions.authz = MagicMock()
+
+        self._func = actions.func
+        actions.func = MagicMock()
+
         self.context = {
             'user': 'example_usr',
             'auth_user_obj': MagicMock(),
@@ -63,10 +75,58 @@ class ActionsTest(unittest.TestCase):
         actions.db = self._db
         actions.validator = self._validator
         actions.datetime = self._datetime
+        actions._user_to_dict = self._user_to_dict
+        actions.cache = self._cache
+        actions.authz = self._authz
+        actions.func = self._func
+
+    def _summary(self, object_id):
+        # Organizations and datasets returned by the mocked queries
+        return {
+            'id': object_id,
+            'name': object_id,
+            'title': object_id.title(),
+            'display_name': object_id.title()
+        }
+
+    def _initialize_bulk_queries(self, default_user):
+        # Users, organizations and datasets are retrieved with one query per model.
+        # Organizations and datasets are summaries built from the name and the title
+        model = self.context['model']
+        for model_class in (model.User, model.Group, model.Package):
+            model_class.id.in_.side_effect = lambda ids: ids
+
+        def _user_row(user_id):
+            user_row = MagicMock(id=user_id)
+            user_row.name = user_id
+            return user_row
+
+        def _query(*entities):
+            query = MagicMock()
+            if entities[0] is model.User.id:
+                query.filter.side_effect = lambda ids: MagicMock(all=lambda: [_user_row(id) for id in ids])
+            elif entities[0] in (model.Group.id, model.Package.id):
+                query.filter.side_effect = lambda ids: [(id, id, id.title()) for id in ids]
+            else:
+                # Edits and datasets of the users
+                query.filter.return_value.group_by.return_value = [('user_id', 3)]
+            return query
+
+        model.Session.query.side_effect = _query
+        actions._user_to_dict = MagicMock(return_value=default_user)
+
+    def _check_open_datarequests_number_invalidated(self):
+        counters_cache = actions.cache.get_counters_cache.return_value
+        counters_cache.delete.assert_called_once_with(actions.cache.OPEN_DATAREQUESTS_NUMBER)
+
+    def _check_pages_invalidated(self, *scopes):
+        pages_cache = actions.cache.get_pages_cache.return_value
+        pages_cache.invalidate.assert_called_once_with(*scopes)
 
     def _check_comment(self, comment, response, user):
         self.assertEquals(comment.id, response['id'])
         self.assertEquals(comment.comment, response['comment'])
+        self.assertEquals(comment.comment_html, response['comment_html'])
         self.assertEquals(str(comment.time), response['time'])
         self.assertEquals(comment.user_id, response['user_id'])
         self.assertEquals(user, response['user'])
@@ -82,6 +142,7 @@ class ActionsTest(unittest.TestCase):
         self.assertEquals(str(datarequest.open_time), response['open_time'])
         self.assertEquals(datarequest.closed, response['closed'])
         self.assertEquals(datarequest.accepted_dataset_id, response['accepted_dataset_id'])
+        self.assertEquals(datarequest.comment_count, response['comments_count'])
 
         if organization:
             self.assertEquals(organization, response['organization'])
@@ -192,9 +253,9 @@ class ActionsTest(unittest.TestCase):
 
         # Mock actions
         default_user = {'user': 1}
-        default_org = {'org': 2}
+        default_org = self._summary(test_data.create_request_data['organization_id'])
         default_pkg = None      # Accepted dataset cannot be different from None at this time
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        self._initialize_bulk_queries(default_user)
 
         # Call the function
         result = actions.datarequest_create(self.context, test_data.create_request_data)
@@ -209,6 +270,8 @@ class ActionsTest(unittest.TestCase):
 
         self.context['session'].add.assert_called_once_with(datarequest)
         self.context['session'].commit.assert_called_once()
+        self._check_open_datarequests_number_invalidated()
+        self._check_pages_invalidated(actions.cache.ALL_PAGES)
 
         # Check the object stored in the database
         self.assertEquals(self.context['auth_user_obj'].id, datarequest.user_id)
@@ -216,10 +279,147 @@ class ActionsTest(unittest.TestCase):
         self.assertEquals(test_data.create_request_data['description'], datarequest.description)
         self.assertEquals(test_data.create_request_data['organization_id'], datarequest.organization_id)
         self.assertEquals(current_time, datarequest.open_time)
+        self.assertEquals(current_time, datarequest.update_time)
 
         # Check the returned object
         self._check_basic_response(datarequest, result, default_user, default_org, default_pkg)
 
+    @parameterized.expand([
+        (actions.datarequest_create, test_data.create_request_data),
+        (actions.datarequest_update, test_data.update_request_data)
+    ])
+    def test_datarequest_title_in_use(self, function, request_data):
+        # Two data requests with the same title stored at the same time: the
+        # unique index rejects the second one
+        actions.db.UNIQUE_TITLE_INDEX = self._db.UNIQUE_TITLE_INDEX
+        actions.db.DataRequest.get.return_value = [test_data._generate_basic_datarequest()]
+        self.context['session'].commit.side_effect = actions.IntegrityError(
+            'INSERT', {}, Exception('duplicate key value violates unique constraint "%s"' % self._db.UNIQUE_TITLE_INDEX))
+
+        with self.assertRaises(self._tk.ValidationError) as c:
+            function(self.context, request_data)
+
+        self.assertEquals({'Title': ['That title is already in use']}, c.exception.error_dict)
+        self.context['session'].rollback.assert_called_once_with()
+
+    def test_datarequest_create_integrity_error(self):
+        # Other integrity errors are not related to the title
+        actions.db.UNIQUE_TITLE_INDEX = self._db.UNIQUE_TITLE_INDEX
+        error = actions.IntegrityError('INSERT', {}, Exception('null value in column "id"'))
+        self.context['session'].commit.side_effect = error
+
+        with self.assertRaises(actions.IntegrityError):
+            actions.datarequest_create(self.context, test_data.create_request_data)
+
+        self.context['session'].rollback.assert_called_once_with()
+        self.assertEquals(0, actions.cache.get_counters_cache.call_count)
+
+    def _init_create_many(self, batch_errors):
+        current_time = self._datetime.datetime.now()
+        actions.datetime.datetime.now = MagicMock(return_value=current_time)
+        actions.db.uuid4.side_effect = ['dr_id_%d' % i for i in range(len(batch_errors))]
+        actions.validator.validate_datarequests.return_value = batch_errors
+        return current_time
+
+    def test_datarequest_create_many_no_access(self):
+        request_data = {'datarequests': [test_data.create_request_data]}
+        actions.tk.check_access = MagicMock(side_effect=self._tk.NotAuthorized)
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_create_many(self.context, request_data)
+
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_CREATE_MANY, self.context, request_data)
+        self.assertEquals(0, actions.validator.validate_datarequests.call_count)
+        self.assertEquals(0, actions.db.DataRequest.insert_many.call_count)
+
+    @parameterized.expand([
+        ({},),
+        ({'datarequests': []},),
+        ({'datarequests': 'not a list'},),
+        ({'datarequests': [test_data.create_request_data] * (constants.DATAREQUESTS_CREATE_MANY_MAX_SIZE + 1)},)
+    ])
+    def test_datarequest_create_many_invalid_batch(self, request_data):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_create_many(self.context, request_data)
+
+        self.assertEquals(0, actions.validator.validate_datarequests.call_count)
+        self.assertEquals(0, actions.db.DataRequest.insert_many.call_count)
+
+    @parameterized.expand([
+        (True,  constants.DataRequestState.visible.value),
+        (False, constants.DataRequestState.hidden.value)
+    ])
+    def test_datarequest_create_many(self, sysadmin, visibility):
+        actions.authz.is_sysadmin.return_value = sysadmin
+        errors = {'Title': ['That title is already in use']}
+        current_time = self._init_create_many([{}, errors, {}])
+        batch = [
+            test_data.create_request_data,
+            {'title': 'Repeated title', 'description': 'Description'},
+            {'title': 'Other title', 'description': 'Description', 'organization_id': None, 'source': 'legacy'}
+        ]
+
+        result = actions.datarequest_create_many(self.context, {'datarequests': batch})
+
+        self.assertEquals({'ids': ['dr_id_0', None, 'dr_id_1'], 'errors': [{'index': 1, 'errors': errors}]}, result)
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_CREATE_MANY, self.context,
+                                                        {'datarequests': batch})
+
+        # The whole batch is validated at once (missing fields are empty)
+        actions.validator.validate_datarequests.assert_called_once_with(self.context, [
+            test_data.create_request_data,
+            {'title': 'Repeated title', 'description': 'Description', 'organization_id': u''},
+            {'title': 'Other title', 'description': 'Description', 'organization_id': u'', 'source': 'legacy'}
+        ])
+
+        # Valid data requests are stored with a single insert and a single commit
+        common = {
+            'user_id': self.context['auth_user_obj'].id,
+            'open_time': current_time,
+            'update_time': current_time,
+            'closed': False,
+            'comment_count': 0,
+            'visibility': visibility
+        }
+        expected_rows = [
+            dict(common, id='dr_id_0', title=test_data.create_request_data['title'],
+                 description=test_data.create_request_data['description'],
+                 organization_id=test_data.create_request_data['organization_id'], extras={}),
+            dict(common, id='dr_id_1', title='Other title', description='Description', organization_id=None,
+                 extras={'source': 'legacy'})
+        ]
+        actions.db.DataRequest.insert_many.assert_called_once_with(expected_rows)
+        self.context['session'].commit.assert_called_once_with()
+        self.assertEquals(0, self.context['session'].add.call_count)
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
+        self._check_open_datarequests_number_invalidated()
+        self._check_pages_invalidated(actions.cache.ALL_PAGES)
+
+    def test_datarequest_create_many_all_invalid(self):
+        errors = {'Description': ['Description cannot be empty']}
+        self._init_create_many([errors])
+
+        result = actions.datarequest_create_many(self.context, {'datarequests': [{'title': 'Title'}]})
+
+        self.assertEquals({'ids': [None], 'errors': [{'index': 0, 'errors': errors}]}, result)
+        self.assertEquals(0, actions.db.DataRequest.insert_many.call_count)
+        self.assertEquals(0, self.context['session'].commit.call_count)
+        self.assertEquals(0, actions.cache.get_counters_cache.call_count)
+
+    def test_datarequest_create_many_title_in_use(self):
+        # A title is taken by other data request while the batch is stored
+        actions.db.UNIQUE_TITLE_INDEX = self._db.UNIQUE_TITLE_INDEX
+        self._init_create_many([{}, {}])
+        self.context['session'].commit.side_effect = actions.IntegrityError(
+            'INSERT', {}, Exception('duplicate key value violates unique constraint "%s"' % self._db.UNIQUE_TITLE_INDEX))
+
+        with self.assertRaises(self._tk.ValidationError) as c:
+            actions.datarequest_create_many(self.context, {'datarequests': [test_data.create_request_data] * 2})
+
+        self.assertEquals({'Title': ['That title is already in use']}, c.exception.error_dict)
+        self.context['session'].rollback.assert_called_once_with()
+        self.assertEquals(0, actions.cache.get_counters_cache.call_count)
+
 
     ######################################################################
     ################################ SHOW ################################
@@ -238,11 +438,9 @@ class ActionsTest(unittest.TestCase):
         # Configure mock
         actions.db.DataRequest.get.return_value = [datarequest]
 
-        # Mock actions
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
+        # Mock queries
         default_user = {'user': 3}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        self._initialize_bulk_queries(default_user)
 
         # Call the function
         result = actions.datarequest_show(self.context, test_data.show_request_data)
@@ -252,8 +450,8 @@ class ActionsTest(unittest.TestCase):
         actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_SHOW, self.context, test_data.show_request_data)
         actions.db.DataRequest.get.assert_called_once_with(id=test_data.show_request_data['id'])
 
-        org = default_org if org_checked else None
-        pkg = default_pkg if pkg_checked else None
+        org = self._summary(datarequest.organization_id) if org_checked else None
+        pkg = self._summary(datarequest.accepted_dataset_id) if pkg_checked else None
         self._check_basic_response(datarequest, result, default_user, org, pkg)
 
     def test_datarequest_show_found_org_open(self):
@@ -322,10 +520,8 @@ class ActionsTest(unittest.TestCase):
         actions.db.DataRequest.get.return_value = [datarequest]
 
         # Mock actions
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
         default_user = {'user': 3}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        self._initialize_bulk_queries(default_user)
 
         # Store previous user (needed to check that it has not been modified)
         previous_user_id = datarequest.user_id
@@ -343,16 +539,18 @@ class ActionsTest(unittest.TestCase):
 
         self.context['session'].add.assert_called_once_with(datarequest)
         self.context['session'].commit.assert_called_once()
+        self._check_pages_invalidated(actions.cache.LIST_PAGES, datarequest.id)
 
         # Check the object stored in the database
         self.assertEquals(previous_user_id, datarequest.user_id)
         self.assertEquals(test_data.update_request_data['title'], datarequest.title)
         self.assertEquals(test_data.update_request_data['description'], datarequest.description)
         self.assertEquals(test_data.update_request_data['organization_id'], datarequest.organization_id)
+        self.assertEquals(actions.datetime.datetime.now.return_value, datarequest.update_time)
 
         # Check the result
-        org = default_org if organization_id else None
-        pkg = default_pkg if accepted_dataset_id else None
+        org = self._summary(datarequest.organization_id) if datarequest.organization_id else None
+        pkg = self._summary(datarequest.accepted_dataset_id) if datarequest.accepted_dataset_id else None
         self._check_basic_response(datarequest, result, default_user, org, pkg)
 
 
@@ -386,16 +584,29 @@ class ActionsTest(unittest.TestCase):
         _organization_show = test_case['organization_show_func']
         _user_show = test_case.get('user_show_func', None)
 
-        # Set the mocks
-        actions.db.DataRequest.get_ordered_by_date.return_value = ddbb_response
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
+        # Set the mocks. The data base is supposed to return only the requested page
+        offset = content.get('offset', 0)
+        limit = content.get('limit', constants.DATAREQUESTS_PER_PAGE)
+        actions.db.DataRequest.get_ordered_by_date.return_value = ddbb_response[offset:offset + limit + 1]
+        actions.db.DataRequest.get_datarequests_number.return_value = len(ddbb_response)
+
+        def _get_facet(field, **kw):
+            # Simulates the GROUP BY query made by the data base
+            counts = {}
+            for data_req in ddbb_response:
+                value = getattr(data_req, field)
+                counts[value] = counts.get(value, 0) + 1
+            return counts.items()
+
+        actions.db.DataRequest.get_facet.side_effect = _get_facet
+
         default_user = {'user': 3, 'id': test_data.user_default_id}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        test_data._initialize_basic_actions(actions, default_user, None, None)
+        self._initialize_bulk_queries(default_user)
 
-        # Modify the default behaviour of 'organization_show'
-        organization_show = actions.tk.get_action('organization_show')
-        organization_show.side_effect = _organization_show
+        # Organization names are resolved in the data base
+        self.context['model'].Group.get.side_effect = \
+            lambda organization: MagicMock(id=_organization_show(None, {'id': organization})['id'])
 
         # Call the function
         response = actions.datarequest_index(self.context, content)
@@ -403,41 +614,36 @@ class ActionsTest(unittest.TestCase):
         # Assertions
         actions.db.init_db.assert_called_once_with(self.context['model'])
         actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_INDEX, self.context, content)
-        actions.db.DataRequest.get_ordered_by_date.assert_called_once_with(**expected_ddbb_params)
-
-        # Expected organizations_show  calls
-        expected_organization_show_calls = 0
-
-        # The initial one to get the real ID and not the name
+        actions.db.DataRequest.get_ordered_by_date.assert_called_once_with(offset=offset, limit=limit + 1, **expected_ddbb_params)
+        actions.db.DataRequest.get_datarequests_number.assert_called_once_with(**expected_ddbb_params)
+        self.assertEquals(3, actions.db.DataRequest.get_facet.call_count)
+        actions.db.DataRequest.get_facet.assert_any_call('organization_id', **expected_ddbb_params)
+        actions.db.DataRequest.get_facet.assert_any_call('closed', **expected_ddbb_params)
+        actions.db.DataRequest.get_facet.assert_any_call('visibility', **expected_ddbb_params)
+
+        # The organization name is resolved to get the real ID
+        model = self.context['model']
         if 'organization_id' in content:
-            organization_show.assert_any_call({'ignore_auth': True}, {'id': content['organization_id']})
-            expected_organization_show_calls += 1
-
-        # The reamining ones to include the display name into the facets
-        if 'organization' in expected_response['facets']:
-            expected_organization_show_calls += len(expected_response['facets']['organization']['items'])
-            for organization_facet in expected_response['facets']['organization']['items']:
-                organization_show.assert_any_call({'ignore_auth': True}, {'id': organization_facet['name']})
-
-        # We have to substract the number of times that the function is called to parse
-        # the datarequest that will be returned
-        count = 0
-        datarequests = expected_response['result']
-        for datarequest in datarequests:
-            if datarequest['organization_id']:
-                count += 1
-            datarequest['user'] = default_user
+            model.Group.get.assert_called_once_with(content['organization_id'])
+        else:
+            self.assertEquals(0, model.Group.get.call_count)
 
-        # Assert that organization_show has been called the appropriate number of times
-        self.assertEquals(organization_show.call_count - count, expected_organization_show_calls)
+        # organization_show is not called: organizations (for the results and for the
+        # facet) are retrieved with one query each, selecting only their summaries
+        self.assertEquals(0, actions.tk.get_action('organization_show').call_count)
+        datarequests = expected_response['result']
+        organization_queries = [c for c in model.Session.query.call_args_list if c[0][0] is model.Group.id]
+        expected_organization_queries = int(any(d['organization_id'] for d in datarequests)) + \
+            int('organization' in expected_response['facets'])
+        self.assertEquals(expected_organization_queries, len(organization_queries))
 
         # user, organization and accepted_dataset are None by default. The value of these fields
-        # must be set based on the value returned by the defined actions
+        # must be set based on the value returned by the queries
         for datarequest in datarequests:
             datarequest['user'] = default_user
             datarequest['accepted_dataset'] = None
             organization_id = datarequest['organization_id']
-            datarequest['organization'] = _organization_show(None, {'id': organization_id}) if organization_id else None
+            datarequest['organization'] = self._summary(organization_id) if organization_id else None
 
         # Check that the result is correct
         # We cannot execute self.assertEquals (for facets) because items
@@ -445,6 +651,13 @@ class ActionsTest(unittest.TestCase):
         self.assertEquals(expected_response['count'], response['count'])
         self.assertEquals(expected_response['result'], response['result'])
 
+        # The cursor points to the last data request returned when there are more pages
+        if offset + limit < len(ddbb_response):
+            last = ddbb_response[offset + limit - 1]
+            self.assertEquals('%s_%s' % (last.open_time.strftime('%Y%m%d%H%M%S%f'), last.id), response['next_cursor'])
+        else:
+            self.assertIsNone(response['next_cursor'])
+
         for facet in expected_response['facets']:
             items = expected_response['facets'][facet]['items']
 
@@ -458,6 +671,198 @@ class ActionsTest(unittest.TestCase):
                 self.assertIn(item, response['facets'][facet]['items'])
 
 
+    @parameterized.expand([
+        (3, 4, True),
+        (3, 3, False),
+        (3, 0, False)
+    ])
+    def test_datarequest_index_cursor(self, limit, db_results, next_page):
+        # The real datetime is needed to parse the cursor
+        actions.datetime = self._datetime
+        open_time = datetime.datetime(2017, 3, 4, 10, 11, 12, 13)
+        ddbb_response = [test_data._generate_basic_datarequest(id='dr%d' % i) for i in range(db_results)]
+        for data_req in ddbb_response:
+            data_req.open_time = open_time
+
+        actions.db.DataRequest.get_ordered_by_date.return_value = ddbb_response
+        actions.db.DataRequest.get_facet.return_value = []
+        test_data._initialize_basic_actions(actions, {'user': 3}, None, None)
+
+        # Call the function
+        content = {'after': '20170304101112000013_example_id', 'limit': limit}
+        response = actions.datarequest_index(self.context, content)
+
+        # Assertions
+        actions.db.DataRequest.get_ordered_by_date.assert_called_once_with(
+            limit=limit + 1, after=(open_time, 'example_id'))
+        self.assertEquals(min(limit, db_results), len(response['result']))
+        expected_cursor = '20170304101112000013_dr%d' % (limit - 1) if next_page else None
+        self.assertEquals(expected_cursor, response['next_cursor'])
+
+    def test_datarequest_index_invalid_cursor(self):
+        actions.datetime = self._datetime
+
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_index(self.context, {'after': 'invalid'})
+
+        self.assertEquals(0, actions.db.DataRequest.get_ordered_by_date.call_count)
+
+    @parameterized.expand([
+        (3, 4),
+        (3, 3)
+    ])
+    def test_datarequest_index_most_discussed(self, limit, db_results):
+        ddbb_response = [test_data._generate_basic_datarequest(id='dr%d' % i, comment_count=10 - i)
+                         for i in range(db_results)]
+        actions.db.DataRequest.get_ordered_by_comments.return_value = ddbb_response
+        actions.db.DataRequest.get_facet.return_value = []
+        self._initialize_bulk_queries({'user': 3})
+
+        # Call the function
+        content = {'sort': 'most_discussed', 'offset': 3, 'limit': limit, 'closed': False}
+        response = actions.datarequest_index(self.context, content)
+
+        # Assertions. Cursors are not returned when data requests are not sorted by date
+        actions.db.DataRequest.get_ordered_by_comments.assert_called_once_with(offset=3, limit=limit + 1, closed=False)
+        self.assertEquals(0, actions.db.DataRequest.get_ordered_by_date.call_count)
+        self.assertEquals(['dr%d' % i for i in range(min(limit, db_results))], [d['id'] for d in response['result']])
+        self.assertEquals([10 - i for i in range(min(limit, db_results))], [d['comments_count'] for d in response['result']])
+        self.assertIsNone(response['next_cursor'])
+
+    @parameterized.expand([
+        # q, sort, expected method
+        ('bus stops', None,             'get_ordered_by_relevance'),
+        ('  bus  ',   'relevance',      'get_ordered_by_relevance'),
+        ('bus',       'most_discussed', 'get_ordered_by_comments'),
+        ('bus',       'newest',         'get_ordered_by_date'),
+        # Relevance cannot be used when nothing is searched
+        ('   ',       'relevance',      'get_ordered_by_date'),
+    ])
+    def test_datarequest_index_search(self, q, sort, expected_method):
+        methods = ('get_ordered_by_relevance', 'get_ordered_by_comments', 'get_ordered_by_date')
+        for method in methods:
+            getattr(actions.db.DataRequest, method).return_value = [test_data._generate_basic_datarequest()]
+        actions.db.DataRequest.get_facet.return_value = []
+        self._initialize_bulk_queries({'user': 3})
+
+        # Call the function
+        content = {'q': q, 'offset': 0, 'limit': 5, 'closed': False}
+        if sort:
+            content['sort'] = sort
+        response = actions.datarequest_index(self.context, content)
+
+        # Search is applied to the page, the count and the facets
+        expected_params = {'closed': False}
+        if q.strip():
+            expected_params['q'] = q.strip()
+
+        getattr(actions.db.DataRequest, expected_method).assert_called_once_with(offset=0, limit=6, **expected_params)
+        for method in methods:
+            if method != expected_method:
+                self.assertEquals(0, getattr(actions.db.DataRequest, method).call_count)
+
+        actions.db.DataRequest.get_datarequests_number.assert_called_once_with(**expected_params)
+        for facet in ('organization_id', 'closed', 'visibility'):
+            actions.db.DataRequest.get_facet.assert_any_call(facet, **expected_params)
+
+        self.assertEquals(1, len(response['result']))
+
+    @parameterized.expand([
+        ({'sort': 'invalid'},),
+        ({'sort': 'most_discussed', 'after': '20170304101112000013_example_id'},),
+        ({'q': 'bus', 'after': '20170304101112000013_example_id'},)
+    ])
+    def test_datarequest_index_invalid_sort(self, content):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_index(self.context, content)
+
+        self.assertEquals(0, actions.db.DataRequest.get_ordered_by_date.call_count)
+        self.assertEquals(0, actions.db.DataRequest.get_ordered_by_comments.call_count)
+        self.assertEquals(0, actions.db.DataRequest.get_ordered_by_relevance.call_count)
+
+
+    ######################################################################
+    ########################### LAST MODIFIED ############################
+    ######################################################################
+
+    @parameterized.expand([
+        (datetime.datetime(2017, 3, 4, 10, 11, 12, 13), '2017-03-04T10:11:12.000013'),
+        (None,                                          None)
+    ])
+    def test_datarequest_last_modified_list(self, update_time, expected_last_modified):
+        actions.db.DataRequest.get_last_modified.return_value = (3, update_time)
+        data_dict = {'organization_id': 'org_name', 'closed': False, 'visibility': 'visible', 'q': ' bus ',
+                     'offset': 10, 'limit': 10}
+
+        result = actions.datarequest_last_modified(self.context, data_dict)
+
+        self.assertEquals({'count': 3, 'last_modified': expected_last_modified}, result)
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_INDEX, self.context, data_dict)
+        self.context['model'].Group.get.assert_called_once_with('org_name')
+        # Only the filters are taken into account (not the page)
+        actions.db.DataRequest.get_last_modified.assert_called_once_with(
+            organization_id=self.context['model'].Group.get.return_value.id, closed=False,
+            visibility=constants.DataRequestState.visible.value, q='bus')
+
+    def test_datarequest_last_modified_datarequest(self):
+        update_time = datetime.datetime(2017, 3, 4, 10, 11, 12)
+        actions.db.DataRequest.get_last_modified.return_value = (1, update_time)
+
+        result = actions.datarequest_last_modified(self.context, {'id': 'dr_id'})
+
+        self.assertEquals({'count': 1, 'last_modified': '2017-03-04T10:11:12'}, result)
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_SHOW, self.context, {'id': 'dr_id'})
+        actions.db.DataRequest.get_last_modified.assert_called_once_with(id='dr_id')
+
+    def test_datarequest_last_modified_not_found(self):
+        actions.db.DataRequest.get_last_modified.return_value = (0, None)
+
+        with self.assertRaises(self._tk.ObjectNotFound):
+            actions.datarequest_last_modified(self.context, {'id': 'dr_id'})
+
+    def test_datarequest_last_modified_not_authorized(self):
+        actions.tk.check_access.side_effect = self._tk.NotAuthorized
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_last_modified(self.context, {})
+
+        self.assertEquals(0, actions.db.DataRequest.get_last_modified.call_count)
+
+    ######################################################################
+    ############################## METRICS ###############################
+    ######################################################################
+
+    @parameterized.expand([
+        ({},                ['datarequest_last_modified', 'datarequest_metrics']),
+        ({'reset': 'true'}, ['datarequest_metrics'])
+    ])
+    def test_datarequest_metrics(self, data_dict, expected_actions_after):
+        actions.tk.asbool = self._tk.asbool
+        actions.metrics.get_metrics(reset=True)
+        actions.db.DataRequest.get_last_modified.return_value = (1, None)
+        actions.datarequest_last_modified(self.context, {'id': 'dr_id'})
+
+        result = actions.datarequest_metrics(self.context, data_dict)
+
+        actions.tk.check_access.assert_called_with(constants.DATAREQUEST_METRICS, self.context, data_dict)
+        self.assertEquals(['datarequest_last_modified'], result['actions'].keys())
+        self.assertEquals(1, result['actions']['datarequest_last_modified']['calls'])
+
+        # The call to datarequest_metrics is included in the following ones
+        self.assertEquals(expected_actions_after, sorted(actions.metrics.get_metrics()['actions'].keys()))
+
+    def test_datarequest_metrics_not_authorized(self):
+        actions.tk.check_access.side_effect = self._tk.NotAuthorized
+        actions.metrics.get_metrics(reset=True)
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_metrics(self.context, {'reset': True})
+
+        # Metrics are not reset and the error is counted
+        self.assertEquals(1, actions.metrics.get_metrics()['actions']['datarequest_metrics']['errors'])
+
+
     ######################################################################
     ############################### DELETE ###############################
     ######################################################################
@@ -484,10 +889,8 @@ class ActionsTest(unittest.TestCase):
         datarequest.accepted_dataset_id = accepted_dataset_id
         actions.db.DataRequest.get.return_value = [datarequest]
 
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
         default_user = {'user': 3}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        self._initialize_bulk_queries(default_user)
 
         # Call the function
         expected_data_dict = test_data.delete_request_data.copy()
@@ -498,9 +901,11 @@ class ActionsTest(unittest.TestCase):
         actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_DELETE, self.context, expected_data_dict)
         self.context['session'].delete.assert_called_once_with(datarequest)
         self.context['session'].commit.assert_called_once_with()
+        self._check_open_datarequests_number_invalidated()
+        self._check_pages_invalidated(actions.cache.ALL_PAGES)
 
-        org = default_org if organization_id else None
-        pkg = default_pkg if accepted_dataset_id else None
+        org = self._summary(datarequest.organization_id) if datarequest.organization_id else None
+        pkg = self._summary(datarequest.accepted_dataset_id) if datarequest.accepted_dataset_id else None
         self._check_basic_response(datarequest, result, default_user, org, pkg)
 
 
@@ -539,10 +944,8 @@ class ActionsTest(unittest.TestCase):
         actions.db.DataRequest.get.return_value = [datarequest]
 
         # Mock actions
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
         default_user = {'user': 3}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        self._initialize_bulk_queries(default_user)
 
         # Call the function
         expected_data_dict = data.copy()
@@ -554,19 +957,211 @@ class ActionsTest(unittest.TestCase):
         self.context['session'].add.assert_called_once_with(datarequest)
         self.context['session'].commit.assert_called_once_with()
 
+        self._check_open_datarequests_number_invalidated()
+        self._check_pages_invalidated(actions.cache.ALL_PAGES)
+
         # The data object returned by the database has been modified appropriately
         self.assertTrue(datarequest.closed)
         self.assertEquals(datarequest.close_time, current_time)
+        self.assertEquals(datarequest.update_time, current_time)
         if expected_accepted_ds:
             self.assertEquals(datarequest.accepted_dataset_id, data['accepted_dataset_id'])
         else:
             self.assertIsNone(datarequest.accepted_dataset_id)
 
-        org = default_org if organization_id else None
-        pkg = default_pkg if expected_accepted_ds else None
+        org = self._summary(datarequest.organization_id) if datarequest.organization_id else None
+        pkg = self._summary(datarequest.accepted_dataset_id) if datarequest.accepted_dataset_id else None
         self._check_basic_response(datarequest, result, default_user, org, pkg)
 
 
+    ######################################################################
+    ############################# BULK UPDATE ############################
+    ######################################################################
+
+    def test_datarequest_bulk_update_not_authorized(self):
+        request_data = {'operation': 'close', 'ids': ['dr_id']}
+        actions.tk.check_access = MagicMock(side_effect=self._tk.NotAuthorized)
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_bulk_update(self.context, request_data)
+
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_BULK_UPDATE, self.context, request_data)
+        self.assertEquals(0, actions.db.DataRequest.close_many.call_count)
+
+    @parameterized.expand([
+        ({'ids': ['dr_id']},                                                 'Operation'),
+        ({'operation': 'delete', 'ids': ['dr_id']},                          'Operation'),
+        ({'operation': 'visibility', 'ids': ['dr_id']},                      'Visibility'),
+        ({'operation': 'visibility', 'visibility': 'other', 'ids': ['dr_id']}, 'Visibility'),
+        ({'operation': 'close', 'ids': 'dr_id'},                             'IDs'),
+        ({'operation': 'close', 'filters': 'closed'},                        'Filters'),
+        ({'operation': 'close'},                                             'Data Requests'),
+        ({'operation': 'close', 'ids': []},                                  'Data Requests')
+    ])
+    def test_datarequest_bulk_update_invalid(self, request_data, field):
+        with self.assertRaises(self._tk.ValidationError) as c:
+            actions.datarequest_bulk_update(self.context, request_data)
+
+        self.assertEquals([field], c.exception.error_dict.keys())
+        self.assertEquals(0, self.context['session'].commit.call_count)
+
+    @parameterized.expand([
+        ('close',      None,      'close_many',          True),
+        ('reopen',     None,      'reopen_many',         True),
+        ('visibility', 'hidden',  'set_visibility_many', False),
+        ('visibility', 'visible', 'set_visibility_many', False)
+    ])
+    def test_datarequest_bulk_update(self, operation, visibility, method, counters_changed):
+        current_time = self._datetime.datetime.now()
+        actions.datetime.datetime.now = MagicMock(return_value=current_time)
+        update_many = getattr(actions.db.DataRequest, method)
+        update_many.return_value = 1500
+        organization = self.context['model'].Group.get.return_value
+        request_data = {
+            'operation': operation,
+            'visibility': visibility,
+            'ids': ['dr_1', 'dr_2'],
+            'filters': {'organization_id': 'org_name', 'closed': False, 'q': 'spam '}
+        }
+
+        result = actions.datarequest_bulk_update(self.context, request_data)
+
+        self.assertEquals({'count': 1500}, result)
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_BULK_UPDATE, self.context, request_data)
+
+        # The filters of datarequest_index are used
+        params = {'organization_id': organization.id, 'closed': False, 'q': 'spam'}
+        if visibility:
+            update_many.assert_called_once_with(constants.DataRequestState[visibility].value, current_time,
+                                                ['dr_1', 'dr_2'], **params)
+        else:
+            update_many.assert_called_once_with(current_time, ['dr_1', 'dr_2'], **params)
+
+        # The data requests are not loaded
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
+        self.context['session'].commit.assert_called_once_with()
+        self._check_pages_invalidated(actions.cache.ALL_PAGES)
+        if counters_changed:
+            self._check_open_datarequests_number_invalidated()
+        else:
+            self.assertEquals(0, actions.cache.get_counters_cache.call_count)
+
+    def test_datarequest_bulk_update_all(self):
+        # Empty filters select all the data requests
+        actions.db.DataRequest.close_many.return_value = 0
+        current_time = self._datetime.datetime.now()
+        actions.datetime.datetime.now = MagicMock(return_value=current_time)
+
+        result = actions.datarequest_bulk_update(self.context, {'operation': 'close', 'filters': {}})
+
+        self.assertEquals({'count': 0}, result)
+        actions.db.DataRequest.close_many.assert_called_once_with(current_time, None)
+
+        # Nothing has changed
+        self.assertEquals(0, actions.cache.get_counters_cache.call_count)
+        self.assertEquals(0, actions.cache.get_pages_cache.call_count)
+
+    @parameterized.expand([
+        ({'operation': 'close', 'ids': [], 'filters': {}},),
+        ({'operation': 'reopen', 'ids': [], 'filters': {'closed': True}},),
+        ({'operation': 'visibility', 'visibility': 'hidden', 'ids': [], 'filters': {}},)
+    ])
+    def test_datarequest_bulk_update_empty_ids(self, request_data):
+        result = actions.datarequest_bulk_update(self.context, request_data)
+
+        # An empty selection never updates all the data requests
+        self.assertEquals({'count': 0}, result)
+        self.assertEquals(0, actions.db.DataRequest.close_many.call_count)
+        self.assertEquals(0, actions.db.DataRequest.reopen_many.call_count)
+        self.assertEquals(0, actions.db.DataRequest.set_visibility_many.call_count)
+        self.assertEquals(0, actions.cache.get_pages_cache.call_count)
+
+
+    ######################################################################
+    ######################## DATASET AUTOCOMPLETE ########################
+    ######################################################################
+
+    def _init_package_search(self, results):
+        package_search = actions.tk.get_action.return_value
+        package_search.return_value = {'count': len(results), 'results': results}
+        return package_search
+
+    def test_datarequest_dataset_autocomplete_not_authorized(self):
+        actions.tk.check_access.side_effect = self._tk.NotAuthorized
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_dataset_autocomplete(self.context, {'q': 'exam'})
+
+        self.assertEquals(0, actions.tk.get_action.call_count)
+
+    @parameterized.expand([
+        ('exam',        None,  None,  10,  'name:exam* OR (title:exam*)'),
+        ('  EXAM ',     None,  '5',   5,   'name:exam* OR (title:exam*)'),
+        ('air q:a',     None,  1000,  100, 'name:air\\ q\\:a* OR (title:air* AND title:q\\:a*)'),
+        ('exam',        'org', 10,    10,  'name:exam* OR (title:exam*)')
+    ])
+    def test_datarequest_dataset_autocomplete(self, q, organization_id, limit, expected_limit, expected_query):
+        model = self.context['model']
+        model.Group.get.return_value.id = 'org_id'
+        package_search = self._init_package_search([{'name': 'example', 'title': 'Example'}, {'name': 'example2'}])
+        data_dict = {'q': q}
+        if organization_id:
+            data_dict['organization_id'] = organization_id
+        if limit is not None:
+            data_dict['limit'] = limit
+
+        result = actions.datarequest_dataset_autocomplete(self.context, data_dict)
+
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_DATASET_AUTOCOMPLETE, self.context, data_dict)
+        self.assertEquals([{'name': 'example', 'title': 'Example'}, {'name': 'example2', 'title': None}], result)
+
+        # Prefix lookup on the name and the title in the search index
+        actions.tk.get_action.assert_called_once_with('package_search')
+        expected_fq = '+dataset_type:dataset'
+
+        if organization_id:
+            model.Group.get.assert_called_once_with(organization_id)
+            expected_fq += ' +owner_org:"org_id"'
+        else:
+            self.assertEquals(0, model.Group.get.call_count)
+
+        package_search.assert_called_once_with({'ignore_auth': True}, {
+            'q': expected_query,
+            'fq': expected_fq,
+            'fl': ['name', 'title'],
+            'sort': 'name asc',
+            'rows': expected_limit
+        })
+
+        # The data base is not queried
+        self.assertEquals(0, model.Session.query.call_count)
+
+    @parameterized.expand([
+        ({'q': ''},),
+        ({'q': '   '},),
+        ({},),
+        ({'q': 'exam', 'limit': 0},)
+    ])
+    def test_datarequest_dataset_autocomplete_empty(self, data_dict):
+        self.assertEquals([], actions.datarequest_dataset_autocomplete(self.context, data_dict))
+        self.assertEquals(0, actions.tk.get_action.call_count)
+
+    def test_datarequest_dataset_autocomplete_invalid_limit(self):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_dataset_autocomplete(self.context, {'q': 'exam', 'limit': 'invalid'})
+
+        self.assertEquals(0, actions.tk.get_action.call_count)
+
+    def test_datarequest_dataset_autocomplete_organization_not_found(self):
+        self._init_package_search([])
+        self.context['model'].Group.get.return_value = None
+
+        with self.assertRaises(self._tk.ObjectNotFound):
+            actions.datarequest_dataset_autocomplete(self.context, {'q': 'exam', 'organization_id': 'org'})
+
+        self.assertEquals(0, actions.tk.get_action.call_count)
+
+
     ######################################################################
     ############################### COMMENT ##############################
     ######################################################################
@@ -605,6 +1200,7 @@ class ActionsTest(unittest.TestCase):
         # User
         default_user = {'user': 'value'}
         test_data._initialize_basic_actions(actions, default_user, None, None)
+        self._initialize_bulk_queries(default_user)
 
         # Call the function
         result = actions.datarequest_comment(self.context, test_data.comment_request_data)
@@ -619,10 +1215,13 @@ class ActionsTest(unittest.TestCase):
 
         self.context['session'].add.assert_called_once_with(comment)
         self.context['session'].commit.assert_called_once()
+        actions.db.DataRequest.update_comment_count.assert_called_once_with(comment.datarequest_id, 1, current_time)
+        self._check_pages_invalidated(actions.cache.LIST_PAGES, comment.datarequest_id)
 
         # Check the object stored in the database
         self.assertEquals(self.context['auth_user_obj'].id, comment.user_id)
         self.assertEquals(test_data.comment_request_data['comment'], comment.comment)
+        self.assertEquals(actions.markup.render_comment(comment.comment), comment.comment_html)
         self.assertEquals(test_data.comment_request_data['datarequest_id'], comment.datarequest_id)
         self.assertEquals(current_time, comment.time)
 
@@ -651,6 +1250,7 @@ class ActionsTest(unittest.TestCase):
         # User
         default_user = {'user': 'value'}
         test_data._initialize_basic_actions(actions, default_user, None, None)
+        self._initialize_bulk_queries(default_user)
 
         # Call the function
         result = actions.datarequest_comment_show(self.context, test_data.comment_show_request_data)
@@ -658,6 +1258,18 @@ class ActionsTest(unittest.TestCase):
         # Check that the response is OK
         self._check_comment(comment, result, default_user)
 
+    def test_comment_show_not_rendered(self):
+        # Comments stored before the HTML was rendered at write time
+        comment = test_data._generate_basic_comment(comment_html=None)
+        comment.comment = 'Visit http://example.com\nnow'
+        actions.db.Comment.get.return_value = [comment]
+        test_data._initialize_basic_actions(actions, {'user': 'value'}, None, None)
+
+        result = actions.datarequest_comment_show(self.context, test_data.comment_show_request_data)
+
+        self.assertEquals('Visit <a href="http://example.com" target="_blank">http://example.com</a><br/>now',
+                          result['comment_html'])
+
 
     ######################################################################
     ############################ LIST COMMENTS ###########################
@@ -680,14 +1292,86 @@ class ActionsTest(unittest.TestCase):
         # User
         default_user = {'user': 'value'}
         test_data._initialize_basic_actions(actions, default_user, None, None)
+        self._initialize_bulk_queries(default_user)
 
         # Call the function
         results = actions.datarequest_comment_list(self.context, test_data.comment_show_request_data)
 
         # Check that the response is OK
+        self.assertEquals(len(comments), len(results))
         for i in range(0, len(results)):
             self._check_comment(comments[i], results[i], default_user)
 
+        # All the comments are written by the same user, so only one user is retrieved
+        # and user_show is not called
+        actions._user_to_dict.assert_called_once()
+        self.assertEquals(0, actions.tk.get_action('user_show').call_count)
+
+    def test_comment_list_cached_users(self):
+        comments = [test_data._generate_basic_comment(user_id='user_%d' % i) for i in range(0, 3)]
+        actions.db.Comment.get_ordered_by_date.return_value = comments
+
+        cached_user = {'user': 'cached'}
+        default_user = {'user': 'value'}
+        actions.USERS_CACHE.set('user_0', cached_user)
+        self._initialize_bulk_queries(default_user)
+
+        results = actions.datarequest_comment_list(self.context, test_data.comment_show_request_data)
+
+        # Only the users that are not cached are queried
+        self.context['model'].User.id.in_.assert_called_once_with(set(['user_1', 'user_2']))
+        self.assertEquals(cached_user, results[0]['user'])
+        self.assertEquals(default_user, results[1]['user'])
+        self.assertEquals(default_user, results[2]['user'])
+
+    def test_comment_list_users_activity(self):
+        comments = [test_data._generate_basic_comment(user_id=user_id) for user_id in ('user_id', 'other_user')]
+        actions.db.Comment.get_ordered_by_date.return_value = comments
+        self._initialize_bulk_queries({'user': 'value'})
+
+        actions.datarequest_comment_list(self.context, test_data.comment_show_request_data)
+
+        # Only the columns of the users are retrieved
+        model = self.context['model']
+        queried = [call[0] for call in model.Session.query.call_args_list]
+        self.assertIn(tuple(getattr(model.User, column) for column in actions.USER_COLUMNS), queried)
+
+        # The edits and the datasets of all the users are counted with one query each
+        queried = [entities[0] for entities in queried]
+        self.assertEquals(1, queried.count(model.Revision.author))
+        self.assertEquals(1, queried.count(model.Package.creator_user_id))
+
+        numbers = dict((call[0][0].id, call[0][1:]) for call in actions._user_to_dict.call_args_list)
+        self.assertEquals({'user_id': (3, 3), 'other_user': (0, 0)}, numbers)
+
+    @parameterized.expand([
+        (u'Example User', u'Example User', u' User@Example.com ', 'user@example.com'),
+        (u'  ',           u'user',         None,                 '')
+    ])
+    def test_user_to_dict(self, fullname, expected_display_name, email, hashed_email):
+        created = self._datetime.datetime(2020, 1, 2, 3, 4, 5)
+        user_row = MagicMock(id='user_id', fullname=fullname, email=email, created=created, about=u'About',
+                             activity_streams_email_notifications=False, sysadmin=False, state=u'active')
+        user_row.name = u'user'
+
+        result = actions._user_to_dict(user_row, 2, 3)
+
+        # Same fields than user_show without a requester: the email is not included
+        self.assertEquals({
+            'id': 'user_id',
+            'name': u'user',
+            'fullname': fullname,
+            'created': '2020-01-02T03:04:05',
+            'about': u'About',
+            'activity_streams_email_notifications': False,
+            'sysadmin': False,
+            'state': u'active',
+            'display_name': expected_display_name,
+            'email_hash': hashlib.md5(hashed_email).hexdigest(),
+            'number_of_edits': 2,
+            'number_created_packages': 3
+        }, result)
+
 
     ######################################################################
     ########################### UPDATE COMMENT ###########################
@@ -718,6 +1402,7 @@ class ActionsTest(unittest.TestCase):
         # Mock actions
         default_user = {'user': 'value'}
         test_data._initialize_basic_actions(actions, default_user, None, None)
+        self._initialize_bulk_queries(default_user)
 
         # Store previous user (needed to check that it has not been modified)
         previous_user_id = comment.user_id
@@ -733,11 +1418,14 @@ class ActionsTest(unittest.TestCase):
 
         self.context['session'].add.assert_called_once_with(comment)
         self.context['session'].commit.assert_called_once()
+        actions.db.DataRequest.set_update_time.assert_called_once_with(comment.datarequest_id,
+                                                                       actions.datetime.datetime.now.return_value)
 
         # Check the object stored in the database
         self.assertEquals(previous_user_id, comment.user_id)
         self.assertEquals(test_data.comment_update_request_data['datarequest_id'], comment.datarequest_id)
         self.assertEquals(test_data.comment_update_request_data['comment'], comment.comment)
+        self.assertEquals(actions.markup.render_comment(comment.comment), comment.comment_html)
 
         # Check the result
         self._check_comment(comment, result, default_user)
@@ -763,6 +1451,7 @@ class ActionsTest(unittest.TestCase):
 
         default_user = {'user': 'value'}
         test_data._initialize_basic_actions(actions, default_user, None, None)
+        self._initialize_bulk_queries(default_user)
 
         # Call the function
         expected_data_dict = test_data.comment_delete_request_data.copy()
@@ -773,5 +1462,35 @@ class ActionsTest(unittest.TestCase):
         actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_COMMENT_DELETE, self.context, expected_data_dict)
         self.context['session'].delete.assert_called_once_with(comment)
         self.context['session'].commit.assert_called_once_with()
+        actions.db.DataRequest.update_comment_count.assert_called_once_with(comment.datarequest_id, -1,
+                                                                            actions.datetime.datetime.now.return_value)
+        self._check_pages_invalidated(actions.cache.LIST_PAGES, comment.datarequest_id)
 
         self._check_comment(comment, result, default_user)
+
+    ######################################################################
+    ############################ USERS CACHE #############################
+    ######################################################################
+
+    def test_get_users_cached(self):
+        user = {'id': 'user_id', 'name': 'user'}
+        self._initialize_bulk_queries(user)
+
+        self.assertEquals({'user_id': user}, actions._get_users(self.context, ['user_id']))
+        self.assertEquals({'user_id': user}, actions._get_users(self.context, ['user_id']))
+
+        # The user is only retrieved the first time
+        self.assertEquals(1, actions._user_to_dict.call_count)
+        self.assertEquals(1, actions.USERS_CACHE.hits)
+        self.assertEquals(1, actions.USERS_CACHE.misses)
+
+    def test_invalidate_user(self):
+        old_user = {'id': 'user_id', 'name': 'old_name'}
+        new_user = {'id': 'user_id', 'name': 'new_name'}
+        self._initialize_bulk_queries(None)
+        actions._user_to_dict.side_effect = [old_user, new_user]
+
+        self.assertEquals({'user_id': old_user}, actions._get_users(self.context, ['user_id']))
+        actions.invalidate_user(MagicMock(), MagicMock(), MagicMock(id='user_id'))
+        self.assertEquals({'user_id': new_user}, actions._get_users(self.context, ['user_id']))
+        self.assertEquals(2, actions._user_to_dict.call_count)
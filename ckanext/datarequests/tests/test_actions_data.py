@@ -17,6 +17,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
+import ckanext.datarequests.constants as constants
 import copy
 import datetime
 
@@ -39,7 +40,9 @@ def dictice_ddbb_response(datarequest):
         'open_time': str(datarequest.open_time),
         'accepted_dataset_id': datarequest.accepted_dataset_id,
         'close_time': str(datarequest.close_time) if datarequest.close_time else datarequest.close_time,
-        'closed': datarequest.closed
+        'closed': datarequest.closed,
+        'visibility': constants.DataRequestState(datarequest.visibility).name,
+        'comments_count': datarequest.comment_count
     }
 
 
@@ -75,14 +78,15 @@ def _generate_basic_ddbb_response(number, organizations=None, closed=None):
     response = list()
     for n in range(number):
         response.append(_generate_basic_datarequest(organization_id=organizations[n], 
-                                                    closed=closed[n]))
+                                                    closed=closed[n], comment_count=n % 3))
 
     return response
 
 
 def _generate_basic_datarequest(id=DATAREQUEST_ID, user_id='example_uuidv4_user',
                                 title='This is a title', description='This is a basic description',
-                                organization_id='example_uuidv4_organization', closed=False):
+                                organization_id='example_uuidv4_organization', closed=False,
+                                comment_count=0):
     datarequest = MagicMock()
     datarequest.id = id
     datarequest.user_id = user_id
@@ -94,16 +98,20 @@ def _generate_basic_datarequest(id=DATAREQUEST_ID, user_id='example_uuidv4_user'
     datarequest.close_time = None
     datarequest.accepted_dataset_id = None
     datarequest.accepted_dataset = {'test': 'test1', 'test2': 'test3'}
+    datarequest.visibility = constants.DataRequestState.visible.value
+    datarequest.comment_count = comment_count
 
     return datarequest
 
 
 def _generate_basic_comment(id=COMMENT_ID, user_id='example_uuidv4_user',
-                            comment='Example Comment', datarequest_id='example_dr_id'):
+                            comment='Example Comment', datarequest_id='example_dr_id',
+                            comment_html='Example Comment'):
     comment = MagicMock()
     comment.id = id
     comment.user_id = user_id
     comment.comment = comment
+    comment.comment_html = comment_html
     comment.datarequest_id = datarequest_id
     comment.time = datetime.datetime.now()
 
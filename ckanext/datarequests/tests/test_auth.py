@@ -69,6 +69,10 @@ class AuthTest(unittest.TestCase):
         (auth.datarequest_index,  context, None),
         (auth.datarequest_index,  None,    request_data_dr),
         (auth.datarequest_index,  context, request_data_dr),
+        (auth.datarequest_dataset_autocomplete, None,    {'q': 'example'}),
+        (auth.datarequest_dataset_autocomplete, context, {'q': 'example'}),
+        (auth.datarequest_last_modified, None,    None),
+        (auth.datarequest_last_modified, context, request_data_dr),
         # Comments
         (auth.datarequest_comment,        None,    None),
         (auth.datarequest_comment,        context, None),
@@ -84,6 +88,35 @@ class AuthTest(unittest.TestCase):
     def test_everyone_can_create_show_and_index(self, function, context, request_data):
         self.assertTrue(function(context, request_data).get('success', False))
 
+    @parameterized.expand([
+        (None,    None),
+        (context, {'datarequests': [request_data_dr]})
+    ])
+    def test_only_sysadmins_can_create_many(self, context, request_data):
+        # Sysadmins are authorized by CKAN before calling the auth function
+        self.assertFalse(auth.datarequest_create_many(context, request_data).get('success', True))
+
+    @parameterized.expand([
+        (None,    None),
+        (context, {'operation': 'close', 'ids': ['dr_id']})
+    ])
+    def test_only_sysadmins_can_bulk_update(self, context, request_data):
+        self.assertFalse(auth.datarequest_bulk_update(context, request_data).get('success', True))
+
+    @parameterized.expand([
+        (None,    None),
+        (context, {})
+    ])
+    def test_only_sysadmins_can_export(self, context, request_data):
+        self.assertFalse(auth.datarequest_export(context, request_data).get('success', True))
+
+    @parameterized.expand([
+        (None,    None),
+        (context, {'reset': True})
+    ])
+    def test_only_sysadmins_can_get_metrics(self, context, request_data):
+        self.assertFalse(auth.datarequest_metrics(context, request_data).get('success', True))
+
     @parameterized.expand([
         # Data Requests
         (auth.datarequest_update, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'user_id'}, True, True),
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.cache as cache
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._time = cache.time
+        cache.time = MagicMock()
+        cache.time.time.return_value = 1000
+
+    def tearDown(self):
+        cache.time = self._time
+
+    def test_get_set(self):
+        lru = cache.LRUCache(max_size=10, ttl=60)
+        lru.set('a', 1)
+
+        self.assertEquals(1, lru.get('a'))
+        self.assertIsNone(lru.get('b'))
+        self.assertEquals('default', lru.get('b', 'default'))
+        self.assertEquals(1, lru.hits)
+        self.assertEquals(2, lru.misses)
+
+    def test_least_recently_used_discarded(self):
+        lru = cache.LRUCache(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')            # 'b' becomes the least recently used entry
+        lru.set('c', 3)
+
+        self.assertEquals(2, len(lru))
+        self.assertIn('a', lru)
+        self.assertNotIn('b', lru)
+        self.assertIn('c', lru)
+
+    @parameterized.expand([
+        (60, 1059, True),
+        (60, 1060, False),
+        (0, 100000, True),
+        (None, 100000, True)
+    ])
+    def test_ttl(self, ttl, now, found):
+        lru = cache.LRUCache(max_size=10, ttl=ttl)
+        lru.set('a', 1)
+
+        cache.time.time.return_value = now
+        self.assertEquals(1 if found else None, lru.get('a'))
+
+    def test_delete(self):
+        lru = cache.LRUCache()
+        lru.set('a', 1)
+        lru.delete('a')
+        lru.delete('b')     # Deleting a missing key does not fail
+
+        self.assertNotIn('a', lru)
+        self.assertEquals(0, len(lru))
+
+    def test_clear_and_stats(self):
+        lru = cache.LRUCache(max_size=5, ttl=30)
+        lru.set('a', 1)
+        lru.get('a')
+        lru.get('b')
+
+        self.assertEquals({'hits': 1, 'misses': 1, 'size': 1, 'max_size': 5, 'ttl': 30}, lru.stats())
+
+        lru.clear()
+        self.assertEquals({'hits': 0, 'misses': 0, 'size': 0, 'max_size': 5, 'ttl': 30}, lru.stats())
+
+
+class RedisCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis_cache = cache.RedisCache(prefix='prefix', ttl=60)
+        self.redis_cache._redis = self.redis
+
+    def test_get(self):
+        self.redis.get.return_value = '{"a": 1}'
+
+        self.assertEquals({'a': 1}, self.redis_cache.get('key'))
+        self.redis.get.assert_called_once_with('prefix:key')
+        self.assertEquals(1, self.redis_cache.hits)
+
+    @parameterized.expand([
+        (None,),
+        (Exception('Redis is not available'),)
+    ])
+    def test_get_miss(self, side_effect):
+        self.redis.get.side_effect = [side_effect] if side_effect is None else side_effect
+
+        self.assertEquals('default', self.redis_cache.get('key', 'default'))
+        self.assertEquals(1, self.redis_cache.misses)
+
+    def test_set(self):
+        self.redis_cache.set('key', 7)
+        self.redis.set.assert_called_once_with('prefix:key', '7', ex=60)
+
+    def test_delete(self):
+        self.redis_cache.delete('key')
+        self.redis.delete.assert_called_once_with('prefix:key')
+
+    def test_redis_errors_ignored(self):
+        self.redis.set.side_effect = Exception('Redis is not available')
+        self.redis.delete.side_effect = Exception('Redis is not available')
+
+        self.redis_cache.set('key', 7)
+        self.redis_cache.delete('key')
+
+
+class FileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.file_cache = cache.FileCache(os.path.join(self.path, 'cache'), max_size=3, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_get_set(self):
+        self.file_cache.set('a', u'Page \xe1')
+
+        self.assertEquals(u'Page \xe1', self.file_cache.get('a'))
+        self.assertIsNone(self.file_cache.get('b'))
+        self.assertEquals('default', self.file_cache.get(u'b\xe1', 'default'))
+        self.assertEquals(1, self.file_cache.hits)
+        self.assertEquals(2, self.file_cache.misses)
+
+    def test_shared_between_instances(self):
+        self.file_cache.set('a', 1)
+        self.assertEquals(1, cache.FileCache(self.file_cache.path).get('a'))
+
+    def test_least_recently_used_discarded(self):
+        for key in ('a', 'b', 'c'):
+            self.file_cache.set(key, key)
+            # Entries are ordered by their modification time
+            os.utime(self.file_cache._file(key), (1000, 1000 + ord(key)))
+
+        os.utime(self.file_cache._file('a'), None)      # 'b' becomes the least recently used entry
+        self.file_cache.set('d', 'd')
+
+        self.assertEquals(3, len(os.listdir(self.file_cache.path)))
+        self.assertIsNone(self.file_cache.get('b'))
+        for key in ('a', 'c', 'd'):
+            self.assertEquals(key, self.file_cache.get(key))
+
+    def test_expired(self):
+        self.file_cache.set('a', 1)
+
+        self._time = cache.time
+        cache.time = MagicMock()
+        cache.time.time.return_value = self._time.time() + 60
+
+        try:
+            self.assertIsNone(self.file_cache.get('a'))
+            self.assertFalse(os.path.exists(self.file_cache._file('a')))
+        finally:
+            cache.time = self._time
+
+    def test_delete(self):
+        self.file_cache.set('a', 1)
+        self.file_cache.delete('a')
+        self.file_cache.delete('b')     # Deleting a missing key does not fail
+
+        self.assertIsNone(self.file_cache.get('a'))
+
+    def test_errors_ignored(self):
+        # The directory cannot be created
+        open(os.path.join(self.path, 'file'), 'w').close()
+        file_cache = cache.FileCache(os.path.join(self.path, 'file', 'cache'))
+
+        file_cache.set('a', 1)
+        self.assertIsNone(file_cache.get('a'))
+
+
+class PagesCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pages_cache = cache.PagesCache(cache.LRUCache())
+
+    def test_get_set(self):
+        self.pages_cache.set('/datarequest', ('all', 'lists'), 'page')
+
+        self.assertEquals('page', self.pages_cache.get('/datarequest', ('all', 'lists')))
+        self.assertIsNone(self.pages_cache.get('/datarequest?page=2', ('all', 'lists')))
+
+    @parameterized.expand([
+        ('all',   False, False),
+        ('lists', False, True),
+        ('dr_id', True,  False),
+        ('other', True,  True)
+    ])
+    def test_invalidate(self, scope, list_found, datarequest_found):
+        self.pages_cache.set('/datarequest', ('all', 'lists'), 'list')
+        self.pages_cache.set('/datarequest/dr_id', ('all', 'dr_id'), 'datarequest')
+
+        self.pages_cache.invalidate(scope)
+
+        self.assertEquals('list' if list_found else None, self.pages_cache.get('/datarequest', ('all', 'lists')))
+        self.assertEquals('datarequest' if datarequest_found else None,
+                          self.pages_cache.get('/datarequest/dr_id', ('all', 'dr_id')))
+
+
+class CreateCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._config = cache.config
+        cache.config = {}
+        cache._counters_cache = None
+        cache._pages_cache = None
+
+    def tearDown(self):
+        cache.config = self._config
+        cache._counters_cache = None
+        cache._pages_cache = None
+
+    @parameterized.expand([
+        ('memory', cache.LRUCache),
+        ('redis', cache.RedisCache),
+        ('file', cache.FileCache)
+    ])
+    def test_create_cache(self, backend, expected_class):
+        created_cache = cache.create_cache(backend, ttl=10)
+        self.assertIsInstance(created_cache, expected_class)
+        self.assertEquals(10, created_cache.ttl)
+
+    def test_create_cache_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            cache.create_cache('unknown')
+
+    @parameterized.expand([
+        ({}, cache.LRUCache, 60),
+        ({'ckan.datarequests.counters_cache.backend': 'redis',
+          'ckan.datarequests.counters_cache.ttl': '30'}, cache.RedisCache, 30)
+    ])
+    def test_get_counters_cache(self, config, expected_class, expected_ttl):
+        cache.config = config
+
+        counters_cache = cache.get_counters_cache()
+
+        self.assertIsInstance(counters_cache, expected_class)
+        self.assertEquals(expected_ttl, counters_cache.ttl)
+        # The same cache is always returned
+        self.assertIs(counters_cache, cache.get_counters_cache())
+
+    @parameterized.expand([
+        ({},),
+        ({'ckan.datarequests.pages_cache.enabled': 'false'},)
+    ])
+    def test_get_pages_cache_disabled(self, config):
+        cache.config = config
+        self.assertIsNone(cache.get_pages_cache())
+
+    @parameterized.expand([
+        ({}, cache.FileCache, 1000, 60, os.path.join(tempfile.gettempdir(), 'ckanext-datarequests-pages')),
+        ({'ckan.datarequests.pages_cache.backend': 'memory'}, cache.LRUCache, 1000, 60),
+        ({'ckan.datarequests.pages_cache.backend': 'file',
+          'ckan.datarequests.pages_cache.path': '/tmp/pages',
+          'ckan.datarequests.pages_cache.size': '50',
+          'ckan.datarequests.pages_cache.ttl': '30'}, cache.FileCache, 50, 30, '/tmp/pages')
+    ])
+    def test_get_pages_cache(self, config, expected_class, expected_size, expected_ttl, expected_path=None):
+        cache.config = dict(config, **{'ckan.datarequests.pages_cache.enabled': 'true'})
+
+        pages_cache = cache.get_pages_cache()
+
+        self.assertIsInstance(pages_cache, cache.PagesCache)
+        self.assertIsInstance(pages_cache.cache, expected_class)
+        self.assertEquals(expected_size, pages_cache.cache.max_size)
+        self.assertEquals(expected_ttl, pages_cache.cache.ttl)
+        if expected_class == cache.FileCache:
+            # The pages cache is shared by the processes of the server by default
+            self.assertEquals(expected_path, pages_cache.cache.path)
+        # The same cache is always returned
+        self.assertIs(pages_cache, cache.get_pages_cache())
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.commands as commands
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import call, MagicMock
+from nose_parameterized import parameterized
+
+
+class DataRequestsCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self._db = commands.db
+        commands.db = MagicMock()
+
+        self._model = commands.model
+        commands.model = MagicMock()
+
+        self._export = commands.export
+        commands.export = MagicMock()
+        commands.export.export.return_value = ['chunk 1\n', 'chunk 2\n']
+
+        self._importer = commands.importer
+        commands.importer = MagicMock()
+
+        self._sys = commands.sys
+        commands.sys = MagicMock()
+
+        self._tk = commands.tk
+        commands.tk = MagicMock()
+        commands.tk.get_action.return_value.return_value = {'name': 'site_user'}
+
+        self.command = commands.DataRequestsCommand('datarequests')
+        self.command._load_config = MagicMock()
+
+    def tearDown(self):
+        commands.db = self._db
+        commands.model = self._model
+        commands.export = self._export
+        commands.importer = self._importer
+        commands.sys = self._sys
+        commands.tk = self._tk
+
+    def test_initdb(self):
+        self.command.args = ['initdb']
+        self.command.command()
+
+        self.command._load_config.assert_called_once_with()
+        commands.db.setup_db.assert_called_once_with(commands.model)
+
+    def test_rebuild_comment_count(self):
+        self.command.args = ['rebuild-comment-count']
+        self.command.command()
+
+        commands.db.init_db.assert_called_once_with(commands.model)
+        commands.db.DataRequest.rebuild_comment_count.assert_called_once_with()
+        commands.model.Session.commit.assert_called_once_with()
+
+    def test_rebuild_comment_html(self):
+        self.command.args = ['rebuild-comment-html']
+        self.command.batch_size = 2
+        comments = [MagicMock(id='c%d' % i, comment='Comment %d\nhttp://example.com' % i) for i in range(3)]
+        commands.db.Comment.get_ordered_by_id.side_effect = [comments[:2], comments[2:], []]
+
+        self.command.command()
+
+        # Comments are rendered in batches, one transaction per batch
+        commands.db.init_db.assert_called_once_with(commands.model)
+        self.assertEquals([((), {'after': None, 'limit': 2}), ((), {'after': 'c1', 'limit': 2}),
+                           ((), {'after': 'c2', 'limit': 2})],
+                          commands.db.Comment.get_ordered_by_id.call_args_list)
+        self.assertEquals(2, commands.model.Session.commit.call_count)
+
+        for comment in comments:
+            self.assertEquals(commands.markup.render_comment(comment.comment), comment.comment_html)
+
+    @parameterized.expand([
+        (['export', 'csv'],                'csv',   False),
+        (['export', 'jsonl', 'comments'],  'jsonl', True)
+    ])
+    def test_export_stdout(self, args, export_format, include_comments):
+        self.command.args = args
+        self.command.options = MagicMock(file_path=None)
+
+        self.command.command()
+
+        commands.export.export.assert_called_once_with(export_format, include_comments)
+        self.assertEquals([call('chunk 1\n'), call('chunk 2\n')], commands.sys.stdout.write.call_args_list)
+
+        # The access is checked as the site user
+        commands.tk.get_action.assert_called_once_with('get_site_user')
+        commands.tk.get_action.return_value.assert_called_once_with({'ignore_auth': True}, {})
+        commands.tk.check_access.assert_called_once_with(
+            commands.constants.DATAREQUEST_EXPORT,
+            {'model': commands.model, 'session': commands.model.Session, 'user': 'site_user'}, {})
+
+    def test_export_not_authorized(self):
+        self.command.args = ['export', 'csv']
+        self.command.options = MagicMock(file_path=None)
+        commands.tk.check_access.side_effect = ValueError('Not authorized')
+
+        with self.assertRaises(ValueError):
+            self.command.command()
+
+        self.assertEquals(0, commands.export.export.call_count)
+
+    def test_export_file(self):
+        file_path = os.path.join(tempfile.mkdtemp(), 'datarequests.jsonl')
+        self.command.args = ['export', 'jsonl']
+        self.command.options = MagicMock(file_path=file_path)
+
+        try:
+            self.command.command()
+
+            # Chunks are written as they are generated
+            commands.export.export.assert_called_once_with('jsonl', False)
+            with open(file_path) as f:
+                self.assertEquals('chunk 1\nchunk 2\n', f.read())
+            self.assertEquals(0, commands.sys.stdout.write.call_count)
+        finally:
+            shutil.rmtree(os.path.dirname(file_path))
+
+    @parameterized.expand([
+        (['export'],),
+        (['export', 'xml'],)
+    ])
+    def test_export_invalid_format(self, args):
+        self.command.args = args
+        self.command.options = MagicMock(file_path=None)
+
+        self.command.command()
+
+        self.assertEquals(0, commands.export.export.call_count)
+
+    def test_import(self):
+        directory = tempfile.mkdtemp()
+        file_path = os.path.join(directory, 'datarequests.jsonl')
+        errors_path = os.path.join(directory, 'errors.jsonl')
+        with open(file_path, 'w') as f:
+            f.write('{"id": "dr_1"}\n{"id": "dr_2"}\n')
+
+        def import_lines(lines, progress):
+            self.assertEquals(['{"id": "dr_1"}\n', '{"id": "dr_2"}\n'], list(lines))
+            progress(datarequests_importer)
+
+        datarequests_importer = commands.importer.Importer.return_value
+        datarequests_importer.lines = datarequests_importer.datarequests = 2
+        datarequests_importer.comments = datarequests_importer.errors = 0
+        datarequests_importer.import_lines.side_effect = import_lines
+        self.command.args = ['import', file_path]
+        self.command.options = MagicMock(file_path=errors_path)
+
+        try:
+            self.command.command()
+
+            # Errors are written to the given file, which is closed at the end
+            errors_output = commands.importer.Importer.call_args[0][0]
+            self.assertEquals(errors_path, errors_output.name)
+            self.assertTrue(errors_output.closed)
+            self.assertEquals(1, datarequests_importer.import_lines.call_count)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_import_errors_stdout(self):
+        file_path = os.path.join(tempfile.mkdtemp(), 'datarequests.jsonl')
+        open(file_path, 'w').close()
+        datarequests_importer = commands.importer.Importer.return_value
+        datarequests_importer.lines = datarequests_importer.datarequests = 0
+        datarequests_importer.comments = datarequests_importer.errors = 0
+        self.command.args = ['import', file_path]
+        self.command.options = MagicMock(file_path=None)
+
+        try:
+            self.command.command()
+            commands.importer.Importer.assert_called_once_with(commands.sys.stdout)
+        finally:
+            shutil.rmtree(os.path.dirname(file_path))
+
+    def test_import_no_file(self):
+        self.command.args = ['import']
+        self.command.options = MagicMock(file_path=None)
+
+        self.command.command()
+
+        self.assertEquals(0, commands.importer.Importer.call_count)
+
+    def test_unknown_command(self):
+        self.command.args = ['unknown']
+        self.command.command()
+
+        self.assertEquals(0, commands.db.setup_db.call_count)
+        self.assertEquals(0, commands.db.DataRequest.rebuild_comment_count.call_count)
@@ -30,6 +30,8 @@ class DBTest(unittest.TestCase):
         # Restart databse initial status
         db.DataRequest = None
         db.Comment = None
+        db._schema_ready = False
+        db._unique_title_index = None
 
         # Create mocks
         self._sa = db.sa
@@ -41,6 +43,8 @@ class DBTest(unittest.TestCase):
     def tearDown(self):
         db.Comment = None
         db.DataRequest = None
+        db._schema_ready = False
+        db._unique_title_index = None
         db.sa = self._sa
         db.func = self._func
 
@@ -77,7 +81,7 @@ class DBTest(unittest.TestCase):
         self.assertEquals(db_response, result)
         final_query.filter_by.assert_called_once_with(**params)
 
-    def _test_get_ordered_by_date(self, table, time_column):
+    def _test_get_ordered_by_date(self, table, time_column, id_tiebreaker=False):
         db_response = [MagicMock(), MagicMock(), MagicMock()]
 
         query_result = MagicMock()
@@ -102,6 +106,7 @@ class DBTest(unittest.TestCase):
         table = getattr(db, table)
         time_column_value = MagicMock()
         setattr(table, time_column, time_column_value)
+        table.id = MagicMock()
 
         # Call the method
         params = {
@@ -112,7 +117,10 @@ class DBTest(unittest.TestCase):
 
         # Assertions
         self.assertEquals(db_response, result)
-        no_ordered.order_by.assert_called_once_with(time_column_value.desc())
+        if id_tiebreaker:
+            no_ordered.order_by.assert_called_once_with(time_column_value.desc(), table.id.desc())
+        else:
+            no_ordered.order_by.assert_called_once_with(time_column_value.desc())
         final_query.filter_by.assert_called_once_with(**params)
 
     def test_initdb_not_initialized(self):
@@ -131,6 +139,11 @@ class DBTest(unittest.TestCase):
         model.meta.mapper.assert_any_call(db.DataRequest, table_data_request)
         model.meta.mapper.assert_any_call(db.Comment, table_comment)
 
+        # The data base is not accessed
+        self.assertEquals(0, table_data_request.exists.call_count)
+        self.assertEquals(0, table_data_request.create.call_count)
+        self.assertEquals(0, table_comment.create.call_count)
+
     def test_initdb_initialized(self):
         db.DataRequest = MagicMock()
         db.Comment = MagicMock()
@@ -143,6 +156,76 @@ class DBTest(unittest.TestCase):
         self.assertEquals(0, db.sa.Table.call_count)
         self.assertEquals(0, model.meta.mapper.call_count)
 
+    @parameterized.expand([
+        (False, [],                                                        False, False, False),
+        (True,  ['extras', 'visibility', 'comment_count', 'update_time'],  False, False, False),
+        (True,  ['visibility', 'comment_count', 'update_time'],            True,  False, False),
+        (True,  ['extras', 'comment_count', 'update_time'],                False, True,  False),
+        (True,  ['extras', 'visibility', 'update_time'],                   False, False, True),
+        (True,  [],                                                        True,  True,  True,  False, False, True),
+        (True,  ['extras', 'visibility', 'comment_count'],                 False, False, False, False, False, True),
+        # Columns created by other process at the same time: their values are computed by that process
+        (True,  ['extras', 'visibility'],                                  False, False, True,  False, False, True, False),
+        # Comments table
+        (True,  ['extras', 'visibility', 'comment_count', 'update_time'],  False, False, False, True,  True),
+        (True,  ['extras', 'visibility', 'comment_count', 'update_time', 'comment_html'], False, False, False, True, False)
+    ])
+    def test_setup_db(self, table_exists, columns, extras_migrated, visibility_migrated,
+                      comment_count_migrated=False, comments_table_exists=False, comment_html_migrated=False,
+                      update_time_migrated=False, migrated_by_this_process=True):
+        mocked = ('Inspector', 'migrate_extras', 'migrate_visibility', 'migrate_comment_count', 'migrate_comment_html',
+                  'migrate_update_time', 'migrate_indexes', 'migrate_unique_title_index', 'migrate_search', 'Session')
+        originals = dict((name, getattr(db, name)) for name in mocked)
+        for name in mocked:
+            setattr(db, name, MagicMock())
+
+        try:
+            table_data_request = MagicMock()
+            table_data_request.exists.return_value = table_exists
+            table_comment = MagicMock()
+            table_comment.exists.return_value = comments_table_exists
+            db.sa.Table = MagicMock(side_effect=[table_data_request, table_comment])
+            db.migrate_comment_count.return_value = migrated_by_this_process
+            db.migrate_update_time.return_value = migrated_by_this_process
+            db.Inspector.from_engine.return_value.get_columns.return_value = [{'name': c} for c in columns]
+
+            # Call the function twice: the schema is only checked the first time
+            model = MagicMock()
+            model.DomainObject = object
+            db.init_db(model)
+            db.DataRequest.rebuild_comment_count = MagicMock()
+            db.DataRequest.rebuild_update_time = MagicMock()
+            db.setup_db(model)
+            db.setup_db(model)
+
+            # Assertions
+            table_data_request.exists.assert_called_once_with()
+            self.assertEquals(0 if table_exists else 1, table_data_request.create.call_count)
+            if not table_exists:
+                table_data_request.create.assert_called_once_with(checkfirst=True)
+            self.assertEquals(1 if extras_migrated else 0, db.migrate_extras.call_count)
+            self.assertEquals(1 if visibility_migrated else 0, db.migrate_visibility.call_count)
+            self.assertEquals(1 if comment_count_migrated else 0, db.migrate_comment_count.call_count)
+            self.assertEquals(0 if comments_table_exists else 1, table_comment.create.call_count)
+            self.assertEquals(1 if comment_html_migrated else 0, db.migrate_comment_html.call_count)
+            self.assertEquals(1 if update_time_migrated else 0, db.migrate_update_time.call_count)
+            self.assertEquals(2, db.migrate_indexes.call_count)
+            db.migrate_indexes.assert_any_call('datarequests', db.DATAREQUESTS_INDEXES)
+            db.migrate_indexes.assert_any_call('datarequests_comments', db.COMMENTS_INDEXES)
+            db.migrate_unique_title_index.assert_called_once_with()
+            db.migrate_search.assert_called_once_with()
+            self.assertTrue(db._schema_ready)
+
+            # The number of comments and the last modification time are computed when the columns are created
+            comment_count_rebuilt = comment_count_migrated and migrated_by_this_process
+            update_time_rebuilt = update_time_migrated and migrated_by_this_process
+            self.assertEquals(1 if comment_count_rebuilt else 0, db.DataRequest.rebuild_comment_count.call_count)
+            self.assertEquals(1 if update_time_rebuilt else 0, db.DataRequest.rebuild_update_time.call_count)
+            self.assertEquals(int(comment_count_rebuilt) + int(update_time_rebuilt), db.Session.commit.call_count)
+        finally:
+            for name in mocked:
+                setattr(db, name, originals[name])
+
     def test_datarequest_get(self):
         self._test_get('DataRequest')
 
@@ -196,7 +279,184 @@ class DBTest(unittest.TestCase):
         final_query.filter.assert_called_once_with(expected_result)
 
     def test_datarequest_get_ordered_by_date(self):
-        self._test_get_ordered_by_date('DataRequest', 'open_time')
+        self._test_get_ordered_by_date('DataRequest', 'open_time', True)
+
+    def test_datarequest_get_ordered_by_date_after(self):
+        db_response = [MagicMock(), MagicMock()]
+
+        ordered = MagicMock()
+        ordered.limit.return_value = ordered
+        ordered.all.return_value = db_response
+
+        after_filtered = MagicMock()
+        after_filtered.order_by.return_value = ordered
+
+        filtered = MagicMock()
+        filtered.filter.return_value = after_filtered
+
+        final_query = MagicMock()
+        final_query.filter_by.return_value = filtered
+
+        query = MagicMock()
+        query.autoflush = MagicMock(return_value=final_query)
+
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query = MagicMock(return_value=query)
+
+        self._and = db.and_
+        self._or = db.or_
+        db.and_ = MagicMock()
+        db.or_ = MagicMock()
+
+        try:
+            # Init the database
+            db.init_db(model)
+            db.DataRequest.open_time = MagicMock()
+            db.DataRequest.id = MagicMock()
+
+            # Call the method
+            params = {'closed': False}
+            result = db.DataRequest.get_ordered_by_date(limit=5, after=('time', 'id'), **params)
+
+            # Assertions
+            self.assertEquals(db_response, result)
+            final_query.filter_by.assert_called_once_with(**params)
+            db.and_.assert_called_once_with(db.DataRequest.open_time == 'time', db.DataRequest.id < 'id')
+            db.or_.assert_called_once_with(db.DataRequest.open_time < 'time', db.and_.return_value)
+            filtered.filter.assert_called_once_with(db.or_.return_value)
+            after_filtered.order_by.assert_called_once_with(db.DataRequest.open_time.desc(), db.DataRequest.id.desc())
+            ordered.limit.assert_called_once_with(5)
+        finally:
+            db.and_ = self._and
+            db.or_ = self._or
+
+    @parameterized.expand([
+        (0, None),
+        (20, 10),
+        (0, 10)
+    ])
+    def test_datarequest_get_ordered_by_date_paginated(self, offset, limit):
+        db_response = [MagicMock(), MagicMock(), MagicMock()]
+
+        paginated = MagicMock()
+        paginated.offset.return_value = paginated
+        paginated.limit.return_value = paginated
+        paginated.all.return_value = db_response
+
+        no_ordered = MagicMock()
+        no_ordered.order_by.return_value = paginated
+
+        final_query = MagicMock()
+        final_query.filter_by.return_value = no_ordered
+
+        query = MagicMock()
+        query.autoflush = MagicMock(return_value=final_query)
+
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query = MagicMock(return_value=query)
+
+        # Init the database
+        db.init_db(model)
+        db.DataRequest.open_time = MagicMock()
+        db.DataRequest.id = MagicMock()
+
+        # Call the method
+        params = {'organization_id': 'example_uuid_v4'}
+        result = db.DataRequest.get_ordered_by_date(offset=offset, limit=limit, **params)
+
+        # Assertions
+        self.assertEquals(db_response, result)
+        final_query.filter_by.assert_called_once_with(**params)
+
+        if offset:
+            paginated.offset.assert_called_once_with(offset)
+        else:
+            self.assertEquals(0, paginated.offset.call_count)
+
+        if limit is not None:
+            paginated.limit.assert_called_once_with(limit)
+        else:
+            self.assertEquals(0, paginated.limit.call_count)
+
+    def test_get_datarequests_number(self):
+
+        n_datarequests = 7
+        count = 'example'
+
+        db.func = MagicMock()
+        db.func.count.return_value = count
+
+        filter_by = MagicMock()
+        filter_by.scalar.return_value = n_datarequests
+
+        query = MagicMock()
+        query.filter_by = MagicMock(return_value=filter_by)
+
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query = MagicMock(return_value=query)
+
+        # Init the database
+        db.init_db(model)
+
+        # Call the method
+        params = {'organization_id': 'example_uuid_v4', 'closed': False}
+        db.DataRequest.id = 'id'
+        result = db.DataRequest.get_datarequests_number(**params)
+
+        # Assertions
+        self.assertEquals(n_datarequests, result)
+        query.filter_by.assert_called_once_with(**params)
+        model.Session.query.assert_called_once_with(count)
+        db.func.count.assert_called_once_with(db.DataRequest.id)
+
+    @parameterized.expand([
+        ('organization_id',),
+        ('closed',),
+        ('visibility',)
+    ])
+    def test_get_facet(self, field):
+
+        db_response = [('value1', 3), ('value2', 5)]
+        count = 'example'
+
+        db.func = MagicMock()
+        db.func.count.return_value = count
+
+        grouped = MagicMock()
+        grouped.all.return_value = db_response
+
+        filtered = MagicMock()
+        filtered.group_by.return_value = grouped
+
+        final_query = MagicMock()
+        final_query.filter_by.return_value = filtered
+
+        query = MagicMock()
+        query.autoflush = MagicMock(return_value=final_query)
+
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query = MagicMock(return_value=query)
+
+        # Init the database
+        db.init_db(model)
+        column = MagicMock()
+        setattr(db.DataRequest, field, column)
+        db.DataRequest.id = 'id'
+
+        # Call the method
+        params = {'user_id': 'example_uuid_v4', 'closed': True}
+        result = db.DataRequest.get_facet(field, **params)
+
+        # Assertions
+        self.assertEquals(db_response, result)
+        model.Session.query.assert_called_once_with(column, count)
+        db.func.count.assert_called_once_with(db.DataRequest.id)
+        final_query.filter_by.assert_called_once_with(**params)
+        filtered.group_by.assert_called_once_with(column)
 
     def test_get_open_datarequests_number(self):
 
@@ -268,3 +528,674 @@ class DBTest(unittest.TestCase):
         query.filter_by.assert_called_once_with(**params)
         model.Session.query.assert_called_once_with(count)
         db.func.count.assert_called_once_with(db.Comment.id)
+
+    def _init_datarequest_query(self):
+        query = MagicMock()
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query = MagicMock(return_value=query)
+
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.open_time = MagicMock()
+        db.DataRequest.comment_count = MagicMock()
+
+        return model, query
+
+    @parameterized.expand([
+        (None, None),
+        (10,   5)
+    ])
+    def test_get_ordered_by_comments(self, offset, limit):
+        model, query = self._init_datarequest_query()
+        ordered = query.autoflush.return_value.filter_by.return_value.order_by.return_value
+        paginated = ordered.offset.return_value if offset else ordered
+        paginated = paginated.limit.return_value if limit else paginated
+        paginated.all.return_value = [MagicMock(), MagicMock()]
+
+        result = db.DataRequest.get_ordered_by_comments(offset=offset, limit=limit, closed=False)
+
+        self.assertEquals(paginated.all.return_value, result)
+        query.autoflush.return_value.filter_by.assert_called_once_with(closed=False)
+        query.autoflush.return_value.filter_by.return_value.order_by.assert_called_once_with(
+            db.DataRequest.comment_count.desc(), db.DataRequest.open_time.desc(), db.DataRequest.id.desc())
+        self.assertEquals(1 if offset else 0, ordered.offset.call_count)
+
+    def test_search_postgresql(self):
+        model, query = self._init_datarequest_query()
+        model.Session.get_bind.return_value.dialect.name = 'postgresql'
+
+        result, relevance = db.DataRequest._search(query, 'bus stops')
+
+        # The vector is the expression of the GIN index
+        db.sa.literal_column.assert_called_once_with(db.SEARCH_VECTOR)
+        vector = db.sa.literal_column.return_value
+        db.func.plainto_tsquery.assert_called_once_with(db.SEARCH_CONFIG, 'bus stops')
+        vector.op.assert_called_once_with('@@')
+        vector.op.return_value.assert_called_once_with(db.func.plainto_tsquery.return_value)
+        query.filter.assert_called_once_with(vector.op.return_value.return_value)
+        self.assertEquals(query.filter.return_value, result)
+        db.func.ts_rank.assert_called_once_with(vector, db.func.plainto_tsquery.return_value)
+        self.assertEquals(db.func.ts_rank.return_value.desc.return_value, relevance)
+
+    def test_search_sqlite(self):
+        model, query = self._init_datarequest_query()
+        model.Session.get_bind.return_value.dialect.name = 'sqlite'
+
+        self._and = db.and_
+        db.and_ = MagicMock()
+        try:
+            result, relevance = db.DataRequest._search(query, 'bus stops')
+        finally:
+            db.and_ = self._and
+
+        # Rows matched by the FTS5 table
+        db.sa.table.assert_called_once_with(db.SEARCH_TABLE, db.sa.column.return_value)
+        db.sa.literal_column.return_value.op.assert_any_call('MATCH')
+        db.sa.literal_column.return_value.op.return_value.assert_called_once_with(u'"bus" "stops"')
+        db.sa.literal_column.return_value.in_.assert_called_once_with(db.sa.select.return_value.where.return_value)
+        query.filter.assert_called_once_with(db.sa.literal_column.return_value.in_.return_value)
+        self.assertEquals(query.filter.return_value, result)
+        db.func.bm25.assert_called_once_with(db.sa.literal_column.return_value)
+        self.assertEquals(db.sa.select.return_value.where.return_value.as_scalar.return_value, relevance)
+
+    @parameterized.expand([
+        (u'!!!',),
+        (u'"',),
+        (u'  ',)
+    ])
+    def test_search_sqlite_without_words(self, q):
+        model, query = self._init_datarequest_query()
+        model.Session.get_bind.return_value.dialect.name = 'sqlite'
+
+        result, relevance = db.DataRequest._search(query, q)
+
+        # FTS5 is not queried: no data request is matched
+        self.assertEquals(0, db.sa.literal_column.call_count)
+        query.filter.assert_called_once_with(db.sa.false.return_value)
+        self.assertEquals(query.filter.return_value, result)
+        self.assertEquals(db.DataRequest.open_time.desc.return_value, relevance)
+
+    def test_search_other_data_bases(self):
+        model, query = self._init_datarequest_query()
+        model.Session.get_bind.return_value.dialect.name = 'mysql'
+        db.DataRequest.title = MagicMock()
+        db.DataRequest.description = MagicMock()
+
+        self._or = db.or_
+        or_ = db.or_ = MagicMock()
+        try:
+            result, relevance = db.DataRequest._search(query, 'bus')
+        finally:
+            db.or_ = self._or
+
+        or_.assert_called_once_with(db.DataRequest.title.ilike.return_value,
+                                    db.DataRequest.description.ilike.return_value)
+        db.DataRequest.title.ilike.assert_called_once_with('%bus%')
+        db.DataRequest.description.ilike.assert_called_once_with('%bus%')
+        self.assertEquals(1, query.filter.call_count)
+        self.assertEquals(query.filter.return_value, result)
+        self.assertEquals(db.DataRequest.open_time.desc.return_value, relevance)
+
+    @parameterized.expand([
+        (None,),
+        ('bus',)
+    ])
+    def test_filter(self, q):
+        model, query = self._init_datarequest_query()
+        db.DataRequest._search = MagicMock(return_value=(MagicMock(), MagicMock()))
+
+        result = db.DataRequest._filter(query, q=q, closed=False)
+
+        query.filter_by.assert_called_once_with(closed=False)
+        if q:
+            db.DataRequest._search.assert_called_once_with(query.filter_by.return_value, q)
+            self.assertEquals(db.DataRequest._search.return_value[0], result)
+        else:
+            self.assertEquals(0, db.DataRequest._search.call_count)
+            self.assertEquals(query.filter_by.return_value, result)
+
+    @parameterized.expand([
+        (None, None),
+        (10,   5)
+    ])
+    def test_get_ordered_by_relevance(self, offset, limit):
+        model, query = self._init_datarequest_query()
+        searched_query = MagicMock()
+        relevance = MagicMock()
+        db.DataRequest._search = MagicMock(return_value=(searched_query, relevance))
+        ordered = searched_query.order_by.return_value
+        paginated = ordered.offset.return_value if offset else ordered
+        paginated = paginated.limit.return_value if limit else paginated
+        paginated.all.return_value = [MagicMock(), MagicMock()]
+
+        result = db.DataRequest.get_ordered_by_relevance('bus', offset=offset, limit=limit, closed=False)
+
+        self.assertEquals(paginated.all.return_value, result)
+        query.autoflush.return_value.filter_by.assert_called_once_with(closed=False)
+        db.DataRequest._search.assert_called_once_with(query.autoflush.return_value.filter_by.return_value, 'bus')
+        searched_query.order_by.assert_called_once_with(relevance, db.DataRequest.open_time.desc(),
+                                                        db.DataRequest.id.desc())
+        self.assertEquals(1 if offset else 0, ordered.offset.call_count)
+
+    @parameterized.expand([
+        (u'bus stops',            u'"bus" "stops"'),
+        (u'"bus" OR stops* -x:y', u'"bus" "OR" "stops" "x" "y"'),
+        (u'Información',          u'"Información"'),
+        (u'  ',                   u''),
+        (u'!!! "',                u'')
+    ])
+    def test_fts_query(self, q, expected_query):
+        self.assertEquals(expected_query, db._fts_query(q))
+
+    @parameterized.expand([
+        ('postgresql', True,  False),
+        ('sqlite',     False, True),
+        ('mysql',      False, False)
+    ])
+    def test_migrate_search(self, dialect, index_created, fts_table_created):
+        mocked = ('Session', 'migrate_indexes', 'migrate_fts_table', 'log')
+        originals = dict((name, getattr(db, name)) for name in mocked)
+        for name in mocked:
+            setattr(db, name, MagicMock())
+
+        try:
+            db.Session.get_bind.return_value.dialect.name = dialect
+
+            db.migrate_search()
+
+            if index_created:
+                db.migrate_indexes.assert_called_once_with('datarequests', db.SEARCH_INDEXES)
+            else:
+                self.assertEquals(0, db.migrate_indexes.call_count)
+
+            self.assertEquals(1 if fts_table_created else 0, db.migrate_fts_table.call_count)
+            self.assertEquals(0 if index_created or fts_table_created else 1, db.log.warn.call_count)
+        finally:
+            for name in mocked:
+                setattr(db, name, originals[name])
+
+    def test_update_comment_count(self):
+        model, query = self._init_datarequest_query()
+
+        db.DataRequest.update_comment_count('dr_id', -1)
+
+        # The column is updated in the data base
+        model.Session.query.assert_called_once_with(db.DataRequest)
+        query.filter_by.assert_called_once_with(id='dr_id')
+        query.filter_by.return_value.update.assert_called_once_with(
+            {db.DataRequest.comment_count: db.DataRequest.comment_count + (-1)}, synchronize_session=False)
+
+    def test_update_comment_count_update_time(self):
+        model, query = self._init_datarequest_query()
+        db.DataRequest.update_time = MagicMock()
+        update_time = MagicMock()
+
+        db.DataRequest.update_comment_count('dr_id', 1, update_time)
+
+        query.filter_by.assert_called_once_with(id='dr_id')
+        query.filter_by.return_value.update.assert_called_once_with(
+            {db.DataRequest.comment_count: db.DataRequest.comment_count + 1,
+             db.DataRequest.update_time: update_time}, synchronize_session=False)
+
+    def test_set_update_time(self):
+        model, query = self._init_datarequest_query()
+        db.DataRequest.update_time = MagicMock()
+        update_time = MagicMock()
+
+        db.DataRequest.set_update_time('dr_id', update_time)
+
+        model.Session.query.assert_called_once_with(db.DataRequest)
+        query.filter_by.assert_called_once_with(id='dr_id')
+        query.filter_by.return_value.update.assert_called_once_with({db.DataRequest.update_time: update_time},
+                                                                    synchronize_session=False)
+
+    def test_get_last_modified(self):
+        model, query = self._init_datarequest_query()
+        db.DataRequest.update_time = MagicMock()
+        db_response = (3, MagicMock())
+        query.autoflush.return_value.filter_by.return_value.one.return_value = list(db_response)
+
+        params = {'organization_id': 'example_uuid_v4', 'closed': False}
+        result = db.DataRequest.get_last_modified(**params)
+
+        self.assertEquals(db_response, result)
+        db.func.count.assert_called_once_with(db.DataRequest.id)
+        db.func.max.assert_called_once_with(db.DataRequest.update_time)
+        model.Session.query.assert_called_once_with(db.func.count.return_value, db.func.max.return_value)
+        query.autoflush.return_value.filter_by.assert_called_once_with(**params)
+
+    @parameterized.expand([
+        ([],),
+        ([u'Title', u'Other Title'],),
+    ])
+    def test_get_existing_titles(self, existing_titles):
+        model, query = self._init_datarequest_query()
+        db.DataRequest.title = MagicMock()
+        filtered = query.autoflush.return_value.filter
+        filtered.return_value = [(title.lower(),) for title in existing_titles]
+
+        result = db.DataRequest.get_existing_titles([u'Title', u'TITLE', u'Other Title', u'New'])
+
+        # Titles are compared in lowercase with a single query
+        self.assertEquals(set(title.lower() for title in existing_titles), result)
+        model.Session.query.assert_called_once_with(db.func.lower.return_value)
+        db.func.lower.assert_called_with(db.DataRequest.title)
+        db.func.lower.return_value.in_.assert_called_once_with(set([u'title', u'other title', u'new']))
+        filtered.assert_called_once_with(db.func.lower.return_value.in_.return_value)
+
+    def test_get_existing_titles_empty(self):
+        model, query = self._init_datarequest_query()
+
+        self.assertEquals(set(), db.DataRequest.get_existing_titles([]))
+        self.assertEquals(0, model.Session.query.call_count)
+
+    @parameterized.expand([
+        ('DataRequest',),
+        ('Comment',)
+    ])
+    def test_get_existing_ids(self, class_name):
+        model, query = self._init_datarequest_query()
+        model_class = getattr(db, class_name)
+        model_class.id = MagicMock()
+        filtered = query.autoflush.return_value.filter
+        filtered.return_value = [('id_1',), ('id_3',)]
+
+        result = model_class.get_existing_ids(['id_1', 'id_2', 'id_3', 'id_1'])
+
+        # Only one query is executed for all the IDs
+        self.assertEquals(set(['id_1', 'id_3']), result)
+        model.Session.query.assert_called_once_with(model_class.id)
+        model_class.id.in_.assert_called_once_with(set(['id_1', 'id_2', 'id_3']))
+        filtered.assert_called_once_with(model_class.id.in_.return_value)
+
+    @parameterized.expand([
+        ('DataRequest',),
+        ('Comment',)
+    ])
+    def test_get_existing_ids_empty(self, class_name):
+        model, query = self._init_datarequest_query()
+
+        self.assertEquals(set(), getattr(db, class_name).get_existing_ids([]))
+        self.assertEquals(0, model.Session.query.call_count)
+
+    def test_insert_many(self):
+        model, query = self._init_datarequest_query()
+        rows = [{'id': 'dr1', 'title': 'Title 1'}, {'id': 'dr2', 'title': 'Title 2'}]
+
+        db.DataRequest.insert_many(rows)
+
+        # Only one statement is executed for all the rows
+        db.datarequests_table.insert.assert_called_once_with()
+        model.Session.execute.assert_called_once_with(db.datarequests_table.insert.return_value, rows)
+
+    def _init_update_many(self):
+        model, query = self._init_datarequest_query()
+        for column in ('closed', 'close_time', 'update_time', 'accepted_dataset_id', 'visibility'):
+            setattr(db.DataRequest, column, MagicMock())
+        filtered = query.filter_by.return_value.filter.return_value
+        filtered.update.return_value = 7
+        filtered.filter.return_value.update.return_value = 3
+        return model, query, filtered
+
+    @parameterized.expand([
+        ('close_many',),
+        ('reopen_many',)
+    ])
+    def test_close_reopen_many(self, method):
+        model, query, filtered = self._init_update_many()
+        update_time = MagicMock()
+
+        result = getattr(db.DataRequest, method)(update_time, organization_id='org', closed=False)
+
+        # The data requests are updated with a single statement
+        self.assertEquals(7, result)
+        query.filter_by.assert_called_once_with(organization_id='org', closed=False)
+        closing = method == 'close_many'
+        query.filter_by.return_value.filter.assert_called_once_with(db.DataRequest.closed == (not closing))
+        filtered.update.assert_called_once_with({
+            db.DataRequest.closed: closing,
+            db.DataRequest.close_time: update_time if closing else None,
+            db.DataRequest.update_time: update_time,
+            db.DataRequest.accepted_dataset_id: None
+        }, synchronize_session=False)
+
+    @parameterized.expand([
+        (3,    1),
+        (500,  1),
+        (501,  2),
+        (1200, 3)
+    ])
+    def test_set_visibility_many_ids(self, ids_number, statements):
+        model, query, filtered = self._init_update_many()
+        update_time = MagicMock()
+        ids = ['dr_%d' % i for i in range(ids_number)]
+
+        result = db.DataRequest.set_visibility_many(1, update_time, ids)
+
+        # One statement per chunk of IDs
+        self.assertEquals(3 * statements, result)
+        self.assertEquals(statements, filtered.filter.call_count)
+        self.assertEquals(0, filtered.update.call_count)
+        db.DataRequest.id.in_.assert_any_call(ids[:db.BULK_IDS_CHUNK_SIZE])
+        db.DataRequest.id.in_.assert_called_with(ids[(statements - 1) * db.BULK_IDS_CHUNK_SIZE:])
+        filtered.filter.return_value.update.assert_called_with(
+            {db.DataRequest.visibility: 1, db.DataRequest.update_time: update_time}, synchronize_session=False)
+
+    def test_rebuild_comment_count(self):
+        model, query = self._init_datarequest_query()
+        db.Comment.id = MagicMock()
+        db.Comment.datarequest_id = MagicMock()
+        comments_number = db.sa.select.return_value.where.return_value.as_scalar.return_value
+
+        db.DataRequest.rebuild_comment_count()
+
+        db.func.count.assert_called_once_with(db.Comment.id)
+        db.sa.select.assert_called_once_with([db.func.count.return_value])
+        db.sa.select.return_value.where.assert_called_once_with(db.Comment.datarequest_id == db.DataRequest.id)
+        query.update.assert_called_once_with({db.DataRequest.comment_count: comments_number},
+                                             synchronize_session=False)
+
+    @parameterized.expand([
+        (4,    4),
+        (None, 0)
+    ])
+    def test_get_comment_count(self, db_value, expected_value):
+        model, query = self._init_datarequest_query()
+        query.autoflush.return_value.filter_by.return_value.scalar.return_value = db_value
+
+        self.assertEquals(expected_value, db.DataRequest.get_comment_count('dr_id'))
+        model.Session.query.assert_called_once_with(db.DataRequest.comment_count)
+        query.autoflush.return_value.filter_by.assert_called_once_with(id='dr_id')
+
+    @parameterized.expand([
+        (set(),),
+        (set(['datarequests_user_id_open_time_idx']),),
+        (set(db.DATAREQUESTS_INDEXES.keys()),)
+    ])
+    def test_migrate_indexes(self, existing_indexes):
+        self._session = db.Session
+        self._get_index_names = db._get_index_names
+        db.Session = MagicMock()
+        db._get_index_names = MagicMock(return_value=existing_indexes)
+
+        try:
+            db.migrate_indexes('datarequests', db.DATAREQUESTS_INDEXES)
+
+            # Only the missing indexes are created
+            db._get_index_names.assert_called_once_with('datarequests')
+            conn = db.Session.connection.return_value
+            missing_indexes = set(db.DATAREQUESTS_INDEXES.keys()) - existing_indexes
+            self.assertEquals(len(missing_indexes), conn.execute.call_count)
+            for name in missing_indexes:
+                conn.execute.assert_any_call('CREATE INDEX %s ON datarequests %s;' %
+                                             (name, db.DATAREQUESTS_INDEXES[name]))
+
+            self.assertEquals(len(missing_indexes), db.Session.commit.call_count)
+        finally:
+            db.Session = self._session
+            db._get_index_names = self._get_index_names
+
+    def test_migrate_indexes_unique(self):
+        self._session = db.Session
+        self._get_index_names = db._get_index_names
+        db.Session = MagicMock()
+        db._get_index_names = MagicMock(return_value=set())
+
+        try:
+            db.migrate_indexes('datarequests', {'example_key': '(lower(title))'}, unique=True)
+            db.Session.connection.return_value.execute.assert_called_once_with(
+                'CREATE UNIQUE INDEX example_key ON datarequests (lower(title));')
+        finally:
+            db.Session = self._session
+            db._get_index_names = self._get_index_names
+
+    @parameterized.expand([
+        (set(['example_key']), False),
+        (set(),                True)
+    ])
+    def test_migrate_indexes_failed(self, indexes_after_error, raised):
+        mocked = ('Session', '_get_index_names', 'log')
+        originals = dict((name, getattr(db, name)) for name in mocked)
+        for name in mocked:
+            setattr(db, name, MagicMock())
+
+        try:
+            db._get_index_names.side_effect = [set(), indexes_after_error]
+            db.Session.connection.return_value.execute.side_effect = db.DBAPIError('CREATE INDEX', {},
+                                                                                   Exception('error'))
+
+            # The index may have been created by other process at the same time
+            if raised:
+                with self.assertRaises(db.DBAPIError):
+                    db.migrate_indexes('datarequests', {'example_key': '(title)'})
+            else:
+                db.migrate_indexes('datarequests', {'example_key': '(title)'})
+
+            self.assertEquals(2, db._get_index_names.call_count)
+            db.Session.rollback.assert_called_once_with()
+        finally:
+            for name in mocked:
+                setattr(db, name, originals[name])
+
+    @parameterized.expand([
+        # Indexes after creating the unique one, index created, obsolete indexes dropped
+        (set([db.UNIQUE_TITLE_INDEX]),                                 True,  []),
+        (set([db.UNIQUE_TITLE_INDEX, 'datarequests_lower_title_idx']), True,  ['datarequests_lower_title_idx']),
+        # Repeated titles: the old index is kept
+        (set(['datarequests_lower_title_idx']),                        False, []),
+        (set(),                                                        False, [])
+    ])
+    def test_migrate_unique_title_index(self, existing_indexes, created, dropped_indexes):
+        mocked = ('Session', 'migrate_indexes', '_get_index_names', 'log')
+        originals = dict((name, getattr(db, name)) for name in mocked)
+        for name in mocked:
+            setattr(db, name, MagicMock())
+
+        try:
+            db._get_index_names.return_value = existing_indexes
+            if not created:
+                db.migrate_indexes.side_effect = db.IntegrityError('CREATE UNIQUE INDEX', {}, Exception('duplicated'))
+
+            db.migrate_unique_title_index()
+
+            db.migrate_indexes.assert_called_once_with('datarequests', {db.UNIQUE_TITLE_INDEX: '(lower(title))'},
+                                                       unique=True)
+            self.assertEquals(0 if created else 1, db.Session.rollback.call_count)
+            self.assertEquals(0 if created else 1, db.log.warn.call_count)
+
+            conn = db.Session.connection.return_value
+            self.assertEquals(len(dropped_indexes), conn.execute.call_count)
+            for name in dropped_indexes:
+                conn.execute.assert_any_call('DROP INDEX %s;' % name)
+            self.assertEquals(len(dropped_indexes), db.Session.commit.call_count)
+
+            # Titles are only checked before storing data requests when the index does not exist
+            self.assertEquals(created, db.has_unique_title_index())
+            db._get_index_names.assert_called_once_with('datarequests')
+        finally:
+            for name in mocked:
+                setattr(db, name, originals[name])
+
+    @parameterized.expand([
+        (None,  False, True),
+        # Changes made by other process at the same time are ignored
+        ('relation "datarequests_user_id_open_time_idx" already exists', True, False),
+        ('duplicate column name: extras', True, False),
+        # Other errors are not ignored
+        ('permission denied for relation datarequests', False, None)
+    ])
+    def test_execute_ddl(self, error, made, expected_result):
+        mocked = ('Session', 'log')
+        originals = dict((name, getattr(db, name)) for name in mocked)
+        for name in mocked:
+            setattr(db, name, MagicMock())
+
+        try:
+            conn = db.Session.connection.return_value
+            if error:
+                conn.execute.side_effect = db.DBAPIError('ALTER TABLE', {}, Exception(error))
+            made_check = MagicMock(return_value=made)
+
+            if expected_result is None:
+                with self.assertRaises(db.DBAPIError):
+                    db._execute_ddl('ALTER TABLE', made_check)
+            else:
+                self.assertEquals(expected_result, db._execute_ddl('ALTER TABLE', made_check))
+
+            conn.execute.assert_called_once_with('ALTER TABLE')
+            self.assertEquals(0 if error else 1, db.Session.commit.call_count)
+            self.assertEquals(1 if error else 0, db.Session.rollback.call_count)
+            # The schema is only inspected when the change fails
+            self.assertEquals(1 if error else 0, made_check.call_count)
+        finally:
+            for name in mocked:
+                setattr(db, name, originals[name])
+
+    @parameterized.expand([
+        ('migrate_extras',        'datarequests',          'extras'),
+        ('migrate_visibility',    'datarequests',          'visibility'),
+        ('migrate_comment_count', 'datarequests',          'comment_count'),
+        ('migrate_update_time',   'datarequests',          'update_time'),
+        ('migrate_comment_html',  'datarequests_comments', 'comment_html')
+    ])
+    def test_migrate_columns(self, migration, table_name, column_name):
+        mocked = ('_execute_ddl', '_column_exists')
+        originals = dict((name, getattr(db, name)) for name in mocked)
+        for name in mocked:
+            setattr(db, name, MagicMock())
+
+        try:
+            self.assertEquals(db._execute_ddl.return_value, getattr(db, migration)())
+
+            # The column is looked up when the change fails
+            statement, made = db._execute_ddl.call_args[0]
+            self.assertIn('ALTER TABLE %s ADD COLUMN %s ' % (table_name, column_name), statement)
+            self.assertEquals(db._column_exists.return_value, made())
+            db._column_exists.assert_called_once_with(table_name, column_name)
+        finally:
+            for name in mocked:
+                setattr(db, name, originals[name])
+
+    @parameterized.expand([
+        (['extras', 'visibility'], 'extras',     True),
+        (['visibility'],           'extras',     False)
+    ])
+    def test_column_exists(self, columns, column_name, expected_result):
+        self._inspector = db.Inspector
+        db.Inspector = MagicMock()
+        db.Inspector.from_engine.return_value.get_columns.return_value = [{'name': c} for c in columns]
+
+        try:
+            self.assertEquals(expected_result, db._column_exists('datarequests', column_name))
+            db.Inspector.from_engine.return_value.get_columns.assert_called_once_with('datarequests')
+        finally:
+            db.Inspector = self._inspector
+
+    @parameterized.expand([
+        (None,  None),
+        ('relation "datarequests" already exists', True),
+        ('permission denied for schema public',    False)
+    ])
+    def test_create_table(self, error, exists):
+        table = MagicMock()
+        table.exists.return_value = exists
+        if error:
+            table.create.side_effect = db.DBAPIError('CREATE TABLE', {}, Exception(error))
+
+        if error and not exists:
+            with self.assertRaises(db.DBAPIError):
+                db._create_table(table)
+        else:
+            db._create_table(table)
+
+        table.create.assert_called_once_with(checkfirst=True)
+        # The table is only looked up when it cannot be created
+        self.assertEquals(1 if error else 0, table.exists.call_count)
+
+    @parameterized.expand([
+        (set([db.UNIQUE_TITLE_INDEX]), True),
+        (set(['datarequests_lower_title_idx']), False)
+    ])
+    def test_has_unique_title_index(self, existing_indexes, expected_result):
+        self._get_index_names = db._get_index_names
+        db._get_index_names = MagicMock(return_value=existing_indexes)
+
+        try:
+            # Indexes are only read once
+            self.assertEquals(expected_result, db.has_unique_title_index())
+            self.assertEquals(expected_result, db.has_unique_title_index())
+            db._get_index_names.assert_called_once_with('datarequests')
+        finally:
+            db._get_index_names = self._get_index_names
+
+    @parameterized.expand([
+        (None, None),
+        ('comment_5', 100)
+    ])
+    def test_comment_get_ordered_by_id(self, after, limit):
+        query = MagicMock()
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query = MagicMock(return_value=query)
+        db.init_db(model)
+        db.Comment.id = MagicMock()
+
+        filtered = query.filter.return_value if after else query
+        ordered = filtered.order_by.return_value
+        paginated = ordered.limit.return_value if limit else ordered
+
+        result = db.Comment.get_ordered_by_id(after=after, limit=limit)
+
+        self.assertEquals(paginated.all.return_value, result)
+        model.Session.query.assert_called_once_with(db.Comment)
+        self.assertEquals(1 if after else 0, query.filter.call_count)
+        filtered.order_by.assert_called_once_with(db.Comment.id)
+        self.assertEquals(1 if limit else 0, ordered.limit.call_count)
+
+    def _columns(self, table, names):
+        columns = []
+        for name in names:
+            column = MagicMock()
+            column.name = name
+            columns.append(column)
+        table.columns = columns
+
+    def test_datarequest_iter_all(self):
+        model, query = self._init_datarequest_query()
+        db.DataRequest.title = MagicMock()
+        self._columns(db.datarequests_table, ['id', 'title'])
+        ordered = query.autoflush.return_value.order_by.return_value
+
+        result = db.DataRequest.iter_all(250)
+
+        # Only the columns are retrieved, in batches
+        self.assertEquals(ordered.yield_per.return_value, result)
+        model.Session.query.assert_called_once_with(db.DataRequest.id, db.DataRequest.title)
+        query.autoflush.return_value.order_by.assert_called_once_with(db.DataRequest.id)
+        ordered.yield_per.assert_called_once_with(250)
+
+    def test_comment_insert_many(self):
+        model, query = self._init_datarequest_query()
+        rows = [{'id': 'c1', 'comment': 'Comment 1'}, {'id': 'c2', 'comment': 'Comment 2'}]
+
+        db.Comment.insert_many(rows)
+
+        # Only one statement is executed for all the rows
+        db.comments_table.insert.assert_called_once_with()
+        model.Session.execute.assert_called_once_with(db.comments_table.insert.return_value, rows)
+
+    def test_comment_get_by_datarequests(self):
+        model, query = self._init_datarequest_query()
+        for column in ('id', 'datarequest_id', 'time'):
+            setattr(db.Comment, column, MagicMock())
+        self._columns(db.comments_table, ['id', 'datarequest_id', 'time'])
+        filtered = query.autoflush.return_value.filter.return_value
+
+        result = db.Comment.get_by_datarequests(['dr_1', 'dr_2'])
+
+        self.assertEquals(filtered.order_by.return_value.all.return_value, result)
+        model.Session.query.assert_called_once_with(db.Comment.id, db.Comment.datarequest_id, db.Comment.time)
+        db.Comment.datarequest_id.in_.assert_called_once_with(['dr_1', 'dr_2'])
+        query.autoflush.return_value.filter.assert_called_once_with(db.Comment.datarequest_id.in_.return_value)
+        filtered.order_by.assert_called_once_with(db.Comment.time, db.Comment.id)
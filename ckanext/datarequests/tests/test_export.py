@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+import ckanext.datarequests.constants as constants
+import ckanext.datarequests.export as export
+import csv
+import datetime
+import json
+import unittest
+
+from collections import namedtuple, OrderedDict
+from cStringIO import StringIO
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+DataRequestRow = namedtuple('DataRequestRow', export.DATAREQUEST_FIELDS)
+CommentRow = namedtuple('CommentRow', export.COMMENT_FIELDS + ['datarequest_id'])
+
+OPEN_TIME = datetime.datetime(2020, 1, 2, 3, 4, 5)
+
+
+def _datarequest(number, **kw):
+    values = {
+        'id': 'dr_%d' % number,
+        'user_id': 'user',
+        'title': u'T\xedtle "%d", with comma' % number,
+        'description': u'Line 1\nLine 2',
+        'organization_id': None,
+        'open_time': OPEN_TIME,
+        'accepted_dataset_id': None,
+        'close_time': None,
+        'closed': False,
+        'visibility': constants.DataRequestState.visible.value,
+        'comment_count': 0,
+        'update_time': OPEN_TIME,
+        'extras': {}
+    }
+    values.update(kw)
+    return DataRequestRow(**values)
+
+
+def _comment(number, datarequest_id):
+    return CommentRow('comment_%d' % number, 'user', OPEN_TIME, u'Comment \xe9 %d' % number, datarequest_id)
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self._db = export.db
+        export.db = MagicMock()
+
+        self._model = export.model
+        export.model = MagicMock()
+
+        self.datarequests = [_datarequest(i) for i in range(5)]
+        export.db.DataRequest.iter_all.return_value = iter(self.datarequests)
+
+    def tearDown(self):
+        export.db = self._db
+        export.model = self._model
+
+    def _set_comments(self, comments):
+        def get_by_datarequests(ids):
+            return [comment for comment in comments if comment.datarequest_id in ids]
+        export.db.Comment.get_by_datarequests.side_effect = get_by_datarequests
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            export.export('xml')
+
+        self.assertEquals(0, export.db.DataRequest.iter_all.call_count)
+
+    def test_batches(self):
+        comments = [_comment(1, 'dr_0'), _comment(2, 'dr_3'), _comment(3, 'dr_3')]
+        self._set_comments(comments)
+
+        batches = list(export.iter_batches(include_comments=True, batch_size=2))
+
+        # One query to retrieve the comments of each batch
+        export.db.DataRequest.iter_all.assert_called_once_with(2)
+        self.assertEquals([2, 2, 1], [len(batch) for batch in batches])
+        self.assertEquals([['dr_0', 'dr_1'], ['dr_2', 'dr_3'], ['dr_4']],
+                          [[record['id'] for record in batch] for batch in batches])
+        self.assertEquals(3, export.db.Comment.get_by_datarequests.call_count)
+        self.assertEquals(['comment_1'], [comment['id'] for comment in batches[0][0]['comments']])
+        self.assertEquals([], batches[0][1]['comments'])
+        self.assertEquals(['comment_2', 'comment_3'], [comment['id'] for comment in batches[1][1]['comments']])
+
+    def test_batches_without_comments(self):
+        batches = list(export.iter_batches(batch_size=10))
+
+        self.assertEquals(1, len(batches))
+        self.assertNotIn('comments', batches[0][0])
+        self.assertEquals(0, export.db.Comment.get_by_datarequests.call_count)
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    def test_export_jsonl(self, include_comments):
+        self._set_comments([_comment(1, 'dr_1')])
+
+        chunks = list(export.export(constants.DATAREQUESTS_EXPORT_JSONL, include_comments, batch_size=2))
+
+        # One chunk per batch and one line per data request
+        self.assertEquals(3, len(chunks))
+        lines = ''.join(chunks).splitlines()
+        self.assertEquals(5, len(lines))
+
+        record = json.loads(lines[1], object_pairs_hook=OrderedDict)
+        self.assertEquals(export.DATAREQUEST_FIELDS + (['comments'] if include_comments else []), record.keys())
+        self.assertEquals('dr_1', record['id'])
+        self.assertEquals(u'T\xedtle "1", with comma', record['title'])
+        self.assertEquals(OPEN_TIME.isoformat(), record['open_time'])
+        self.assertEquals('visible', record['visibility'])
+        self.assertIsNone(record['close_time'])
+
+        if include_comments:
+            self.assertEquals([{'id': 'comment_1', 'user_id': 'user', 'time': OPEN_TIME.isoformat(),
+                                'comment': u'Comment \xe9 1'}], record['comments'])
+
+        # The session is released when the export finishes
+        export.db.init_db.assert_called_once_with(export.model)
+        export.model.Session.remove.assert_called_once_with()
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    def test_export_csv(self, include_comments):
+        self._set_comments([_comment(1, 'dr_1')])
+        self.datarequests[2] = _datarequest(2, closed=True, close_time=OPEN_TIME, extras={'source': 'legacy'},
+                                            visibility=constants.DataRequestState.hidden.value)
+
+        chunks = list(export.export(constants.DATAREQUESTS_EXPORT_CSV, include_comments, batch_size=2))
+
+        self.assertEquals(3, len(chunks))
+        rows = list(csv.reader(StringIO(''.join(chunks))))
+        self.assertEquals(export.DATAREQUEST_FIELDS + (['comments'] if include_comments else []), rows[0])
+        self.assertEquals(6, len(rows))
+
+        row = dict(zip(rows[0], rows[3]))
+        self.assertEquals('dr_2', row['id'])
+        self.assertEquals(u'T\xedtle "2", with comma'.encode('utf-8'), row['title'])
+        self.assertEquals('Line 1\nLine 2', row['description'])
+        self.assertEquals('', row['organization_id'])
+        self.assertEquals(OPEN_TIME.isoformat(), row['close_time'])
+        self.assertEquals('True', row['closed'])
+        self.assertEquals('hidden', row['visibility'])
+        self.assertEquals({'source': 'legacy'}, json.loads(row['extras']))
+
+        if include_comments:
+            self.assertEquals('comment_1', json.loads(dict(zip(rows[0], rows[2]))['comments'])[0]['id'])
+            self.assertEquals([], json.loads(row['comments']))
+
+    def test_export_csv_empty(self):
+        export.db.DataRequest.iter_all.return_value = iter([])
+
+        chunks = list(export.export(constants.DATAREQUESTS_EXPORT_CSV))
+
+        self.assertEquals([','.join(export.DATAREQUEST_FIELDS) + '\r\n'], chunks)
+
+    def test_export_is_lazy(self):
+        result = export.export(constants.DATAREQUESTS_EXPORT_JSONL)
+
+        # The data base is not accessed until the export is consumed
+        self.assertEquals(0, export.db.DataRequest.iter_all.call_count)
+        next(result)
+        result.close()
+        export.model.Session.remove.assert_called_once_with()
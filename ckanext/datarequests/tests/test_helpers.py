@@ -35,15 +35,22 @@ class HelpersTest(unittest.TestCase):
         self._db = helpers.db
         helpers.db = MagicMock()
 
+        # Counters are not cached by default
+        self._cache = helpers.cache
+        helpers.cache = MagicMock()
+        self.counters_cache = helpers.cache.get_counters_cache.return_value
+        self.counters_cache.get.return_value = None
+
     def tearDown(self):
         helpers.tk = self._tk
         helpers.model = self._model
         helpers.db = self._db
+        helpers.cache = self._cache
 
     def test_get_comments_number(self):
         # Mocking
         n_comments = 3
-        helpers.db.Comment.get_datarequest_comments_number.return_value = n_comments
+        helpers.db.DataRequest.get_comment_count.return_value = n_comments
 
         # Call the function
         datarequest_id = 'example_uuidv4'
@@ -51,13 +58,13 @@ class HelpersTest(unittest.TestCase):
 
         # Assertions
         helpers.db.init_db.assert_called_once_with(helpers.model)
-        helpers.db.Comment.get_datarequest_comments_number.assert_called_once_with(datarequest_id=datarequest_id)
+        helpers.db.DataRequest.get_comment_count.assert_called_once_with(datarequest_id)
         self.assertEquals(result, n_comments)
 
     def test_get_comments_badge(self):
         # Mocking
         n_comments = 3
-        helpers.db.Comment.get_datarequest_comments_number.return_value = n_comments
+        helpers.db.DataRequest.get_comment_count.return_value = n_comments
 
         # Call the function
         datarequest_id = 'example_uuidv4'
@@ -65,7 +72,7 @@ class HelpersTest(unittest.TestCase):
 
         # Assertions
         helpers.db.init_db.assert_called_once_with(helpers.model)
-        helpers.db.Comment.get_datarequest_comments_number.assert_called_once_with(datarequest_id=datarequest_id)
+        helpers.db.DataRequest.get_comment_count.assert_called_once_with(datarequest_id)
         self.assertEquals(result, helpers.tk.render_snippet.return_value)
         helpers.tk.render_snippet.assert_called_once_with('datarequests/snippets/badge.html',
                                                           {'comments_count': n_comments})
@@ -82,6 +89,21 @@ class HelpersTest(unittest.TestCase):
         helpers.db.init_db.assert_called_once_with(helpers.model)
         helpers.db.DataRequest.get_open_datarequests_number.assert_called_once_with()
         self.assertEquals(result, n_datarequests)
+        self.counters_cache.get.assert_called_once_with(helpers.cache.OPEN_DATAREQUESTS_NUMBER)
+        self.counters_cache.set.assert_called_once_with(helpers.cache.OPEN_DATAREQUESTS_NUMBER, n_datarequests)
+
+    def test_get_open_datarequests_number_cached(self):
+        # Mocking
+        n_datarequests = 5
+        self.counters_cache.get.return_value = n_datarequests
+
+        # Call the function
+        result = helpers.get_open_datarequests_number()
+
+        # Assertions. The data base is not queried
+        self.assertEquals(result, n_datarequests)
+        self.assertEquals(0, helpers.db.DataRequest.get_open_datarequests_number.call_count)
+        self.assertEquals(0, self.counters_cache.set.call_count)
 
     def test_get_open_datarequests_badge_true(self):
         # Mocking
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.constants as constants
+import ckanext.datarequests.importer as importer
+import datetime
+import json
+import unittest
+
+from cStringIO import StringIO
+from mock import MagicMock
+from nose_parameterized import parameterized
+from sqlalchemy.exc import IntegrityError
+
+OPEN_TIME = datetime.datetime(2020, 1, 2, 3, 4, 5)
+COMMENT_TIME = datetime.datetime(2020, 1, 3, 3, 4, 5, 123456)
+
+# (ID, name) of the users, organizations and datasets stored in the data base
+EXISTING_OBJECTS = [('user_id', 'user'), ('org_id', 'org'), ('pkg_id', 'pkg')]
+
+
+def _datarequest(number, **kw):
+    record = {
+        'id': 'dr_%d' % number,
+        'user_id': 'user_id',
+        'title': u'Title %d' % number,
+        'description': u'Description',
+        'organization_id': None,
+        'open_time': OPEN_TIME.isoformat(),
+        'accepted_dataset_id': None,
+        'close_time': None,
+        'closed': False,
+        'visibility': 'visible',
+        'comment_count': 0,
+        'update_time': OPEN_TIME.isoformat(),
+        'extras': {}
+    }
+    record.update(kw)
+    return record
+
+
+def _comment(number, datarequest_id, **kw):
+    record = {
+        'id': 'comment_%d' % number,
+        'datarequest_id': datarequest_id,
+        'user_id': 'user_id',
+        'time': str(COMMENT_TIME),
+        'comment': u'Comment %d' % number
+    }
+    record.update(kw)
+    return record
+
+
+def _lines(*records):
+    return [json.dumps(record) + '\n' for record in records]
+
+
+class ImporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._db = importer.db
+        importer.db = MagicMock()
+        importer.db.DataRequest.get_existing_ids.return_value = set(['existing_dr'])
+        importer.db.Comment.get_existing_ids.return_value = set(['existing_comment'])
+
+        self._model = importer.model
+        importer.model = MagicMock()
+        importer.model.Session.query.return_value.filter.return_value = EXISTING_OBJECTS
+
+        self._or = importer.or_
+        importer.or_ = MagicMock()
+
+        self._validator = importer.validator
+        importer.validator = MagicMock()
+        importer.validator.validate_datarequests.side_effect = lambda context, datarequests: [{}] * len(datarequests)
+
+        self._cache = importer.cache
+        importer.cache = MagicMock()
+
+        self.errors_output = StringIO()
+        self.importer = importer.Importer(self.errors_output)
+
+    def tearDown(self):
+        importer.db = self._db
+        importer.model = self._model
+        importer.or_ = self._or
+        importer.validator = self._validator
+        importer.cache = self._cache
+
+    def _errors(self):
+        return [json.loads(line) for line in self.errors_output.getvalue().splitlines()]
+
+    def _inserted_datarequests(self):
+        return [row for args, _ in importer.db.DataRequest.insert_many.call_args_list for row in args[0]]
+
+    def _inserted_comments(self):
+        return [row for args, _ in importer.db.Comment.insert_many.call_args_list for row in args[0]]
+
+    @parameterized.expand([
+        (None,                          None),
+        ('',                            None),
+        ('2020-01-02 03:04:05',         OPEN_TIME),
+        ('2020-01-02T03:04:05',         OPEN_TIME),
+        ('2020-01-03 03:04:05.123456',  COMMENT_TIME),
+        ('2020-01-03T03:04:05.123456',  COMMENT_TIME)
+    ])
+    def test_parse_time(self, value, expected_time):
+        self.assertEquals(expected_time, importer._parse_time(value))
+
+    def test_parse_time_invalid(self):
+        self.assertRaises(ValueError, importer._parse_time, '02/01/2020')
+
+    def test_get_ids(self):
+        model_class = MagicMock()
+
+        result = importer._get_ids(model_class, ['user', 'pkg_id', None, 'user'])
+
+        # Objects are retrieved by name or by ID with a single query
+        self.assertEquals({'user_id': 'user_id', 'user': 'user_id', 'org_id': 'org_id', 'org': 'org_id',
+                           'pkg_id': 'pkg_id', 'pkg': 'pkg_id'}, result)
+        importer.model.Session.query.assert_called_once_with(model_class.id, model_class.name)
+        model_class.name.in_.assert_called_once_with(set(['user', 'pkg_id']))
+        model_class.id.in_.assert_called_once_with(set(['user', 'pkg_id']))
+
+    def test_get_ids_empty(self):
+        self.assertEquals({}, importer._get_ids(MagicMock(), [None, '']))
+        self.assertEquals(0, importer.model.Session.query.call_count)
+
+    def test_import_datarequests(self):
+        first = _datarequest(1, user={'name': 'user'}, organization={'name': 'org'}, organization_id='other',
+                             accepted_dataset={'name': 'pkg'}, closed=True, close_time=COMMENT_TIME.isoformat(),
+                             update_time=None, visibility='hidden', extras={'custom': 'value'}, field='extra')
+        second = _datarequest(2, comments=[_comment(1, 'dr_2'), _comment(2, 'dr_2', comment=u'http://example.com')])
+
+        self.importer.import_lines(_lines(first, second))
+
+        importer.db.init_db.assert_called_once_with(importer.model)
+        self.assertEquals({}, dict((error['id'], error) for error in self._errors()))
+
+        # Users, organizations and datasets are mapped by name and IDs and times are kept
+        datarequests = self._inserted_datarequests()
+        self.assertEquals(1, importer.db.DataRequest.insert_many.call_count)
+        self.assertEquals({
+            'id': 'dr_1',
+            'user_id': 'user_id',
+            'title': u'Title 1',
+            'description': u'Description',
+            'organization_id': 'org_id',
+            'open_time': OPEN_TIME,
+            'accepted_dataset_id': 'pkg_id',
+            'close_time': COMMENT_TIME,
+            'closed': True,
+            'visibility': constants.DataRequestState.hidden.value,
+            'comment_count': 0,
+            'update_time': COMMENT_TIME,
+            'extras': {'custom': 'value', 'field': 'extra'}
+        }, datarequests[0])
+
+        # The comments included in the data request are counted
+        self.assertEquals('dr_2', datarequests[1]['id'])
+        self.assertEquals(constants.DataRequestState.visible.value, datarequests[1]['visibility'])
+        self.assertEquals(2, datarequests[1]['comment_count'])
+        self.assertEquals(COMMENT_TIME, datarequests[1]['update_time'])
+
+        comments = self._inserted_comments()
+        self.assertEquals(1, importer.db.Comment.insert_many.call_count)
+        self.assertEquals(['comment_1', 'comment_2'], [comment['id'] for comment in comments])
+        self.assertEquals(['dr_2', 'dr_2'], [comment['datarequest_id'] for comment in comments])
+        self.assertEquals(['user_id', 'user_id'], [comment['user_id'] for comment in comments])
+        self.assertEquals([COMMENT_TIME, COMMENT_TIME], [comment['time'] for comment in comments])
+        self.assertEquals(importer.markup.render_comment(u'http://example.com'), comments[1]['comment_html'])
+
+        # Lookups are done once per batch
+        self.assertEquals(3, importer.model.Session.query.call_count)
+        importer.db.DataRequest.get_existing_ids.assert_called_once_with(['dr_1', 'dr_2', 'dr_2', 'dr_2'])
+        importer.db.Comment.get_existing_ids.assert_called_once_with(['comment_1', 'comment_2'])
+        self.assertEquals(1, importer.validator.validate_datarequests.call_count)
+        self.assertEquals(0, importer.db.DataRequest.update_comment_count.call_count)
+        importer.model.Session.commit.assert_called_once_with()
+
+        self.assertEquals((2, 2, 2, 0), (self.importer.lines, self.importer.datarequests,
+                                         self.importer.comments, self.importer.errors))
+
+        # Caches are invalidated
+        importer.cache.get_counters_cache.return_value.delete.assert_called_once_with(
+            importer.cache.OPEN_DATAREQUESTS_NUMBER)
+        importer.cache.get_pages_cache.return_value.invalidate.assert_called_once_with(importer.cache.ALL_PAGES)
+
+    def test_import_comments_existing_datarequest(self):
+        self.importer.import_lines(_lines(_comment(1, 'existing_dr'), _comment(2, 'existing_dr')))
+
+        self.assertEquals([], self._errors())
+        self.assertEquals(0, importer.db.DataRequest.insert_many.call_count)
+        self.assertEquals(['comment_1', 'comment_2'], [comment['id'] for comment in self._inserted_comments()])
+
+        # The number of comments of the data request is updated
+        self.assertEquals(1, importer.db.DataRequest.update_comment_count.call_count)
+        args = importer.db.DataRequest.update_comment_count.call_args[0]
+        self.assertEquals(('existing_dr', 2), args[:2])
+        self.assertTrue(isinstance(args[2], datetime.datetime))
+        importer.model.Session.commit.assert_called_once_with()
+        self.assertEquals((0, 2), (self.importer.datarequests, self.importer.comments))
+
+    @parameterized.expand([
+        ('not json\n',                                                       {'Line': ['No JSON object could be decoded']}),
+        ('[1, 2]\n',                                                         {'Line': ['A JSON object was expected']}),
+        (_lines(_datarequest(1, id=None))[0],                                {'ID': ['ID is required']}),
+        (_lines(_datarequest(1, id='existing_dr'))[0],                       {'ID': ['Data Request existing_dr already exists']}),
+        (_lines(_datarequest(1, user_id='unknown'))[0],                      {'User': ['User unknown not found']}),
+        (_lines(_datarequest(1, user={'name': 'unknown'}))[0],               {'User': ['User unknown not found']}),
+        (_lines(_datarequest(1, organization_id='unknown'))[0],              {'Organization': ['Organization unknown not found']}),
+        (_lines(_datarequest(1, accepted_dataset_id='unknown'))[0],          {'Accepted Dataset': ['Dataset unknown not found']}),
+        (_lines(_datarequest(1, visibility='public'))[0],                    {'Visibility': ['Visibility public is not valid']}),
+        (_lines(_datarequest(1, open_time=None))[0],                         {'Open Time': ['Open time is required']}),
+        (_lines(_datarequest(1, open_time='yesterday'))[0],                  {'Time': ['Time yesterday is not valid']}),
+        (_lines(_comment(1, 'existing_dr', id=None))[0],                     {'ID': ['ID is required']}),
+        (_lines(_comment(1, 'existing_dr', id='existing_comment'))[0],       {'ID': ['Comment existing_comment already exists']}),
+        (_lines(_comment(1, 'unknown'))[0],                                  {'Data Request': ['Data Request unknown not found']}),
+        (_lines(_comment(1, 'existing_dr', user_id='unknown'))[0],           {'User': ['User unknown not found']}),
+        (_lines(_comment(1, 'existing_dr', comment=u''))[0],                 {'Comment': ['Comments must be a minimum of 1 character long']}),
+        (_lines(_comment(1, 'existing_dr', comment=u'a' * (constants.COMMENT_MAX_LENGTH + 1)))[0],
+         {'Comment': ['Comments must be a maximum of %d characters long' % constants.COMMENT_MAX_LENGTH]}),
+        (_lines(_comment(1, 'existing_dr', time=None))[0],                   {'Time': ['Time is required']}),
+    ])
+    def test_import_invalid_record(self, line, expected_errors):
+        self.importer.import_lines(['\n', line])
+
+        # The record is skipped and its errors are logged with its line number
+        errors = self._errors()
+        self.assertEquals(1, len(errors))
+        self.assertEquals(2, errors[0]['line'])
+        self.assertEquals(expected_errors, errors[0]['errors'])
+        self.assertEquals([], self._inserted_datarequests())
+        self.assertEquals([], self._inserted_comments())
+        self.assertEquals((0, 0, 1), (self.importer.datarequests, self.importer.comments, self.importer.errors))
+        self.assertEquals(0, importer.cache.get_counters_cache.call_count)
+
+    @parameterized.expand([
+        (u'<script>alert(1)</script>',      u'&lt;script&gt;alert(1)&lt;/script&gt;'),
+        (u'&lt;b&gt;Exported&lt;/b&gt;',  u'&lt;b&gt;Exported&lt;/b&gt;'),
+        (u'Tom &amp; Jerry',                u'Tom &amp; Jerry'),
+        (u'Tom & Jerry',                    u'Tom &amp; Jerry'),
+        (u'&#60;img src=x&#62;',            u'&lt;img src=x&gt;'),
+        (u'&amp;lt;b&amp;gt;',              u'&amp;lt;b&amp;gt;')
+    ])
+    def test_import_comment_escaped(self, comment, expected_comment):
+        self.importer.import_lines(_lines(_comment(1, 'existing_dr', comment=comment)))
+
+        # Exported (escaped) comments are kept and any other HTML is escaped
+        comments = self._inserted_comments()
+        self.assertEquals(expected_comment, comments[0]['comment'])
+        self.assertEquals(importer.markup.render_comment(expected_comment), comments[0]['comment_html'])
+
+    def test_import_duplicate_ids(self):
+        self.importer.import_lines(_lines(_datarequest(1), _datarequest(1, title=u'Other'),
+                                          _comment(1, 'dr_1'), _comment(1, 'dr_1')))
+
+        self.assertEquals([{'line': 2, 'id': 'dr_1', 'errors': {'ID': ['Data Request dr_1 already exists']}},
+                           {'line': 4, 'id': 'comment_1', 'errors': {'ID': ['Comment comment_1 already exists']}}],
+                          self._errors())
+        self.assertEquals(['dr_1'], [row['id'] for row in self._inserted_datarequests()])
+        self.assertEquals(['comment_1'], [row['id'] for row in self._inserted_comments()])
+        self.assertEquals(1, self._inserted_datarequests()[0]['comment_count'])
+
+    def test_import_validator_errors(self):
+        title_errors = {'Title': ['That title is already in use']}
+        importer.validator.validate_datarequests.side_effect = lambda context, datarequests: [title_errors, {}]
+
+        self.importer.import_lines(_lines(_datarequest(1), _datarequest(2), _comment(1, 'dr_1')))
+
+        # The comments of the invalid data requests are not imported
+        self.assertEquals([{'line': 1, 'id': 'dr_1', 'errors': title_errors},
+                           {'line': 3, 'id': 'comment_1', 'errors': {'Data Request': ['Data Request dr_1 not found']}}],
+                          self._errors())
+        self.assertEquals(['dr_2'], [row['id'] for row in self._inserted_datarequests()])
+        self.assertEquals([], self._inserted_comments())
+        self.assertEquals(importer.model, importer.validator.validate_datarequests.call_args[0][0]['model'])
+
+    def test_import_real_validator(self):
+        # Rows are built as the validator expects them
+        importer.validator = self._validator
+        validator_db = importer.validator.db
+        importer.validator.db = MagicMock()
+        importer.validator.db.DataRequest.get_existing_titles.return_value = set()
+
+        try:
+            self.importer.import_lines(_lines(_datarequest(1), _datarequest(2, title=5)))
+        finally:
+            importer.validator.db = validator_db
+
+        # Data requests without organization are valid
+        self.assertEquals([{'line': 2, 'id': 'dr_2', 'errors': {'Title': ['Title must be a string']}}],
+                          self._errors())
+        self.assertEquals(['dr_1'], [row['id'] for row in self._inserted_datarequests()])
+        self.assertIsNone(self._inserted_datarequests()[0]['organization_id'])
+
+    def test_import_batches(self):
+        progress = MagicMock()
+        self.importer.batch_size = 2
+
+        self.importer.import_lines(_lines(*[_datarequest(i) for i in range(5)]), progress)
+
+        # Every batch is stored in its own transaction
+        self.assertEquals(3, importer.db.DataRequest.insert_many.call_count)
+        self.assertEquals(3, importer.model.Session.commit.call_count)
+        self.assertEquals(3, importer.validator.validate_datarequests.call_count)
+        self.assertEquals(3, progress.call_count)
+        progress.assert_called_with(self.importer)
+        self.assertEquals(['dr_%d' % i for i in range(5)], [row['id'] for row in self._inserted_datarequests()])
+        self.assertEquals((5, 5, 0), (self.importer.lines, self.importer.datarequests, self.importer.errors))
+
+    def test_import_integrity_error(self):
+        importer.db.Comment.insert_many.side_effect = IntegrityError('INSERT', {}, Exception('duplicate key'))
+
+        self.importer.import_lines(_lines(_datarequest(1, comments=[_comment(1, 'dr_1')])))
+
+        # The whole batch is discarded
+        importer.model.Session.rollback.assert_called_once_with()
+        self.assertEquals(0, importer.model.Session.commit.call_count)
+        self.assertEquals([{'line': 1, 'id': 'dr_1', 'errors': {'Data Base': ['duplicate key']}},
+                           {'line': 1, 'id': 'comment_1', 'errors': {'Data Base': ['duplicate key']}}],
+                          self._errors())
+        self.assertEquals((0, 0, 2), (self.importer.datarequests, self.importer.comments, self.importer.errors))
+
+    def test_import_empty(self):
+        self.importer.import_lines([])
+
+        self.assertEquals(0, importer.model.Session.commit.call_count)
+        self.assertEquals(0, importer.cache.get_counters_cache.call_count)
+        self.assertEquals(0, self.importer.lines)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.constants as constants
+import ckanext.datarequests.markup as markup
+import random
+import re
+import time
+import unittest
+
+from nose_parameterized import parameterized
+
+# Regular expression that was used to detect links, kept as the reference output
+_reference_link = re.compile(r'(?:(https?://)|(www\.))(\S+\b/?)([!"#$%&\'()*+,\-./:;<=>?@[\\\]^_`{|}~]*)(\s|$)', re.I)
+
+
+def reference_convert_links(text):
+    def replace(match):
+        groups = match.groups()
+        return u'<a href="{0}{1}{2}" target="_blank">{0}{1}{2}</a>{3}{4}'.format(
+            groups[0] or '', groups[1] or '', *groups[2:])
+    return _reference_link.sub(replace, text)
+
+
+class MarkupTest(unittest.TestCase):
+
+    @parameterized.expand([
+        ('Comment without links', 'Comment without links'),
+        ('Comment 3 with link https://fiware.org/some/path?param1=1&param2=2',
+         'Comment 3 with link <a href="https://fiware.org/some/path?param1=1&param2=2" target="_blank">'
+         'https://fiware.org/some/path?param1=1&param2=2</a>'),
+        ('Comment 4 with two links https://fiware.org/some/path?param1=1&param2=2 and https://google.es',
+         'Comment 4 with two links <a href="https://fiware.org/some/path?param1=1&param2=2" target="_blank">'
+         'https://fiware.org/some/path?param1=1&param2=2</a> and <a href="https://google.es" '
+         'target="_blank">https://google.es</a>'),
+        ('Links with www: www.fiware.org.',
+         'Links with www: <a href="www.fiware.org" target="_blank">www.fiware.org</a>.'),
+        ('Trailing punctuation (http://fiware.org/path/), is not included',
+         'Trailing punctuation (<a href="http://fiware.org/path/" target="_blank">http://fiware.org/path/</a>), '
+         'is not included')
+    ])
+    def test_convert_links(self, text, expected_html):
+        self.assertEquals(expected_html, markup.convert_links(text))
+        self.assertEquals(reference_convert_links(text), markup.convert_links(text))
+
+    @parameterized.expand([
+        (1,),
+        (7,),
+        (42,)
+    ])
+    def test_convert_links_same_as_reference(self, seed):
+        fragments = [u'http://', u'https://', u'HTTP://', u'www.', u'WWW.', u'a', u'b1', u'_', u'.', u',', u'/',
+                     u'-', u'(', u')', u'!', u'?', u'&', u' ', u'\n', u'\t', u'\xe9', u'\xa0']
+        rand = random.Random(seed)
+
+        for _ in range(2000):
+            text = u''.join(rand.choice(fragments) for _ in range(rand.randint(0, 30)))
+            self.assertEquals(reference_convert_links(text), markup.convert_links(text), repr(text))
+
+    @parameterized.expand([
+        (u'www.',),
+        (u'www.a',),
+        (u'http://',),
+        (u'https://a!!!',),
+        (u'a.',),
+        (u'-',)
+    ])
+    def test_convert_links_pathological_input(self, pattern):
+        text = (u'http://' + pattern * constants.COMMENT_MAX_LENGTH)[:constants.COMMENT_MAX_LENGTH - 1] + u'\xe9'
+
+        start = time.time()
+        result = markup.convert_links(text)
+        elapsed = time.time() - start
+
+        self.assertEquals(reference_convert_links(text), result)
+        # The reference implementation needs several milliseconds for some of these inputs
+        self.assertLess(elapsed, 0.05)
+
+    @parameterized.expand([
+        ('Comment 1\nwith new line', 'Comment 1<br/>with new line'),
+        ('Commnet 2\nwith two\nnew lines', 'Commnet 2<br/>with two<br/>new lines'),
+        ('Coment\nwith http://fiware.org\nhttp://fiware.eu',
+         'Coment<br/>with <a href="http://fiware.org" target="_blank">http://fiware.org</a><br/><a '
+         'href="http://fiware.eu" target="_blank">http://fiware.eu</a>')
+    ])
+    def test_render_comment(self, comment, expected_html):
+        self.assertEquals(expected_html, markup.render_comment(comment))
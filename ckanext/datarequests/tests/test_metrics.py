@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.metrics as metrics
+import json
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+def _execute_statements(number):
+    for _ in range(number):
+        metrics.count_statement(None, None, 'SELECT 1', {}, None, False)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._time = metrics.time
+        metrics.time = MagicMock()
+        self.now = 100.0
+        metrics.time.time.side_effect = lambda: self.now
+
+        self._log = metrics.log
+        metrics.log = MagicMock()
+
+        self._event = metrics.event
+        metrics.event = MagicMock()
+
+        self._log_calls = metrics.log_calls
+        metrics.get_metrics(reset=True)
+
+    def tearDown(self):
+        metrics.time = self._time
+        metrics.log = self._log
+        metrics.event = self._event
+        metrics.log_calls = self._log_calls
+        metrics.get_metrics(reset=True)
+
+    def _action(self, seconds, statements, result=None, error=None, nested=None):
+        def datarequest_action(context, data_dict):
+            '''Action docstring'''
+            _execute_statements(statements)
+            if nested:
+                nested()
+            self.now += seconds
+            if error:
+                raise error
+            return result
+        return metrics.instrumented(datarequest_action)
+
+    def test_instrumented(self):
+        action = self._action(0.5, 3, result={'id': 'dr_id'})
+
+        self.assertEquals({'id': 'dr_id'}, action({}, {}))
+        self.assertEquals({'id': 'dr_id'}, action({}, {}))
+
+        self.assertEquals('datarequest_action', action.__name__)
+        self.assertEquals('Action docstring', action.__doc__)
+        self.assertEquals({'datarequest_action': {
+            'calls': 2,
+            'errors': 0,
+            'total_seconds': 1.0,
+            'mean_seconds': 0.5,
+            'max_seconds': 0.5,
+            'sql_statements': 6,
+            'sql_statements_per_call': 3.0,
+            'nested_calls': {}
+        }}, metrics.get_metrics()['actions'])
+
+    def test_instrumented_error(self):
+        action = self._action(0.25, 1, error=ValueError('Invalid'))
+
+        with self.assertRaises(ValueError):
+            action({}, {})
+
+        result = metrics.get_metrics()['actions']['datarequest_action']
+        self.assertEquals((1, 1, 0.25, 1), (result['calls'], result['errors'], result['total_seconds'],
+                                            result['sql_statements']))
+
+        # Statements executed after the action are not counted
+        _execute_statements(2)
+        self.assertEquals(1, metrics.get_metrics()['actions']['datarequest_action']['sql_statements'])
+
+    def test_nested_actions(self):
+        def user_show(context, data_dict):
+            _execute_statements(2)
+            self.now += 0.1
+            return {'id': data_dict['id']}
+
+        nested_user_show = metrics.nested_action('user_show', user_show)
+
+        def nested():
+            self.assertEquals({'id': 'user'}, nested_user_show({}, {'id': 'user'}))
+            nested_user_show({}, {'id': 'user'})
+
+        action = self._action(0.5, 1, nested=nested)
+        action({}, {})
+
+        # The statements of the nested calls are not counted in the action
+        result = metrics.get_metrics()['actions']
+        self.assertEquals(['datarequest_action'], result.keys())
+        self.assertEquals(1, result['datarequest_action']['sql_statements'])
+        self.assertAlmostEquals(0.7, result['datarequest_action']['total_seconds'])
+        self.assertEquals(['user_show'], result['datarequest_action']['nested_calls'].keys())
+        nested_metrics = result['datarequest_action']['nested_calls']['user_show']
+        self.assertEquals((2, 4), (nested_metrics['calls'], nested_metrics['sql_statements']))
+        self.assertAlmostEquals(0.2, nested_metrics['total_seconds'])
+
+    def test_nested_instrumented_actions(self):
+        inner_action = self._action(0.25, 2)
+        outer_action = self._action(0.5, 1, nested=lambda: inner_action({}, {}))
+
+        outer_action({}, {})
+
+        # Both actions have their own metrics, and the inner call is nested in the outer one
+        result = metrics.get_metrics()['actions']['datarequest_action']
+        self.assertEquals(2, result['calls'])
+        self.assertEquals(3, result['sql_statements'])
+        self.assertEquals({'datarequest_action': {'calls': 1, 'total_seconds': 0.25, 'sql_statements': 2}},
+                          result['nested_calls'])
+
+    def test_measure(self):
+        nested_user_show = metrics.nested_action('user_show', lambda context, data_dict: _execute_statements(2))
+        action = self._action(0.5, 1, nested=lambda: nested_user_show({}, {}))
+
+        with metrics.measure() as call:
+            _execute_statements(1)
+            action({}, {})
+            action({}, {})
+
+        # Nested calls are counted at any depth, but the block is not recorded
+        self.assertEquals(1, call.sql_statements)
+        self.assertEquals(7, call.total_sql_statements())
+        self.assertEquals({'datarequest_action': 2, 'user_show': 2}, call.all_nested_calls)
+        self.assertEquals(['datarequest_action'], metrics.get_metrics()['actions'].keys())
+
+    def test_count_statement_without_action(self):
+        _execute_statements(3)
+        self.assertEquals({}, metrics.get_metrics()['actions'])
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    def test_reset(self, reset):
+        self._action(0.5, 1)({}, {})
+
+        result = metrics.get_metrics(reset)
+
+        self.assertEquals(['datarequest_action'], result['actions'].keys())
+        self.assertTrue(result['since'] <= result['until'])
+        after = metrics.get_metrics()
+        self.assertEquals(0 if reset else 1, len(after['actions']))
+        self.assertEquals(result['until'] if reset else result['since'], after['since'])
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    def test_log_calls(self, log_calls):
+        metrics.log_calls = log_calls
+        nested_user_show = metrics.nested_action('user_show', lambda context, data_dict: None)
+
+        self._action(0.5, 2, nested=lambda: nested_user_show({}, {}))({}, {})
+
+        self.assertEquals(1 if log_calls else 0, metrics.log.info.call_count)
+        if log_calls:
+            self.assertEquals({
+                'action': 'datarequest_action',
+                'seconds': 0.5,
+                'error': False,
+                'sql_statements': 2,
+                'nested_calls': {'user_show': {'calls': 1, 'seconds': 0.0, 'sql_statements': 0}}
+            }, json.loads(metrics.log.info.call_args[0][0]))
+
+    @parameterized.expand([
+        (False, True),
+        (True,  False)
+    ])
+    def test_setup(self, already_registered, log_calls):
+        metrics.event.contains.return_value = already_registered
+
+        metrics.setup(log_calls)
+
+        self.assertEquals(log_calls, metrics.log_calls)
+        metrics.event.contains.assert_called_once_with(metrics.Engine, 'before_cursor_execute',
+                                                       metrics.count_statement)
+        if already_registered:
+            self.assertEquals(0, metrics.event.listen.call_count)
+        else:
+            metrics.event.listen.assert_called_once_with(metrics.Engine, 'before_cursor_execute',
+                                                         metrics.count_statement)
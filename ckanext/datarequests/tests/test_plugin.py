@@ -24,9 +24,12 @@ import unittest
 from mock import MagicMock
 from nose_parameterized import parameterized
 
-TOTAL_ACTIONS = 11
+TOTAL_ACTIONS = 16
 COMMENTS_ACTIONS = 5
 ACTIONS_NO_COMMENTS = TOTAL_ACTIONS - COMMENTS_ACTIONS
+# datarequest_export is only checked by the export page and command
+TOTAL_AUTH_FUNCTIONS = TOTAL_ACTIONS + 1
+AUTH_FUNCTIONS_NO_COMMENTS = TOTAL_AUTH_FUNCTIONS - COMMENTS_ACTIONS
 
 
 class DataRequestPluginTest(unittest.TestCase):
@@ -50,12 +53,27 @@ class DataRequestPluginTest(unittest.TestCase):
         self._partial = plugin.partial
         plugin.partial = MagicMock()
 
+        self._event = plugin.event
+        plugin.event = MagicMock()
+
+        self._db = plugin.db
+        plugin.db = MagicMock()
+
+        self._metrics = plugin.metrics
+        plugin.metrics = MagicMock()
+
         # plg = plugin
         self.datarequest_create = constants.DATAREQUEST_CREATE
+        self.datarequest_create_many = constants.DATAREQUEST_CREATE_MANY
         self.datarequest_show = constants.DATAREQUEST_SHOW
         self.datarequest_update = constants.DATAREQUEST_UPDATE
         self.datarequest_index = constants.DATAREQUEST_INDEX
         self.datarequest_delete = constants.DATAREQUEST_DELETE
+        self.datarequest_bulk_update = constants.DATAREQUEST_BULK_UPDATE
+        self.datarequest_export = constants.DATAREQUEST_EXPORT
+        self.datarequest_dataset_autocomplete = constants.DATAREQUEST_DATASET_AUTOCOMPLETE
+        self.datarequest_last_modified = constants.DATAREQUEST_LAST_MODIFIED
+        self.datarequest_metrics = constants.DATAREQUEST_METRICS
         self.datarequest_comment = constants.DATAREQUEST_COMMENT
         self.datarequest_comment_list = constants.DATAREQUEST_COMMENT_LIST
         self.datarequest_comment_show = constants.DATAREQUEST_COMMENT_SHOW
@@ -68,6 +86,36 @@ class DataRequestPluginTest(unittest.TestCase):
         plugin.tk = self._tk
         plugin.helpers = self._helpers
         plugin.partial = self._partial
+        plugin.event = self._event
+        plugin.db = self._db
+        plugin.metrics = self._metrics
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    def test_users_cache_invalidation(self, already_registered):
+        plugin.event.contains.return_value = already_registered
+        plugin.DataRequestsPlugin()
+
+        plugin.event.contains.assert_called_once_with(plugin.model.User, 'after_update',
+                                                      plugin.actions.invalidate_user)
+        if already_registered:
+            self.assertEquals(0, plugin.event.listen.call_count)
+        else:
+            plugin.event.listen.assert_called_once_with(plugin.model.User, 'after_update',
+                                                        plugin.actions.invalidate_user)
+
+    @parameterized.expand([
+        ('True',  True),
+        ('False', False)
+    ])
+    def test_metrics_setup(self, log_calls, expected_log_calls):
+        plugin.config.get.return_value = log_calls
+        plugin.DataRequestsPlugin()
+
+        plugin.metrics.setup.assert_called_once_with(expected_log_calls)
+        plugin.config.get.assert_any_call('ckan.datarequests.metrics.log', False)
 
     @parameterized.expand([
         ('True',),
@@ -86,10 +134,16 @@ class DataRequestPluginTest(unittest.TestCase):
 
         self.assertEquals(actions_len, len(actions))
         self.assertEquals(plugin.actions.datarequest_create, actions[self.datarequest_create])
+        self.assertEquals(plugin.actions.datarequest_create_many, actions[self.datarequest_create_many])
         self.assertEquals(plugin.actions.datarequest_show, actions[self.datarequest_show])
         self.assertEquals(plugin.actions.datarequest_update, actions[self.datarequest_update])
         self.assertEquals(plugin.actions.datarequest_index, actions[self.datarequest_index])
         self.assertEquals(plugin.actions.datarequest_delete, actions[self.datarequest_delete])
+        self.assertEquals(plugin.actions.datarequest_bulk_update, actions[self.datarequest_bulk_update])
+        self.assertEquals(plugin.actions.datarequest_dataset_autocomplete,
+                          actions[self.datarequest_dataset_autocomplete])
+        self.assertEquals(plugin.actions.datarequest_last_modified, actions[self.datarequest_last_modified])
+        self.assertEquals(plugin.actions.datarequest_metrics, actions[self.datarequest_metrics])
 
         if comments_enabled == 'True':
             self.assertEquals(plugin.actions.datarequest_comment, actions[self.datarequest_comment])
@@ -104,7 +158,7 @@ class DataRequestPluginTest(unittest.TestCase):
     ])
     def test_get_auth_functions(self, comments_enabled):
 
-        auth_functions_len = TOTAL_ACTIONS if comments_enabled == 'True' else ACTIONS_NO_COMMENTS
+        auth_functions_len = TOTAL_AUTH_FUNCTIONS if comments_enabled == 'True' else AUTH_FUNCTIONS_NO_COMMENTS
 
         # Configure config and create instance
         plugin.config.get.return_value = comments_enabled
@@ -115,10 +169,17 @@ class DataRequestPluginTest(unittest.TestCase):
 
         self.assertEquals(auth_functions_len, len(auth_functions))
         self.assertEquals(plugin.auth.datarequest_create, auth_functions[self.datarequest_create])
+        self.assertEquals(plugin.auth.datarequest_create_many, auth_functions[self.datarequest_create_many])
         self.assertEquals(plugin.auth.datarequest_show, auth_functions[self.datarequest_show])
         self.assertEquals(plugin.auth.datarequest_update, auth_functions[self.datarequest_update])
         self.assertEquals(plugin.auth.datarequest_index, auth_functions[self.datarequest_index])
         self.assertEquals(plugin.auth.datarequest_delete, auth_functions[self.datarequest_delete])
+        self.assertEquals(plugin.auth.datarequest_bulk_update, auth_functions[self.datarequest_bulk_update])
+        self.assertEquals(plugin.auth.datarequest_export, auth_functions[self.datarequest_export])
+        self.assertEquals(plugin.auth.datarequest_dataset_autocomplete,
+                          auth_functions[self.datarequest_dataset_autocomplete])
+        self.assertEquals(plugin.auth.datarequest_last_modified, auth_functions[self.datarequest_last_modified])
+        self.assertEquals(plugin.auth.datarequest_metrics, auth_functions[self.datarequest_metrics])
 
         if comments_enabled == 'True':
             self.assertEquals(plugin.auth.datarequest_comment, auth_functions[self.datarequest_comment])
@@ -127,6 +188,21 @@ class DataRequestPluginTest(unittest.TestCase):
             self.assertEquals(plugin.auth.datarequest_comment_update, auth_functions[self.datarequest_comment_update])
             self.assertEquals(plugin.auth.datarequest_comment_delete, auth_functions[self.datarequest_comment_delete])
 
+    @parameterized.expand([
+        ('True',  1),
+        ('False', 0)
+    ])
+    def test_configure(self, setup_db_on_startup, expected_calls):
+        plugin.config.get.return_value = setup_db_on_startup
+        self.plg_instance = plugin.DataRequestsPlugin()
+
+        self.plg_instance.configure(plugin.config)
+
+        plugin.config.get.assert_any_call('ckan.datarequests.setup_db_on_startup', True)
+        self.assertEquals(expected_calls, plugin.db.setup_db.call_count)
+        if expected_calls:
+            plugin.db.setup_db.assert_called_once_with(plugin.model)
+
     def test_update_config(self):
         # Create instance
         self.plg_instance = plugin.DataRequestsPlugin()
@@ -142,7 +218,7 @@ class DataRequestPluginTest(unittest.TestCase):
     ])
     def test_before_map(self, comments_enabled):
 
-        urls_set = 10
+        urls_set = 12
         mapa_calls = urls_set if comments_enabled == 'True' else urls_set - 2
 
         # Configure config and get instance
@@ -163,6 +239,14 @@ class DataRequestPluginTest(unittest.TestCase):
             controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
             action='new', conditions=dict(method=['GET', 'POST']))
 
+        mapa.connect.assert_any_call('/%s/dataset_autocomplete' % dr_basic_path,
+            controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
+            action='dataset_autocomplete', conditions=dict(method=['GET']))
+
+        mapa.connect.assert_any_call('/%s/export' % dr_basic_path,
+            controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
+            action='export', conditions=dict(method=['GET']))
+
         mapa.connect.assert_any_call('datarequest_show', '/%s/{id}' % dr_basic_path,
             controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
             action='show', conditions=dict(method=['GET']), ckan_icon='question-sign')
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import ckanext.datarequests.actions as actions
+import ckanext.datarequests.cache as cache
+import ckanext.datarequests.constants as constants
+import ckanext.datarequests.db as db
+import ckanext.datarequests.helpers as helpers
+import datetime
+import sqlalchemy as sa
+import unittest
+import uuid
+
+from ckan.lib.dictization import model_dictize
+from nose_parameterized import parameterized
+from query_budget import query_budget
+
+# Statements executed by datarequest_index for any page: the data requests of the
+# page, the total number, the users (and their numbers of edits and datasets), the
+# organizations, the accepted datasets, the three facets and the facet organizations
+INDEX_STATEMENTS = 11
+
+# The organization is looked up by ID and then by name (when a name is given)
+ORGANIZATION_FILTER_STATEMENTS = 2
+
+# user_show: the user and their numbers of edits and datasets
+USER_SHOW_STATEMENTS = 3
+
+# The data request, its user (and their numbers of edits and datasets), its
+# organization and its accepted dataset
+SHOW_STATEMENTS = 6
+
+# The comments and their users (and their numbers of edits and datasets)
+COMMENT_LIST_STATEMENTS = 4
+
+FIRST_OPEN_TIME = datetime.datetime(2015, 1, 1)
+
+
+def _uuid():
+    return unicode(uuid.uuid4())
+
+
+class QueryBudgetsTest(unittest.TestCase):
+    '''
+    The actions and the helpers are run on an in-memory SQLite data base. The
+    number of SQL statements they execute must not depend on the number of
+    data requests, comments or users shown: they must be retrieved in bulk.
+    '''
+
+    def setUp(self):
+        self._engine = model.meta.engine
+        self._reset_db()
+
+        engine = sa.create_engine('sqlite://')
+        model.init_model(engine)
+        model.meta.metadata.create_all(engine)
+        db.setup_db(model)
+
+        self.users = []
+        self.organizations = []
+        self.datasets = []
+        self.datarequests = []
+
+        actions.USERS_CACHE.clear()
+        cache.get_counters_cache().delete(cache.OPEN_DATAREQUESTS_NUMBER)
+
+    def tearDown(self):
+        model.Session.remove()
+        model.meta.metadata.remove(db.datarequests_table)
+        model.meta.metadata.remove(db.comments_table)
+        self._reset_db()
+
+        model.Session.configure(bind=self._engine)
+        model.meta.create_local_session.configure(bind=self._engine)
+        model.meta.engine = self._engine
+        model.meta.metadata.bind = self._engine
+
+        actions.USERS_CACHE.clear()
+        cache.get_counters_cache().delete(cache.OPEN_DATAREQUESTS_NUMBER)
+
+    def _reset_db(self):
+        db.DataRequest = None
+        db.Comment = None
+        db.datarequests_table = None
+        db.comments_table = None
+        db._schema_ready = False
+        db._unique_title_index = None
+
+    def _context(self):
+        return {'model': model, 'session': model.Session, 'ignore_auth': True}
+
+    def _create_base(self, users=60, organizations=10, datasets=20):
+        now = datetime.datetime.now()
+        rows = {
+            model.user_table: [{'id': _uuid(), 'name': u'user-%d' % i, 'password': u'', 'created': now,
+                                'state': u'active', 'sysadmin': False} for i in range(users)],
+            model.group_table: [{'id': _uuid(), 'name': u'organization-%d' % i, 'title': u'Organization %d' % i,
+                                 'type': u'organization', 'is_organization': True, 'state': u'active',
+                                 'approval_status': u'approved', 'created': now} for i in range(organizations)],
+            model.package_table: [{'id': _uuid(), 'name': u'dataset-%d' % i, 'title': u'Dataset %d' % i,
+                                   'type': u'dataset', 'private': False, 'state': u'active',
+                                   'metadata_created': now, 'metadata_modified': now} for i in range(datasets)]
+        }
+
+        for table, table_rows in rows.items():
+            model.Session.execute(table.insert(), table_rows)
+        model.Session.commit()
+
+        self.users = [row['id'] for row in rows[model.user_table]]
+        self.organizations = [row['name'] for row in rows[model.group_table]]
+        self._organizations_ids = [row['id'] for row in rows[model.group_table]]
+        self.datasets = [row['id'] for row in rows[model.package_table]]
+
+    def _add_datarequests(self, number, comments=0):
+        '''
+        Every data request has a different user (while there are users left), an
+        organization and an accepted dataset, so every page needs all the queries
+        '''
+        datarequests = []
+        comments_rows = []
+
+        for i in range(len(self.datarequests), len(self.datarequests) + number):
+            open_time = FIRST_OPEN_TIME + datetime.timedelta(minutes=i)
+            datarequest = {
+                'id': _uuid(),
+                'user_id': self.users[i % len(self.users)],
+                'title': u'Data request %d' % i,
+                'description': u'Budget data of the year %d' % (2000 + i),
+                'organization_id': self._organizations_ids[i % len(self._organizations_ids)],
+                'open_time': open_time,
+                'accepted_dataset_id': self.datasets[i % len(self.datasets)],
+                'close_time': open_time,
+                'closed': True,
+                'visibility': constants.DataRequestState.visible.value,
+                'comment_count': comments,
+                'update_time': open_time,
+                'extras': {}
+            }
+            datarequests.append(datarequest)
+            comments_rows.extend({
+                'id': _uuid(),
+                'datarequest_id': datarequest['id'],
+                'user_id': self.users[j % len(self.users)],
+                'time': open_time + datetime.timedelta(seconds=j),
+                'comment': u'Comment %d' % j,
+                'comment_html': u'<p>Comment %d</p>' % j
+            } for j in range(comments))
+
+        db.DataRequest.insert_many(datarequests)
+        if comments_rows:
+            db.Comment.insert_many(comments_rows)
+        model.Session.commit()
+
+        self.datarequests.extend(datarequest['id'] for datarequest in datarequests)
+
+    def _measure(self, call, sql_statements, action_calls=None):
+        '''
+        Runs the call as the API does (with a new session and without cached
+        users) and returns the number of SQL statements it executed
+        '''
+        model.Session.remove()
+        actions.USERS_CACHE.clear()
+
+        with query_budget(sql_statements, action_calls) as measured:
+            call()
+
+        return measured.total_sql_statements()
+
+    @parameterized.expand([
+        (20,  1,  0),
+        (20,  10, 0),
+        (20,  50, 0),
+        (200, 10, 0),
+        (200, 50, 0),
+        (200, 50, 100)
+    ])
+    def test_index(self, datarequests, limit, offset):
+        self._create_base()
+        self._add_datarequests(datarequests)
+
+        statements = self._measure(
+            lambda: actions.datarequest_index(self._context(), {'limit': limit, 'offset': offset}),
+            INDEX_STATEMENTS, {'user_show': 0})
+
+        self.assertEquals(INDEX_STATEMENTS, statements)
+
+    def test_index_next_page(self):
+        self._create_base()
+        self._add_datarequests(50)
+        first_page = actions.datarequest_index(self._context(), {'limit': 10})
+
+        statements = self._measure(
+            lambda: actions.datarequest_index(self._context(), {'limit': 10, 'after': first_page['next_cursor']}),
+            INDEX_STATEMENTS, {'user_show': 0})
+
+        self.assertEquals(INDEX_STATEMENTS, statements)
+
+    @parameterized.expand([
+        ({'q': u'budget'},                                   INDEX_STATEMENTS),
+        ({'closed': True},                                   INDEX_STATEMENTS),
+        ({'visibility': constants.DataRequestState.visible.name}, INDEX_STATEMENTS),
+        ({'sort': constants.DATAREQUESTS_SORT_NEWEST},       INDEX_STATEMENTS),
+        ({'sort': constants.DATAREQUESTS_SORT_MOST_DISCUSSED}, INDEX_STATEMENTS),
+        ({'organization_id': 0},                             INDEX_STATEMENTS + ORGANIZATION_FILTER_STATEMENTS),
+        ({'user_id': 0},                                     INDEX_STATEMENTS + USER_SHOW_STATEMENTS, 1),
+        ({'user_id': 0, 'organization_id': 0, 'closed': True, 'q': u'budget'},
+         INDEX_STATEMENTS + ORGANIZATION_FILTER_STATEMENTS + USER_SHOW_STATEMENTS, 1)
+    ])
+    def test_index_filters(self, data_dict, budget, user_show_calls=0):
+        self._create_base(organizations=50)
+        self._add_datarequests(200)
+
+        # Users and organizations are given by their position in the lists
+        data_dict = dict(data_dict)
+        if 'user_id' in data_dict:
+            data_dict['user_id'] = self.users[data_dict['user_id']]
+        if 'organization_id' in data_dict:
+            data_dict['organization_id'] = self.organizations[data_dict['organization_id']]
+
+        self._measure(lambda: actions.datarequest_index(self._context(), data_dict), budget,
+                      {'user_show': user_show_calls})
+
+    @parameterized.expand([
+        (u'!!!',),
+        (u'"',)
+    ])
+    def test_index_search_without_words(self, q):
+        self._create_base()
+        self._add_datarequests(10)
+
+        # Texts without words are not valid FTS5 queries: they match nothing
+        result = actions.datarequest_index(self._context(), {'q': q})
+
+        self.assertEquals((0, []), (result['count'], result['result']))
+
+    def test_show(self):
+        self._create_base()
+        self._add_datarequests(10, comments=5)
+
+        statements = self._measure(lambda: actions.datarequest_show(self._context(), {'id': self.datarequests[0]}),
+                                   SHOW_STATEMENTS, {'user_show': 0})
+
+        self.assertEquals(SHOW_STATEMENTS, statements)
+
+    @parameterized.expand([
+        (1,),
+        (10,),
+        (60,)
+    ])
+    def test_comment_list(self, comments):
+        # Every comment is written by a different user
+        self._create_base()
+        self._add_datarequests(1, comments=comments)
+
+        statements = self._measure(
+            lambda: actions.datarequest_comment_list(self._context(), {'datarequest_id': self.datarequests[0]}),
+            COMMENT_LIST_STATEMENTS, {'user_show': 0})
+
+        self.assertEquals(COMMENT_LIST_STATEMENTS, statements)
+
+    def test_get_comments_number(self):
+        self._create_base()
+        self._add_datarequests(1, comments=10)
+
+        self._measure(lambda: self.assertEquals(10, helpers.get_comments_number(self.datarequests[0])), 1)
+
+    def test_get_open_datarequests_number(self):
+        self._create_base()
+        self._add_datarequests(10)
+
+        self.assertEquals(1, self._measure(helpers.get_open_datarequests_number, 1))
+        # The number is cached
+        self.assertEquals(0, self._measure(helpers.get_open_datarequests_number, 0))
+
+    def test_budget_exceeded(self):
+        self._create_base()
+        self._add_datarequests(10)
+
+        with self.assertRaises(AssertionError):
+            self._measure(lambda: actions.datarequest_index(self._context(), {}), INDEX_STATEMENTS - 1)
+
+        with self.assertRaises(AssertionError):
+            self._measure(lambda: actions.datarequest_index(self._context(), {'user_id': self.users[0]}),
+                          INDEX_STATEMENTS + USER_SHOW_STATEMENTS, {'user_show': 0})
+
+    def test_users_not_changed(self):
+        self._create_base()
+        self._add_datarequests(10)
+        now = datetime.datetime.now()
+        model.Session.execute(model.package_table.insert(), [
+            {'id': _uuid(), 'name': u'user-dataset-%d' % i, 'type': u'dataset', 'private': private,
+             'state': u'active', 'creator_user_id': self.users[0], 'metadata_created': now,
+             'metadata_modified': now} for i, private in enumerate((False, True))])
+        model.Session.commit()
+
+        user_obj = model.User.get(self.users[0])
+        user_obj.fullname = u'User 0'
+        user_obj.email = u'User0@example.com'
+        model.Session.commit()
+        result = actions.datarequest_index(self._context(), {'user_id': self.users[0]})
+
+        # The activity numbers are counted in bulk without changing the users of the session
+        self.assertEquals(1, result['result'][0]['user']['number_created_packages'])
+        self.assertNotIn('number_of_edits', vars(user_obj))
+        self.assertNotIn('number_created_packages', vars(user_obj))
+        self.assertEquals(2, user_obj.number_created_packages(include_private_and_draft=True))
+
+        # The users are the same than the ones returned by user_show to other users
+        expected_user = model_dictize.user_dictize(user_obj, {'model': model, 'session': model.Session})
+        self.assertEquals(expected_user, result['result'][0]['user'])
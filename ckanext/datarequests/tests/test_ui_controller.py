@@ -17,8 +17,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
+import ckanext.datarequests.cache as cache
 import ckanext.datarequests.constants as constants
 import ckanext.datarequests.controllers.ui_controller as controller
+import json
 import unittest
 
 from mock import MagicMock
@@ -58,6 +60,23 @@ class UIControllerTest(unittest.TestCase):
         self._helpers = controller.helpers
         controller.helpers = MagicMock()
 
+        self._authz = controller.authz
+        controller.authz = MagicMock()
+        controller.authz.is_sysadmin.return_value = False
+
+        self._config = controller.config
+        controller.config = {}
+
+        self._cache = controller.cache
+        controller.cache = MagicMock()
+        controller.cache.get_pages_cache.return_value = None
+        controller.cache.ALL_PAGES = cache.ALL_PAGES
+        controller.cache.LIST_PAGES = cache.LIST_PAGES
+
+        self._export = controller.export
+        controller.export = MagicMock()
+        controller.export.CONTENT_TYPES = self._export.CONTENT_TYPES
+
         self._datarequests_per_page = controller.constants.DATAREQUESTS_PER_PAGE
 
         self.expected_context = {
@@ -67,6 +86,9 @@ class UIControllerTest(unittest.TestCase):
             'auth_user_obj': controller.c.userobj
         }
 
+        # The index includes the ignore_auth configuration value
+        self.expected_index_context = dict(self.expected_context, ignore_auth=False)
+
         self.controller_instance = controller.DataRequestsUI()
 
     def tearDown(self):
@@ -77,6 +99,10 @@ class UIControllerTest(unittest.TestCase):
         controller.model = self._model
         controller.request = self._request
         controller.helpers = self._helpers
+        controller.authz = self._authz
+        controller.config = self._config
+        controller.cache = self._cache
+        controller.export = self._export
         controller.constants.DATAREQUESTS_PER_PAGE = self._datarequests_per_page
 
 
@@ -440,8 +466,9 @@ class UIControllerTest(unittest.TestCase):
         result = self.controller_instance.index()
 
         # Assertions
-        expected_data_req = {'organization_id': organization_name, 'limit': 10, 'offset': 0}
-        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_INDEX, self.expected_context, expected_data_req)
+        expected_data_req = {'organization_id': organization_name, 'limit': 10, 'offset': 0,
+                             'visibility': constants.DataRequestState.visible.name}
+        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_INDEX, self.expected_index_context, expected_data_req)
         controller.tk.abort.assert_called_once_with(403, 'Unauthorized to list Data Requests')
         self.assertEquals(0, controller.tk.get_action.call_count)
         self.assertEquals(0, controller.tk.render.call_count)
@@ -488,7 +515,8 @@ class UIControllerTest(unittest.TestCase):
         # Expected data_dict
         expected_data_dict = {
             'offset': expected_offset,
-            'limit': expected_limit
+            'limit': expected_limit,
+            'visibility': constants.DataRequestState.visible.name
         }
 
         # Set datarequests_per_page
@@ -535,7 +563,7 @@ class UIControllerTest(unittest.TestCase):
         result = function(**params)
 
         # Assertions
-        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_INDEX, self.expected_context, expected_data_dict)
+        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_INDEX, self.expected_index_context, expected_data_dict)
 
         # Specific assertions depending on the function called
         if func == INDEX_FUNCTION:
@@ -558,7 +586,7 @@ class UIControllerTest(unittest.TestCase):
             expected_render_page = 'user/datarequests.html'
 
         # Check the values put in c
-        datarequest_index.assert_called_once_with(self.expected_context, expected_data_dict)
+        datarequest_index.assert_called_once_with(self.expected_index_context, expected_data_dict)
         expected_response = datarequest_index.return_value
         self.assertEquals(expected_response['count'], controller.c.datarequest_count)
         self.assertEquals(expected_response['result'], controller.c.datarequests)
@@ -601,6 +629,116 @@ class UIControllerTest(unittest.TestCase):
         controller.tk.render.assert_called_once_with(expected_render_page)
 
 
+    @parameterized.expand([
+        ('1', None),
+        ('3', '20170304101112000013_example_id'),
+    ])
+    def test_index_cursor(self, page, after):
+        base_url = 'http://someurl.com/somepath/otherpath'
+        next_cursor = '20170304101112000013_next_id'
+
+        controller.request.GET = controller.request.params = {'page': page}
+        if after:
+            controller.request.GET['after'] = after
+
+        datarequest_index = MagicMock(return_value={'count': 50, 'result': [], 'facets': {},
+                                                    'next_cursor': next_cursor})
+        controller.tk.get_action.return_value = datarequest_index
+        controller.helpers.url_for.return_value = base_url
+
+        # Call the function
+        self.controller_instance.index()
+
+        # The cursor is sent to the API when it is received
+        expected_data_dict = {
+            'offset': (int(page) - 1) * constants.DATAREQUESTS_PER_PAGE,
+            'limit': constants.DATAREQUESTS_PER_PAGE,
+            'visibility': constants.DataRequestState.visible.name
+        }
+        if after:
+            expected_data_dict['after'] = after
+
+        datarequest_index.assert_called_once_with(self.expected_index_context, expected_data_dict)
+
+        # Only the link to the next page includes the cursor
+        pager_url = controller.helpers.Page.call_args[1]['url']
+        next_page = int(page) + 1
+        self.assertEquals('%s?page=%d&after=%s' % (base_url, next_page, next_cursor), pager_url(page=next_page))
+        self.assertEquals('%s?page=%d' % (base_url, next_page + 1), pager_url(page=next_page + 1))
+
+    def test_index_invalid_cursor(self):
+        controller.request.GET = controller.request.params = {'after': 'invalid'}
+        controller.tk.get_action.return_value.side_effect = controller.tk.ValidationError({'Cursor': ['error']})
+
+        # Call the function
+        result = self.controller_instance.index()
+
+        # Assertions
+        controller.tk.abort.assert_called_once_with(400, '"after" parameter is not valid')
+        self.assertEquals(0, controller.tk.render.call_count)
+        self.assertIsNone(result)
+
+    def test_index_sort(self):
+        base_url = 'http://someurl.com/somepath/otherpath'
+        controller.request.GET = controller.request.params = {'page': '2', 'sort': 'most_discussed'}
+
+        datarequest_index = MagicMock(return_value={'count': 50, 'result': [], 'facets': {},
+                                                    'next_cursor': None})
+        controller.tk.get_action.return_value = datarequest_index
+        controller.helpers.url_for.return_value = base_url
+
+        # Call the function
+        self.controller_instance.index()
+
+        # The order is sent to the API and kept by the pager
+        expected_data_dict = {
+            'offset': constants.DATAREQUESTS_PER_PAGE,
+            'limit': constants.DATAREQUESTS_PER_PAGE,
+            'visibility': constants.DataRequestState.visible.name,
+            'sort': 'most_discussed'
+        }
+        datarequest_index.assert_called_once_with(self.expected_index_context, expected_data_dict)
+
+        pager_url = controller.helpers.Page.call_args[1]['url']
+        self.assertEquals('%s?page=3&sort=most_discussed' % base_url, pager_url(page=3))
+
+    def test_index_search(self):
+        base_url = 'http://someurl.com/somepath/otherpath'
+        controller.request.GET = controller.request.params = {'page': '2', 'q': 'bus'}
+
+        datarequest_index = MagicMock(return_value={'count': 50, 'result': [], 'facets': {},
+                                                    'next_cursor': None})
+        controller.tk.get_action.return_value = datarequest_index
+        controller.helpers.url_for.return_value = base_url
+
+        # Call the function
+        self.controller_instance.index()
+
+        # The search is sent to the API and kept by the pager
+        expected_data_dict = {
+            'offset': constants.DATAREQUESTS_PER_PAGE,
+            'limit': constants.DATAREQUESTS_PER_PAGE,
+            'visibility': constants.DataRequestState.visible.name,
+            'q': 'bus'
+        }
+        datarequest_index.assert_called_once_with(self.expected_index_context, expected_data_dict)
+
+        pager_url = controller.helpers.Page.call_args[1]['url']
+        self.assertEquals('%s?page=3&q=bus' % base_url, pager_url(page=3))
+
+    def test_index_invalid_sort(self):
+        controller.request.GET = controller.request.params = {'sort': 'invalid'}
+        controller.tk.get_action.return_value.side_effect = controller.tk.ValidationError({'Sort': ['error']})
+
+        # Call the function
+        result = self.controller_instance.index()
+
+        # Assertions
+        controller.tk.abort.assert_called_once_with(400, '"sort" parameter is not valid')
+        self.assertEquals(0, controller.tk.render.call_count)
+        self.assertIsNone(result)
+
+
     ######################################################################
     ############################### DELETE ###############################
     ######################################################################
@@ -666,17 +804,9 @@ class UIControllerTest(unittest.TestCase):
             datarequest['organization_id'] = organization
 
         datarequest_show = MagicMock(return_value=datarequest)
-        packages_org = [{'name': 'packo1', 'title': 'packo1'}, {'name': 'packo2', 'title': 'packo2'}]
-        organization_show = MagicMock(return_value={'packages': packages_org})
-        packages_no_org = [{'name': 'pack1', 'title': 'pack1'}, {'name': 'pack2', 'title': 'pack2'}]
-        package_search = MagicMock(return_value={'results': packages_no_org})
 
         def _get_action(action):
-            if action == 'organization_show':
-                return organization_show
-            elif action == 'package_search':
-                return package_search
-            elif action == constants.DATAREQUEST_SHOW:
+            if action == constants.DATAREQUEST_SHOW:
                 return datarequest_show
             elif action == constants.DATAREQUEST_CLOSE:
                 return datarequest_close
@@ -690,10 +820,8 @@ class UIControllerTest(unittest.TestCase):
         controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_CLOSE, self.expected_context, {'id': datarequest_id})
         datarequest_show.assert_called_once_with(self.expected_context, {'id': datarequest_id})
 
-        if organization:
-            organization_show.assert_called_once_with({'ignore_auth': True}, {'id': organization, 'include_datasets': True})
-        else:
-            package_search.assert_called_once_with({'ignore_auth': True}, {'rows': 500})
+        # Datasets are not loaded (they are looked up by the form while the user types)
+        self.assertEquals(2 if post_content else 1, controller.tk.get_action.call_count)
 
         # Assertions
         controller.tk.render.assert_called_once_with('datarequests/close.html')
@@ -704,9 +832,7 @@ class UIControllerTest(unittest.TestCase):
         self.assertEquals(errors, controller.c.errors)
         self.assertEquals(errors_summary, controller.c.errors_summary)
         self.assertEquals(datarequest, controller.c.datarequest)
-
-        expected_datasets = packages_org if organization else packages_no_org
-        self.assertEquals(expected_datasets, controller.c.datasets)
+        self.assertEquals(post_content.get('accepted_dataset_id', ''), controller.c.accepted_dataset_id)
 
     def test_close_post_no_error(self):
         controller.request.POST = {'accepted_dataset': 'example_ds'}
@@ -738,7 +864,7 @@ class UIControllerTest(unittest.TestCase):
         ('organization_uuidv4', )
     ])
     def test_close_post_errors(self, organization):
-        post_content = {'accepted_dataset': 'example_ds'}
+        post_content = {'accepted_dataset_id': 'example_ds'}
         exception = controller.tk.ValidationError({'Accepted Dataset': ['error1', 'error2']})
         datarequest_close = MagicMock(side_effect=exception)
 
@@ -747,6 +873,80 @@ class UIControllerTest(unittest.TestCase):
                         {'Accepted Dataset': 'error1, error2'}, datarequest_close)
 
 
+    @parameterized.expand([
+        ({'incomplete': 'exam'},                                    {'q': 'exam', 'organization_id': None, 'limit': 10}),
+        ({'incomplete': 'exam', 'organization_id': 'org', 'limit': '5'}, {'q': 'exam', 'organization_id': 'org', 'limit': '5'}),
+    ])
+    def test_dataset_autocomplete(self, params, expected_data_dict):
+        controller.request.GET = params
+        controller.tk.response.headers = {}
+        datasets = [{'name': 'example', 'title': 'Example'}]
+        controller.tk.get_action.return_value = MagicMock(return_value=datasets)
+
+        result = self.controller_instance.dataset_autocomplete()
+
+        controller.tk.get_action.assert_called_once_with(constants.DATAREQUEST_DATASET_AUTOCOMPLETE)
+        controller.tk.get_action.return_value.assert_called_once_with(self.expected_context, expected_data_dict)
+        self.assertEquals({'ResultSet': {'Result': datasets}}, json.loads(result))
+        self.assertEquals('application/json;charset=utf-8', controller.tk.response.headers['Content-Type'])
+
+    @parameterized.expand([
+        (controller.tk.ValidationError({'Limit': ['error']}), 400, '"limit" parameter is not valid'),
+        (controller.tk.ObjectNotFound('Not found'),          404, 'Organization org not found'),
+        (controller.tk.NotAuthorized('Not authorized'),      401, 'You are not authorized to look up datasets')
+    ])
+    def test_dataset_autocomplete_error(self, exception, expected_status, expected_msg):
+        controller.request.GET = {'incomplete': 'exam', 'organization_id': 'org'}
+        controller.tk.get_action.return_value.side_effect = exception
+
+        self.controller_instance.dataset_autocomplete()
+
+        controller.tk.abort.assert_called_once_with(expected_status, expected_msg)
+
+
+    ######################################################################
+    ############################### EXPORT ###############################
+    ######################################################################
+
+    @parameterized.expand([
+        ({},                                       'csv',   False),
+        ({'format': 'jsonl'},                      'jsonl', False),
+        ({'format': 'jsonl', 'comments': 'true'},  'jsonl', True),
+        ({'format': 'csv', 'comments': 'false'},   'csv',   False)
+    ])
+    def test_export(self, params, export_format, include_comments):
+        controller.request.GET = params
+        controller.tk.asbool = self._tk.asbool
+        controller.tk.response.headers = {}
+
+        result = self.controller_instance.export()
+
+        # The export is streamed
+        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_EXPORT, self.expected_context, {})
+        controller.export.export.assert_called_once_with(export_format, include_comments)
+        self.assertEquals(controller.export.export.return_value, result)
+        self.assertEquals(self._export.CONTENT_TYPES[export_format], controller.tk.response.headers['Content-Type'])
+        self.assertEquals('attachment; filename="datarequests.%s"' % export_format,
+                          controller.tk.response.headers['Content-Disposition'])
+        self.assertEquals(0, controller.tk.abort.call_count)
+
+    @parameterized.expand([
+        (False, 'csv', 403, 'You are not authorized to export the Data Requests'),
+        (True,  'xml', 400, '"format" parameter is not valid')
+    ])
+    def test_export_error(self, authorized, export_format, expected_status, expected_msg):
+        controller.request.GET = {'format': export_format}
+        if not authorized:
+            controller.tk.check_access.side_effect = controller.tk.NotAuthorized('User not authorized')
+
+        result = self.controller_instance.export()
+
+        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_EXPORT, self.expected_context, {})
+        controller.tk.abort.assert_called_once_with(expected_status, expected_msg)
+        self.assertEquals(0, controller.export.export.call_count)
+        self.assertIsNone(result)
+
+
     ######################################################################
     ############################### COMMENT ##############################
     ######################################################################
@@ -804,25 +1004,13 @@ class UIControllerTest(unittest.TestCase):
             }
 
         datarequest = {'id': 'uuid4', 'user_id': 'user_uuid4', 'title': 'example_title'}
+        # The HTML of the comments is rendered when they are stored
         comments_list = [
-            {'comment': 'Comment 1\nwith new line'},
-            {'comment': 'Commnet 2\nwith two\nnew lines'},
-            {'comment': 'Comment 3 with link https://fiware.org/some/path?param1=1&param2=2'},
-            {'comment': 'Comment 4 with two links https://fiware.org/some/path?param1=1&param2=2 and https://google.es'},
-            {'comment': 'Coment\nwith http://fiware.org\nhttp://fiware.eu'}
-        ]
-
-        expected_comment_list = [
-            {'comment': 'Comment 1<br/>with new line'},
-            {'comment': 'Commnet 2<br/>with two<br/>new lines'},
-            {'comment': 'Comment 3 with link <a href="https://fiware.org/some/path?param1=1&param2=2" target="_blank">'
-                        + 'https://fiware.org/some/path?param1=1&param2=2</a>'},
-            {'comment': 'Comment 4 with two links <a href="https://fiware.org/some/path?param1=1&param2=2" target="_blank">'
-                        + 'https://fiware.org/some/path?param1=1&param2=2</a> and <a href="https://google.es" '
-                        + 'target="_blank">https://google.es</a>'},
-            {'comment': 'Coment<br/>with <a href="http://fiware.org" target="_blank">http://fiware.org</a><br/><a '
-                        + 'href="http://fiware.eu" target="_blank">http://fiware.eu</a>'}
+            {'comment': 'Comment 1\nwith new line', 'comment_html': 'Comment 1<br/>with new line'},
+            {'comment': 'Comment 2 with link http://fiware.org',
+             'comment_html': 'Comment 2 with link <a href="http://fiware.org" target="_blank">http://fiware.org</a>'}
         ]
+        expected_comment_list = [dict(item) for item in comments_list]
 
         datarequest_show = MagicMock(return_value=datarequest)
         datarequest_comment_list = MagicMock(return_value=comments_list)
@@ -848,6 +1036,8 @@ class UIControllerTest(unittest.TestCase):
         # Verify comments and data request
         self.assertEquals(controller.c.datarequest, datarequest)
         self.assertEquals(controller.c.comments, expected_comment_list)
+        # The badge is rendered with the number of listed comments
+        self.assertEquals(len(comments_list), controller.c.datarequest['comments_count'])
 
         # Check calls
         datarequest_show.assert_called_once_with(self.expected_context, {'id': datarequest_id})
@@ -932,3 +1122,189 @@ class UIControllerTest(unittest.TestCase):
         self.assertEquals(302, controller.tk.response.status_int)
         self.assertEquals('/%s/comment/%s' % (constants.DATAREQUESTS_MAIN_PATH, datarequest_id),
                           controller.tk.response.location)
+
+
+    ######################################################################
+    ########################### CONDITIONAL GET ##########################
+    ######################################################################
+
+    def _init_conditional_get(self, headers={}, last_modified='2017-03-04T10:11:12.000013', method='GET'):
+        controller.request.method = method
+        controller.request.headers = headers
+        controller.request.GET = controller.request.params = {}
+        controller.request.POST = {}
+        controller.helpers.are_there_flash_messages.return_value = False
+        controller.helpers.lang.return_value = 'en'
+        controller.c.user = self.expected_context['user'] = 'example_user'
+        controller.tk.response.headers = {}
+        controller.tk.response.status_int = 200
+        controller.tk.render.reset_mock()
+
+        datarequest_last_modified = MagicMock(return_value={'count': 1, 'last_modified': last_modified})
+        actions = {constants.DATAREQUEST_LAST_MODIFIED: datarequest_last_modified}
+        controller.tk.get_action.side_effect = lambda action: actions.setdefault(action, MagicMock())
+
+        return actions
+
+    def _get_validators(self, function, *args):
+        self._init_conditional_get()
+        function(*args)
+        return controller.tk.response.headers
+
+    @parameterized.expand([
+        ('show', constants.DATAREQUEST_SHOW),
+        ('comment', constants.DATAREQUEST_SHOW)
+    ])
+    def test_datarequest_not_modified(self, func, rendered_action):
+        function = getattr(self.controller_instance, func)
+        etag = self._get_validators(function, 'dr_id')['ETag']
+        actions = self._init_conditional_get({'If-None-Match': '"other", %s' % etag})
+
+        result = function('dr_id')
+
+        self.assertEquals('', result)
+        self.assertEquals(304, controller.tk.response.status_int)
+        self.assertEquals(etag, controller.tk.response.headers['ETag'])
+        actions[constants.DATAREQUEST_LAST_MODIFIED].assert_called_once_with(self.expected_context, {'id': 'dr_id'})
+        # The data request is not retrieved and the page is not rendered
+        self.assertNotIn(rendered_action, actions)
+        self.assertEquals(0, controller.tk.render.call_count)
+
+    @parameterized.expand([
+        ({'If-None-Match': 'W/"other"'},),
+        ({'If-Modified-Since': 'Sat, 04 Mar 2017 00:00:00 GMT'},),
+        # If-None-Match prevails over If-Modified-Since
+        ({'If-None-Match': 'W/"other"', 'If-Modified-Since': 'Sat, 04 Mar 2037 00:00:00 GMT'},),
+        # The page has to be generated to show the flash messages
+        ({'If-None-Match': '*'}, True),
+        ({'If-None-Match': '*'}, False, 'POST')
+    ])
+    def test_datarequest_modified(self, headers, flash_messages=False, method='GET'):
+        actions = self._init_conditional_get(headers, method=method)
+        controller.helpers.are_there_flash_messages.return_value = flash_messages
+
+        result = self.controller_instance.show('dr_id')
+
+        self.assertEquals(controller.tk.render.return_value, result)
+        self.assertEquals(200, controller.tk.response.status_int)
+        actions[constants.DATAREQUEST_SHOW].assert_called_once_with(self.expected_context, {'id': 'dr_id'})
+
+        if method == 'GET' and not flash_messages:
+            self.assertTrue(controller.tk.response.headers['ETag'].startswith('W/"'))
+            self.assertIn('Last-Modified', controller.tk.response.headers)
+
+    def test_datarequest_not_modified_since(self):
+        last_modified = self._get_validators(self.controller_instance.show, 'dr_id')['Last-Modified']
+        actions = self._init_conditional_get({'If-Modified-Since': last_modified})
+
+        result = self.controller_instance.show('dr_id')
+
+        self.assertEquals('', result)
+        self.assertEquals(304, controller.tk.response.status_int)
+        self.assertNotIn(constants.DATAREQUEST_SHOW, actions)
+
+    def test_datarequest_etag_depends_on_user(self):
+        etag = self._get_validators(self.controller_instance.show, 'dr_id')['ETag']
+        actions = self._init_conditional_get({'If-None-Match': etag})
+        controller.c.user = 'other_user'
+
+        self.controller_instance.show('dr_id')
+
+        self.assertEquals(200, controller.tk.response.status_int)
+        self.assertNotEquals(etag, controller.tk.response.headers['ETag'])
+        self.assertIn(constants.DATAREQUEST_SHOW, actions)
+
+    @parameterized.expand([
+        (INDEX_FUNCTION, ()),
+        (ORGANIZATION_DATAREQUESTS_FUNCTION, ('conwet',)),
+        (USER_DATAREQUESTS_FUNCTION, ('ckan',))
+    ])
+    def test_index_not_modified(self, func, args):
+        function = getattr(self.controller_instance, func)
+        headers = self._get_validators(function, *args)
+        # Lists do not include Last-Modified: it does not change when data requests are deleted
+        self.assertNotIn('Last-Modified', headers)
+
+        actions = self._init_conditional_get({'If-None-Match': headers['ETag']})
+        result = function(*args)
+
+        self.assertEquals('', result)
+        self.assertEquals(304, controller.tk.response.status_int)
+        expected_data_dict = actions[constants.DATAREQUEST_LAST_MODIFIED].call_args[0][1]
+        self.assertEquals(constants.DataRequestState.visible.name, expected_data_dict['visibility'])
+        for action in (constants.DATAREQUEST_INDEX, 'organization_show', 'user_show'):
+            self.assertNotIn(action, actions)
+        self.assertEquals(0, controller.tk.render.call_count)
+
+    def test_index_modified(self):
+        etag = self._get_validators(self.controller_instance.index)['ETag']
+        actions = self._init_conditional_get({'If-None-Match': etag}, last_modified='2017-03-04T10:11:13')
+
+        self.controller_instance.index()
+
+        self.assertEquals(200, controller.tk.response.status_int)
+        self.assertNotEquals(etag, controller.tk.response.headers['ETag'])
+        self.assertIn(constants.DATAREQUEST_INDEX, actions)
+        controller.tk.render.assert_called_with('datarequests/index.html')
+
+
+    ######################################################################
+    ############################# PAGES CACHE ############################
+    ######################################################################
+
+    def _init_pages_cache(self, cached_page=None, user=''):
+        actions = self._init_conditional_get()
+        controller.c.user = self.expected_context['user'] = user
+        controller.request.path_qs = '/datarequest?page=2'
+        pages_cache = controller.cache.get_pages_cache.return_value = MagicMock()
+        pages_cache.get.return_value = cached_page
+        return actions, pages_cache
+
+    @parameterized.expand([
+        ('show', ('dr_id',), ('dr_id',)),
+        (INDEX_FUNCTION, (), (cache.LIST_PAGES,)),
+        (ORGANIZATION_DATAREQUESTS_FUNCTION, ('conwet',), (cache.LIST_PAGES,)),
+        (USER_DATAREQUESTS_FUNCTION, ('ckan',), (cache.LIST_PAGES,))
+    ])
+    def test_cached_page(self, func, args, scopes):
+        actions, pages_cache = self._init_pages_cache('cached page')
+
+        result = getattr(self.controller_instance, func)(*args)
+
+        self.assertEquals('cached page', result)
+        pages_cache.get.assert_called_once_with(u'/datarequest?page=2|en', (cache.ALL_PAGES,) + scopes)
+        self.assertEquals(0, pages_cache.set.call_count)
+        for action in (constants.DATAREQUEST_SHOW, constants.DATAREQUEST_INDEX, 'organization_show', 'user_show'):
+            self.assertNotIn(action, actions)
+        self.assertEquals(0, controller.tk.render.call_count)
+
+    @parameterized.expand([
+        ('show', ('dr_id',), ('dr_id',), constants.DATAREQUEST_SHOW),
+        (INDEX_FUNCTION, (), (cache.LIST_PAGES,), constants.DATAREQUEST_INDEX)
+    ])
+    def test_page_cached(self, func, args, scopes, action):
+        actions, pages_cache = self._init_pages_cache()
+
+        result = getattr(self.controller_instance, func)(*args)
+
+        self.assertEquals(controller.tk.render.return_value, result)
+        self.assertIn(action, actions)
+        pages_cache.set.assert_called_once_with(u'/datarequest?page=2|en', (cache.ALL_PAGES,) + scopes,
+                                                controller.tk.render.return_value)
+
+    @parameterized.expand([
+        ('example_user', 'GET', False),
+        ('',             'POST', False),
+        ('',             'GET', True)
+    ])
+    def test_page_not_cached(self, user, method, flash_messages):
+        actions, pages_cache = self._init_pages_cache('cached page', user)
+        controller.request.method = method
+        controller.helpers.are_there_flash_messages.return_value = flash_messages
+
+        result = self.controller_instance.show('dr_id')
+
+        self.assertEquals(controller.tk.render.return_value, result)
+        self.assertIn(constants.DATAREQUEST_SHOW, actions)
+        self.assertEquals(0, pages_cache.get.call_count)
+        self.assertEquals(0, pages_cache.set.call_count)
@@ -49,6 +49,7 @@ class ValidatorTest(unittest.TestCase):
         self._db = validator.db
         validator.db = MagicMock()
         validator.db.DataRequest.datarequest_exists.return_value = False
+        validator.db.has_unique_title_index.return_value = False
 
     def tearDown(self):
         validator.tk = self._tk
@@ -69,6 +70,13 @@ class ValidatorTest(unittest.TestCase):
         else:
             validator.db.DataRequest.datarequest_exists.assert_called_once_with(self.request_data['title'])
 
+    def test_validate_unique_title_index(self):
+        # Repeated titles are rejected by the data base
+        validator.db.has_unique_title_index.return_value = True
+        validator.db.DataRequest.datarequest_exists.return_value = True
+        self.assertIsNone(validator.validate_datarequest({}, self.request_data))
+        self.assertEquals(0, validator.db.DataRequest.datarequest_exists.call_count)
+
     @parameterized.expand([
         ('Title', generate_string(validator.constants.NAME_MAX_LENGTH + 1), False,
             'Title must be a maximum of %d characters long' % validator.constants.NAME_MAX_LENGTH),
@@ -107,6 +115,84 @@ class ValidatorTest(unittest.TestCase):
         self.assertIsNone(validator.validate_datarequest(context, self.request_data))
         self.assertEquals(0, validator.tk.get_validator.call_count)
 
+    def _init_batch(self, existing_titles=(), existing_organizations=()):
+        context = {'model': MagicMock(), 'session': MagicMock()}
+        validator.db.DataRequest.get_existing_titles.return_value = set(existing_titles)
+        query = context['session'].query.return_value.filter
+        query.return_value = [(organization_id,) for organization_id in existing_organizations]
+        return context
+
+    def test_validate_datarequests_valid(self):
+        context = self._init_batch(existing_organizations=['uuid-example'])
+        other_request_data = {'title': 'Other Title', 'description': 'Other description', 'organization_id': ''}
+
+        result = validator.validate_datarequests(context, [self.request_data, other_request_data])
+
+        self.assertEquals([{}, {}], result)
+        # The titles and the organizations are checked once for the whole batch
+        validator.db.DataRequest.get_existing_titles.assert_called_once_with(['Example Title', 'Other Title'])
+        context['session'].query.assert_called_once_with(context['model'].Group.id)
+        context['model'].Group.id.in_.assert_called_once_with(set(['uuid-example']))
+        self.assertEquals(0, validator.tk.get_validator.call_count)
+
+    def test_validate_datarequests_invalid(self):
+        context = self._init_batch(existing_titles=['taken title'], existing_organizations=['uuid-example'])
+        batch = [
+            {'title': '', 'description': 'Description', 'organization_id': ''},
+            {'title': 'Taken Title', 'description': '', 'organization_id': 'uuid-example'},
+            {'title': 'Example Title', 'description': 'Description', 'organization_id': 'invalid'},
+            {'title': 'EXAMPLE TITLE', 'description': 'Description', 'organization_id': ''},
+            {'title': 'Valid Title', 'description': generate_string(validator.constants.DESCRIPTION_MAX_LENGTH + 1),
+             'organization_id': ''}
+        ]
+
+        result = validator.validate_datarequests(context, batch)
+
+        self.assertEquals([
+            {'Title': ['Title cannot be empty']},
+            {'Title': ['That title is already in use'], 'Description': ['Description cannot be empty']},
+            {'Organization': ['Organization is not valid']},
+            # Titles repeated in the batch are also rejected
+            {'Title': ['That title is already in use']},
+            {'Description': ['Description must be a maximum of %d characters long' %
+                             validator.constants.DESCRIPTION_MAX_LENGTH]}
+        ], result)
+        # Only valid titles are looked up in the data base
+        validator.db.DataRequest.get_existing_titles.assert_called_once_with(
+            ['Taken Title', 'Example Title', 'EXAMPLE TITLE', 'Valid Title'])
+
+    def test_validate_datarequests_invalid_types(self):
+        context = self._init_batch(existing_organizations=['uuid-example'])
+        batch = [
+            {'title': 5, 'description': 'Description', 'organization_id': ''},
+            {'title': 'Title', 'description': ['Description'], 'organization_id': {'id': 'uuid-example'}},
+            {'title': u'Valid Title', 'description': u'Description', 'organization_id': u'uuid-example'},
+            {'title': u'No Organization', 'description': u'Description', 'organization_id': None}
+        ]
+
+        result = validator.validate_datarequests(context, batch)
+
+        # Only the data requests with fields of other types are rejected (data requests
+        # without organization have no organization_id)
+        self.assertEquals([
+            {'Title': ['Title must be a string']},
+            {'Description': ['Description must be a string'], 'Organization': ['Organization must be a string']},
+            {},
+            {}
+        ], result)
+        validator.db.DataRequest.get_existing_titles.assert_called_once_with(
+            ['Title', u'Valid Title', u'No Organization'])
+        context['model'].Group.id.in_.assert_called_once_with(set(['uuid-example']))
+
+    def test_validate_datarequests_avoid_existing_title_check(self):
+        context = self._init_batch(existing_titles=['example title'])
+        context['avoid_existing_title_check'] = True
+        self.request_data['organization_id'] = ''
+
+        self.assertEquals([{}], validator.validate_datarequests(context, [self.request_data]))
+        self.assertEquals(0, validator.db.DataRequest.get_existing_titles.call_count)
+        self.assertEquals(0, context['session'].query.call_count)
+
     def test_close_invalid_accepted_dataset(self):
         context = {}
         accepted_ds_id = 'accepted_ds_uuidv4'
@@ -22,31 +22,40 @@ import ckan.plugins.toolkit as tk
 import ckanext.datarequests.db as db
 
 
-def validate_datarequest(context, request_data):
-
-    errors = {}
-
-    # Check name
+def _check_title(request_data, errors):
     if len(request_data['title']) > constants.NAME_MAX_LENGTH:
         errors['Title'] = [tk._('Title must be a maximum of %d characters long') % constants.NAME_MAX_LENGTH]
 
     if not request_data['title']:
         errors['Title'] = [tk._('Title cannot be empty')]
 
-    # Title is only checked in the database when it's correct
-    avoid_existing_title_check = context['avoid_existing_title_check'] if 'avoid_existing_title_check' in context else False
-
-    if 'Title' not in errors and not avoid_existing_title_check:
-        if db.DataRequest.datarequest_exists(request_data['title']):
-            errors['Title'] = ['That title is already in use']
 
-    # Check description
+def _check_description(request_data, errors):
     if not request_data['description']:
         errors['Description'] = [tk._('Description cannot be empty')]
 
     if len(request_data['description']) > constants.DESCRIPTION_MAX_LENGTH:
         errors['Description'] = [tk._('Description must be a maximum of %d characters long') % constants.DESCRIPTION_MAX_LENGTH]
 
+
+def validate_datarequest(context, request_data):
+
+    errors = {}
+
+    # Check name
+    _check_title(request_data, errors)
+
+    # Title is only checked in the database when it's correct. Repeated titles are
+    # rejected when the data request is stored if the unique title index exists
+    avoid_existing_title_check = context['avoid_existing_title_check'] if 'avoid_existing_title_check' in context else False
+
+    if 'Title' not in errors and not avoid_existing_title_check and not db.has_unique_title_index():
+        if db.DataRequest.datarequest_exists(request_data['title']):
+            errors['Title'] = ['That title is already in use']
+
+    # Check description
+    _check_description(request_data, errors)
+
     # Check organization
     if request_data['organization_id']:
         try:
@@ -58,6 +67,64 @@ def validate_datarequest(context, request_data):
         raise tk.ValidationError(errors)
 
 
+def validate_datarequests(context, datarequests):
+    '''
+    Validates a batch of data requests. The titles are checked with a single
+    query (titles repeated in the batch are also rejected) and the organizations
+    are resolved once. Returns a list with the errors of every data request (an
+    empty dict when the data request is valid).
+    '''
+    batch_errors = []
+
+    for request_data in datarequests:
+        errors = {}
+        # The batch comes from other systems: fields of other types are reported as
+        # errors of the data request instead of failing the whole batch. Data requests
+        # without organization have no organization_id
+        for field, name in (('title', 'Title'), ('description', 'Description'), ('organization_id', 'Organization')):
+            if not isinstance(request_data[field], basestring) and not (field == 'organization_id' and
+                                                                       request_data[field] is None):
+                errors[name] = [tk._('%s must be a string') % name]
+
+        if 'Title' not in errors:
+            _check_title(request_data, errors)
+        if 'Description' not in errors:
+            _check_description(request_data, errors)
+        batch_errors.append(errors)
+
+    # Check titles
+    avoid_existing_title_check = context['avoid_existing_title_check'] if 'avoid_existing_title_check' in context else False
+    titles = [request_data['title'] for request_data, datarequest_errors in zip(datarequests, batch_errors)
+              if 'Title' not in datarequest_errors]
+    existing_titles = set() if avoid_existing_title_check else db.DataRequest.get_existing_titles(titles)
+    batch_titles = set()
+
+    for request_data, datarequest_errors in zip(datarequests, batch_errors):
+        if 'Title' not in datarequest_errors:
+            title = request_data['title'].lower()
+            if title in existing_titles or title in batch_titles:
+                datarequest_errors['Title'] = ['That title is already in use']
+            batch_titles.add(title)
+
+    # Check organizations (same check as the group_id_exists validator)
+    organizations_ids = set(request_data['organization_id']
+                            for request_data, datarequest_errors in zip(datarequests, batch_errors)
+                            if request_data['organization_id'] and 'Organization' not in datarequest_errors)
+    existing_organizations = set()
+
+    if organizations_ids:
+        model = context['model']
+        query = context['session'].query(model.Group.id).filter(model.Group.id.in_(organizations_ids))
+        existing_organizations = set(organization_id for organization_id, in query)
+
+    for request_data, datarequest_errors in zip(datarequests, batch_errors):
+        if 'Organization' not in datarequest_errors and request_data['organization_id'] and \
+                request_data['organization_id'] not in existing_organizations:
+            datarequest_errors['Organization'] = ['Organization is not valid']
+
+    return batch_errors
+
+
 def validate_datarequest_closing(context, request_data):
 
     accepted_dataset_id = request_data.get('accepted_dataset_id', '')
@@ -56,5 +56,8 @@ setup(
         # Add plugins here, e.g.
         # myplugin=ckanext.datarequests.plugin:PluginClass
         datarequests=ckanext.datarequests.plugin:DataRequestsPlugin
+
+        [paste.paster_command]
+        datarequests=ckanext.datarequests.commands:DataRequestsCommand
     ''',
 )